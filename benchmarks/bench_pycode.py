@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+bench_pycode.py
+
+Benchmarks of pycode over standard library modules and generated
+synthetic packages: deep class hierarchies, thousands of functions,
+huge docstrings.
+
+Each case runs in its own worker process, so imports and peak memory
+of one case do not affect the others. Results can be saved and compared
+with results of a previous run to detect performance regressions.
+
+    python benchmarks/bench_pycode.py [-q] [-r <repeat>] [-s <file>] [-c <file>]
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pycode
+
+STDLIB_MODULES = ('os', 'json', 'inspect', 'logging', 'collections', 'pydoc')
+
+SYNTHETIC_MODULES = ('bench_deep_mro', 'bench_many_funcs', 'bench_huge_docs')
+
+ENGINES = ('inspect', 'ast')
+
+# ------------------------------------------------
+# Synthetic packages
+# ------------------------------------------------
+
+def make_deep_mro(depth=200, methods=5):
+    ''' returns source of module with a chain of classes depth levels deep '''
+    lines = ['class Base0(object):', '    """ Base0 """']
+    for i in range(1, depth):
+        lines.append('class Base%d(Base%d):' % (i, i - 1))
+        lines.append('    """ Base%d """' % i)
+        for j in range(methods):
+            lines.append('    def method_%d_%d(self, a, b=%d):' % (i, j, j))
+            lines.append('        """ Base%d.method_%d_%d() """' % (i, i, j))
+    return '\n'.join(lines) + '\n'
+
+def make_many_funcs(count=5000):
+    ''' returns source of module with count functions and data items '''
+    lines = list()
+    for i in range(count):
+        lines.append('def func_%d(a, b=None, *args, **kwargs):' % i)
+        lines.append('    """ func_%d() """' % i)
+        lines.append('DATA_%d = %d' % (i, i))
+    return '\n'.join(lines) + '\n'
+
+def make_huge_docs(count=200, size=100000):
+    ''' returns source of module with count functions and classes
+    having docstrings of size bytes '''
+    doc = ('Lorem ipsum dolor sit amet. ' * (size // 28 + 1))[:size]
+    lines = list()
+    for i in range(count):
+        lines.append('def func_%d():' % i)
+        lines.append('    """%s"""' % doc)
+        lines.append('class Class_%d(object):' % i)
+        lines.append('    """%s"""' % doc)
+    return '\n'.join(lines) + '\n'
+
+def make_synthetic(path, quick=False):
+    ''' write synthetic modules to path '''
+    scale = quick and 10 or 1
+    sources = {
+        'bench_deep_mro': make_deep_mro(200 // scale),
+        'bench_many_funcs': make_many_funcs(5000 // scale),
+        'bench_huge_docs': make_huge_docs(200 // scale),
+    }
+    for name, source in sources.items():
+        with open(os.path.join(path, name + '.py'), 'w') as file:
+            file.write(source)
+
+# ------------------------------------------------
+# Cases
+# ------------------------------------------------
+
+def maxrss():
+    ''' returns peak resident memory of the process, in KB '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def evict(names):
+    ''' remove modules from sys.modules, so that they are imported again '''
+    for name in names:
+        sys.modules.pop(name, None)
+
+def run_case(args):
+    ''' run a benchmark case, in a worker process
+
+    Phases are timed by pycode.Profiler: the analysis ('struct') and its
+    phases ('import', 'parse', 'getmembers', ...), JSON output ('json') and
+    dict2flat() ('dict2flat'), the best of repeat runs. The module, its
+    submodules and modules imported by the previous run are removed from
+    sys.modules before each run, so that 'import' times a real import.
+    '''
+    thing, engine, repeat, path = args
+    sys.path.insert(0, path)
+
+    phases = dict()
+    imported = set(name for name in sys.modules
+                    if name == thing or name.startswith(thing + '.'))
+    for i in range(repeat):
+        evict(imported)
+        pycode.STRUCT_MEMO.clear()
+        loaded = set(sys.modules)
+        profiler = pycode.Profiler()
+        result = profiler.call('struct', None, pycode.struct_code, thing, engine, None, profiler)
+        imported |= set(sys.modules) - loaded
+        output = profiler.call('json', None, pycode.dumpjson, result)
+        profiler.call('dict2flat', None, pycode.dict2flat, '', result)
+
+        for phase, (count, elapsed) in profiler.phases.items():
+            phases[phase] = min(phases.get(phase, elapsed), elapsed)
+
+    return {
+        'name': thing,
+        'engine': engine,
+        'phases': phases,
+        # analysis phases are part of 'struct'
+        'total': phases['struct'] + phases['json'] + phases['dict2flat'],
+        'maxrss': maxrss(),
+        'size': len(output),
+    }
+
+def run_cli(thing, engine, path):
+    ''' returns wall time of command line run '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([path, env.get('PYTHONPATH', '')])
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'pycode.py'),
+                                '-e', engine, thing], stdout=devnull, env=env)
+    return time.time() - start
+
+def run(quick=False, repeat=1):
+    ''' run all benchmark cases, returns results '''
+    path = tempfile.mkdtemp(prefix='pycode-bench-')
+    try:
+        make_synthetic(path, quick)
+        modules = quick and STDLIB_MODULES[:2] or STDLIB_MODULES
+        cases = [(thing, engine, repeat, path)
+                    for thing in modules + SYNTHETIC_MODULES for engine in ENGINES]
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            results = pool.map(run_case, cases, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            result['cli'] = run_cli(result['name'], result['engine'], path)
+    finally:
+        shutil.rmtree(path)
+    return {
+        'version': pycode.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': quick,
+        'results': results,
+    }
+
+# ------------------------------------------------
+# Reports
+# ------------------------------------------------
+
+def report(run, baseline=None, threshold=1.2):
+    ''' print results, compared with baseline if given.
+    returns number of regressions '''
+    old = dict()
+    if baseline:
+        old = dict(((r['name'], r['engine']), r) for r in baseline['results'])
+    print '%-20s %-8s %8s %8s %8s %8s %8s %8s %8s %10s %10s' % (
+        'name', 'engine', 'import', 'parse', 'struct', 'json', 'flat', 'total', 'cli',
+        'maxrss,KB', 'size')
+    regressions = 0
+    for r in run['results']:
+        p = r['phases']
+        line = '%-20s %-8s %8.4f %8.4f %8.4f %8.4f %8.4f %8.4f %8.4f %10d %10d' % (
+            r['name'], r['engine'], p.get('import', 0.0), p.get('parse', 0.0), p['struct'],
+            p['json'], p['dict2flat'], r['total'], r['cli'], r['maxrss'], r['size'])
+        prev = old.get((r['name'], r['engine']))
+        if prev:
+            ratio = r['total'] / max(prev['total'], 1e-6)
+            line += '  x%.2f' % ratio
+            if ratio > threshold:
+                line += ' REGRESSION'
+                regressions += 1
+        print line
+    return regressions
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'qr:s:c:t:')
+    quick, repeat, save, compare, threshold = False, 1, None, None, 1.2
+    for opt, val in opts:
+        if opt == '-q': quick = True
+        if opt == '-r': repeat = int(val)
+        if opt == '-s': save = val
+        if opt == '-c': compare = val
+        if opt == '-t': threshold = float(val)
+
+    baseline = None
+    if compare:
+        with open(compare) as file:
+            baseline = json.load(file)
+    results = run(quick, repeat)
+    regressions = report(results, baseline, threshold)
+    if save:
+        with open(save, 'w') as file:
+            json.dump(results, file, indent=2)
+    sys.exit(regressions and 1 or 0)
+
+if __name__ == '__main__':
+    main()
@@ -9,15 +9,17 @@ Based on module pydoc from standard python library
 '''
 
 __author__ = 'Andrey Usov <https://github.com/ownport/pycode>'
-__version__ = '0.2'
+__version__ = '0.3'
 
 import os
 import re
 import sys
-import json
+import ast
+import struct
+import time
 import types
-import pprint
-import inspect
+import thread
+import collections
 
 from traceback import extract_tb
 
@@ -45,22 +47,534 @@ class ErrorDuringImport(Exception):
             exc = exc.__name__
         return 'problem in %s - %s: %s' % (self.filename, exc, self.value)
 
+class WorkerError(Exception):
+    """A worker process was stopped or died while analyzing a module."""
+
+class CancelledError(Exception):
+    """The request was cancelled before it was done."""
+
+class TimeoutError(Exception):
+    """The request was not done in time."""
+
 # ------------------------------------------------
 # Classes
 # ------------------------------------------------
+class _LazyModule(object):
+    ''' placeholder of a module in the globals of pycode, importing the
+    module on first access to its attributes and replacing itself by it '''
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = __import__(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+# imported on first use, it takes longer to import than pycode itself
+inspect = _LazyModule('inspect')
+
 class _OldStyleClass: pass
 _OLD_INSTANCE_TYPE = type(_OldStyleClass())
 
+# first bytes of files written by BinaryWriter
+BINARY_MAGIC = 'PYCODE\x00\x01'
+
+# first bytes of files written by DumpWriter, and the header which follows
+DUMP_MAGIC = 'PYCODE\x00\x02'
+_DUMP_HEADER = struct.Struct('<10Q')
+
+# types of modules, as described by describe()
+_MODULE_TYPES = ('module', 'package', 'built-in module')
+
+# archives of modules, analyzed without extracting them, see archivesources()
+_ARCHIVE_SUFFIXES = ('.whl', '.egg', '.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+
+# members of modules and classes, the levels of code structure tree
+_MODULE_MEMBERS = ('classes', 'funcs', 'data')
+_CLASS_MEMBERS = ('class_attrs', 'inherited attrs')
+
+# fields of structures holding docs and class names, see sharestrings()
+_SHARED_FIELDS = ('doc', 'note', 'belongs_to', 'bases', 'direct_bases')
+
+# blank first line of docs, removed by getdoc()
+_LEADING_BLANK_LINE = re.compile('^ *\n')
+
+# definitions of classes and functions, as searched by inspect.findsource()
+_CLASS_HEAD = re.compile(r'(\s*)class\s*(\w+)')
+_FUNCTION_HEAD = re.compile(r'^(\s*def\s)|(.*(?<!\w)lambda(:|\s))|^(\s*@)')
+
+# characters escaped by likepattern()
+_LIKE_SPECIAL = re.compile(r'([%_\\])')
+
+# value of fields missing from structure nodes, see StructNode
+_UNSET = object()
+
+
+class LRUCache(object):
+    ''' mapping of limited size, discarding least recently used items
+
+    Safe to share by threads, e.g. STRUCT_MEMO by threads of StructExecutor.
+    '''
+
+    def __init__(self, maxsize=4096):
+
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = thread.allocate_lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        self._lock.acquire()
+        try:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            return self._items.pop(key, default)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LazyStruct(collections.Mapping):
+    ''' code structure with members computed on first access
+
+    fields are known structure fields, the ones named by keys are loaded
+    together, by loader(), when one of them is accessed. Iteration loads all
+    fields. See expandstruct() for partial serialization.
+    '''
+
+    def __init__(self, fields, keys, loader):
+        self.fields = dict(fields)
+        self.lazykeys = tuple(keys)
+        self._loader = loader
+
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            self.fields.update(loader())
+
+    def __getitem__(self, key):
+        if key not in self.fields and key in self.lazykeys:
+            self.load()
+        return self.fields[key]
+
+    def __iter__(self):
+        self.load()
+        return iter(self.fields)
+
+    def __len__(self):
+        self.load()
+        return len(self.fields)
+
+    def __repr__(self):
+        return '<LazyStruct %r%s>' % (self.fields, not self.loaded and ' ...' or '')
+
+
+class StringTable(object):
+    ''' table of unique strings, referenced by their ids, the positions
+    in the table '''
+
+    def __init__(self):
+        self.ids = dict()
+        self.texts = []
+
+    def intern(self, text):
+        ''' returns the string of the table equal to text, adding text if
+        there is no such string '''
+        return self.texts[self.index(text)]
+
+    def index(self, text):
+        ''' returns the id of text, adding it to the table if needed '''
+        index = self.ids.get(text)
+        if index is None:
+            index = self.ids[text] = len(self.texts)
+            self.texts.append(text)
+        return index
+
+    def __getitem__(self, index):
+        return self.texts[index]
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class SourceComments(object):
+    ''' comments of a source file, found in one pass over its lines: the
+    block at the top of the file and the blocks right above definitions,
+    the same as inspect.getcomments() finds them for each object '''
+
+    def __init__(self, lines):
+
+        self.lines = lines
+        self.module = None
+        self.classes = dict()   # name -> (indent, line number) of its definition
+        self.blocks = dict()    # line number after a block -> (indent, comments)
+
+        start = 1 if lines and lines[0][:2] == '#!' else 0
+        while start < len(lines) and lines[start].strip() in ('', '#'):
+            start += 1
+        end = start
+        while end < len(lines) and lines[end][:1] == '#':
+            end += 1
+        if end > start:
+            self.module = ''.join(line.expandtabs() for line in lines[start:end])
+
+        block, indent = [], None
+        for lnum, line in enumerate(lines):
+            if line.lstrip()[:1] == '#':
+                size = inspect.indentsize(line)
+                if size != indent:
+                    block, indent = [], size
+                block.append(line.expandtabs().lstrip())
+                continue
+            if block:
+                self.blocks[lnum] = (indent, block)
+                block, indent = [], None
+            match = _CLASS_HEAD.match(line)
+            if match:
+                head = (match.group(1), lnum)
+                name = match.group(2)
+                if self.classes.get(name, head) >= head:
+                    self.classes[name] = head
+
+    def classline(self, name):
+        ''' returns the line number of the definition of a class or None '''
+        head = self.classes.get(name)
+        return head and head[1]
+
+    def codeline(self, firstlineno):
+        ''' returns the line number of the definition of a function, given
+        the first line number of its code '''
+        lnum = min(firstlineno, len(self.lines)) - 1
+        while lnum > 0 and not _FUNCTION_HEAD.match(self.lines[lnum]):
+            lnum -= 1
+        return lnum
+
+    def above(self, lnum):
+        ''' returns the comments right above a line at its indentation or None '''
+        indent, block = self.blocks.get(lnum, (None, None))
+        if block is None or indent != inspect.indentsize(self.lines[lnum]):
+            return None
+        start, end = 0, len(block)
+        while start < end and block[start].strip() == '#':
+            start += 1
+        while start < end and block[end - 1].strip() == '#':
+            end -= 1
+        return ''.join(block[start:end])
+
+
+class StructNode(object):
+    ''' code structure of an analyzed object, a mapping of its fields
+
+    Subclasses name their fields, values are kept in slots instead of a dict
+    per node. Fields which are not set are missing from the mapping, so a
+    node is equal to the dict of its fields. Nodes are converted to dicts at
+    the edge, see todict() and dumpjson().
+    '''
+
+    __slots__ = ()
+    fields = ()
+    _slots = {}
+    _fieldslots = ()
+
+    def __init__(self, fields=()):
+        self.update(fields)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._slots[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._slots:
+            raise KeyError(key)
+        setattr(self, self._slots[key], value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self._slots[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._slots and hasattr(self, self._slots[key])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        if key in self._slots:
+            return getattr(self, self._slots[key], default)
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, fields=()):
+        if hasattr(fields, 'keys'):
+            fields = [(key, fields[key]) for key in fields.keys()]
+        for key, value in fields:
+            self[key] = value
+
+    def items(self):
+        items = []
+        for key, slot in self._fieldslots:
+            value = getattr(self, slot, _UNSET)
+            if value is not _UNSET:
+                items.append((key, value))
+        return items
+
+    def keys(self):
+        return [key for key, value in self.items()]
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def copy(self):
+        ''' returns a shallow copy of the node '''
+        return type(self)(self.items())
+
+    def todict(self):
+        ''' returns a dict of fields, nested nodes are not converted '''
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.Mapping):
+            return NotImplemented
+        return self.todict() == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.todict()
+
+    def __setstate__(self, state):
+        self.update(state)
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.todict())
+
+collections.MutableMapping.register(StructNode)
+
+
+def _nodeslots(fields):
+    ''' returns slot names of node fields '''
+    return tuple(field.replace(' ', '_') for field in fields)
+
+
+class ModuleNode(StructNode):
+    ''' structure of a module: its members and related modules '''
+
+    fields = _MODULE_MEMBERS + ('doc_location', 'packages', 'modules', 'submodules')
+    __slots__ = _nodeslots(fields)
+    _slots = dict(zip(fields, __slots__))
+    _fieldslots = zip(fields, __slots__)
+
+
+class ClassNode(StructNode):
+    ''' structure of a class '''
+
+    fields = ('type', 'name', 'decl', 'doc', 'bases', 'direct_bases') + _CLASS_MEMBERS + ('belongs_to',)
+    __slots__ = _nodeslots(fields)
+    _slots = dict(zip(fields, __slots__))
+    _fieldslots = zip(fields, __slots__)
+
+
+class RoutineNode(StructNode):
+    ''' structure of a function or method '''
+
+    fields = ('type', 'name', 'decl', 'doc', 'note', 'belongs_to')
+    __slots__ = _nodeslots(fields)
+    _slots = dict(zip(fields, __slots__))
+    _fieldslots = zip(fields, __slots__)
+
+
+class DataNode(StructNode):
+    ''' structure of a data descriptor, property or other attribute '''
+
+    fields = ('type', 'name', 'doc', 'belongs_to')
+    __slots__ = _nodeslots(fields)
+    _slots = dict(zip(fields, __slots__))
+    _fieldslots = zip(fields, __slots__)
+
+
+# structures of classes, routines and descriptors, shared by PyCodeStruct
+# instances of the process
+STRUCT_MEMO = LRUCache()
+
+
+class Profiler(object):
+    ''' collects timings of analysis phases and of analyzed objects
+
+    Phases ('import', 'parse', 'getmembers', 'classify', 'getdoc',
+    'getargspec', 'serialize') are counted and timed in total, analyzed
+    objects ('module', 'class') one by one, by name. If given,
+    callback(event, name, elapsed) is called for every timing, name is None
+    for phases.
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = dict()    # phase -> [count, total time]
+        self.objects = dict()   # kind -> {name: total time}
+
+    def record(self, event, name, elapsed):
+        if name is None:
+            counter = self.phases.setdefault(event, [0, 0.0])
+            counter[0] += 1
+            counter[1] += elapsed
+        else:
+            objects = self.objects.setdefault(event, dict())
+            objects[name] = objects.get(name, 0.0) + elapsed
+        if self.callback is not None:
+            self.callback(event, name, elapsed)
+
+    def call(self, event, name, func, *args):
+        ''' returns func(*args), timed '''
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.record(event, name, time.time() - start)
+
+    def iterate(self, event, name, items):
+        ''' generates items, timing the time spent to produce them '''
+        elapsed = 0.0
+        items = iter(items)
+        while True:
+            start = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.time() - start
+            yield item
+        self.record(event, name, elapsed)
+
+    def stats(self):
+        ''' returns collected timings as dict '''
+        return {'phases': self.phases, 'objects': self.objects}
+
+    def merge(self, stats):
+        ''' add timings collected by other profiler, see stats() '''
+        for phase, (count, elapsed) in stats['phases'].items():
+            counter = self.phases.setdefault(phase, [0, 0.0])
+            counter[0] += count
+            counter[1] += elapsed
+        for kind, objects in stats['objects'].items():
+            for name, elapsed in objects.items():
+                own = self.objects.setdefault(kind, dict())
+                own[name] = own.get(name, 0.0) + elapsed
+
+    def report(self, top=20, file=None):
+        ''' print phases and top slowest modules and classes '''
+        file = file or sys.stdout
+        file.write('%-12s %10s %10s\n' % ('phase', 'calls', 'time, s'))
+        for phase, (count, elapsed) in sorted(self.phases.items(), key=lambda p: -p[1][1]):
+            file.write('%-12s %10d %10.3f\n' % (phase, count, elapsed))
+        for kind in ('module', 'class'):
+            objects = sorted(self.objects.get(kind, {}).items(), key=lambda o: -o[1])[:top]
+            if objects:
+                file.write('\n%-60s %10s\n' % ('slowest %s' % kind, 'time, s'))
+                for name, elapsed in objects:
+                    file.write('%-60s %10.3f\n' % (name, elapsed))
+
 
 class PyCodeStruct(object):
-    ''' extract code structure '''
+    ''' extract code structure
+
+    Structures of classes, routines and descriptors are memoized by the
+    identity of analyzed objects in memo (LRUCache, STRUCT_MEMO by default),
+    so attributes inherited by many classes are described once. Memoized
+    structures are returned as shallow copies, nested items are shared.
+
+    If profiler (Profiler) is given, analysis phases, modules and classes
+    are timed. If lazy, members of modules and classes are analyzed on
+    first access, see LazyStruct. Docs and class names are interned in
+    strings (StringTable), so equal ones are stored once. Source files are
+    scanned for comments of undocumented objects once, see SourceComments.
+    '''
+
+    def __init__(self, memo=None, profiler=None, lazy=False, strings=None):
+        self.memo = STRUCT_MEMO if memo is None else memo
+        self.profiler = profiler
+        self.lazy = lazy
+        self.strings = StringTable() if strings is None else strings
+        self.sources = dict()
+
+    def _memoized(self, key, func, obj, *args):
+        ''' returns result of func(obj, *args), memoized by key, identity
+        of obj and args '''
+        key = (key, id(obj)) + args
+        entry = self.memo.get(key)
+        if entry is None or entry[0] is not obj:
+            entry = (obj, func(obj, *args))
+            self.memo.put(key, entry)
+        return entry[1]
 
     def _struct_descriptor(self, name, value, mod):
+        return self._memoized('descriptor', self._describe, value, name).copy()
+
+    def _describe(self, value, name):
     
-        result = dict()
-        result['type'], realname = describe(value)
-        result['name'] = name or realname
-        result['doc'] = getdoc(value) or ''
+        result = DataNode()
+        result.type, realname = describe(value)
+        result.name = name or realname
+        result.doc = self.getdoc(value)
         return result
 
     def struct(self, obj, name=None, *args):
@@ -81,88 +595,143 @@ class PyCodeStruct(object):
         if isinstance(obj, (bool, str, unicode, int, long, float, complex, tuple, list, dict)):
             return dict([(name, obj),])
         result = self._struct_descriptor(name, obj, mod)
-        if result and isinstance(result, dict):
-            cls_name = classname(cl, mod)
+        if result and isinstance(result, DataNode):
+            cls_name = self.classname(cl, mod)
             if cls_name:
-                result['belongs_to'] = cls_name
+                result.belongs_to = cls_name
+        return result
+
+    def struct_attr(self, attr, mod=None):
+        """Produce structure for a class attribute, as classified
+        by inspect.classify_class_attrs()."""
+
+        result = None
+        name, kind, homecls, value = attr
+        if kind in ('method', 'class method', 'static method'):
+            result = self.struct(value, name, mod, homecls)
+        elif kind in ('data', 'property'):
+            result = self.struct_data(value, name, mod, homecls)
+        if not result:
+            raise RuntimeError('Unknown attribute: {}'.format(attr))
+        if isinstance(result, (dict, StructNode)):
+            result['belongs_to'] = self.classname(homecls, mod)
         return result
 
     def struct_class(self, obj, name=None, mod=None, *ignored):
         """Produce structure for a given class object."""
-        
-        def spill(attrs):
-            # Data descriptors
-            # Other
-            result = None
-            name, kind, homecls, value = attr
-            if kind in ('method', 'class method', 'static method'):
-                result = self.struct(value, name, mod, homecls)
-            elif kind in ('data', 'property'):
-                result = self.struct_data(value, name, mod, homecls)
-            if not result:
-                raise RuntimeError('Unknown attribute: {}'.format(attr))
-            if isinstance(result, dict):
-                result['belongs_to'] = classname(homecls, mod)
-            return result
-        
-        result = dict()
-        result['type'], realname = describe(obj)
-        result['name'] = name or realname
+        if self.lazy:
+            return LazyStruct(self._class_head(obj, name), _CLASS_MEMBERS,
+                    lambda: self._memoized('class', self._struct_class, obj, name, mod))
+        return self._memoized('class', self._struct_class, obj, name, mod).copy()
+
+    def _struct_class(self, obj, name=None, mod=None):
+        return profiled(self.profiler, 'class', classname(obj, None),
+                        self._build_class, obj, name, mod)
+
+    def _class_head(self, obj, name=None):
+        """Produce structure for a given class object, without attributes."""
+
+        result = ClassNode()
+        result.type, realname = describe(obj)
+        result.name = name or realname
 
         if name and name <> realname:
-            result['decl'] = name + ' = class ' + realname
+            result.decl = name + ' = class ' + realname
  
-        result['doc'] = getdoc(obj)
+        result.doc = self.getdoc(obj)
 
         # List the mro, if non-trivial.
         mro = inspect.getmro(obj)
         if len(mro) > 1:
-            result['bases'] = map(lambda c, m=obj.__module__: classname(c,m), mro[1:])
+            result.bases = [self.classname(c, obj.__module__) for c in mro[1:]]
+        # bases of the class statement, unless the mro starts with the only one
+        if len(obj.__bases__) > 1:
+            result.direct_bases = [self.classname(c, obj.__module__) for c in obj.__bases__]
+        return result
 
+    def _build_class(self, obj, name=None, mod=None):
+        
+        def spill(attr):
+            return self.struct_attr(attr, mod)
+        
+        result = self._class_head(obj, name)
         attrs = filter(lambda data: visiblename(data[0], obj=obj),
-                       inspect.classify_class_attrs(obj))
+                       profiled(self.profiler, 'classify', None,
+                                inspect.classify_class_attrs, obj))
         
-        obj_attrs = filter(lambda data: data[2] is obj, attrs)
-        inherited_attrs = set(attrs) - set(obj_attrs)
-        result['class_attrs'] = [spill(attr) for attr in obj_attrs]
-        result['inherited attrs'] = [spill(attr) for attr in inherited_attrs]
+        # values of attributes may be unhashable, attributes are not compared
+        obj_attrs = [attr for attr in attrs if attr[2] is obj]
+        inherited_attrs = [attr for attr in attrs if attr[2] is not obj]
+        result.class_attrs = [spill(attr) for attr in obj_attrs]
+        result.inherited_attrs = [spill(attr) for attr in inherited_attrs]
         return result
 
     def struct_routine(self, obj, name=None, mod=None, cl=None):
         """Produce code structure for a function or method object."""
         
-        result = dict()
-        result['type'], realname = describe(obj)
-        result['name'] = name or realname
+        result = RoutineNode()
+        result.type, realname = describe(obj)
+        result.name = name or realname
 
         if inspect.ismethod(obj):
             imclass = obj.im_class
             if cl:
                 if imclass is not cl:
-                    result['note'] = 'from ' + classname(imclass, mod)
+                    result.note = self.strings.intern('from ' + classname(imclass, mod))
             else:
                 if obj.im_self is not None:
-                    result['note'] = 'method of %s instance' % classname(
-                        obj.im_self.__class__, mod)
+                    result.note = self.strings.intern('method of %s instance' % classname(
+                        obj.im_self.__class__, mod))
                 else:
-                    result['note'] = 'unbound %s method' % classname(imclass,mod)
+                    result.note = self.strings.intern(
+                        'unbound %s method' % classname(imclass,mod))
             obj = obj.im_func
 
+        result.decl, result.doc = self._memoized('routine', self._routine_spec,
+                                                        obj, result.name)
+        return result
+
+    def _routine_spec(self, obj, name):
+        ''' returns declaration and documentation of a routine '''
+
         if inspect.isfunction(obj):
-            args, varargs, varkw, defaults = inspect.getargspec(obj)
+            args, varargs, varkw, defaults = profiled(self.profiler, 'getargspec', None,
+                                                        inspect.getargspec, obj)
             argspec = inspect.formatargspec(args, varargs, varkw, defaults)
-            if result['name'] == '<lambda>':
+            if name == '<lambda>':
                 argspec = argspec[1:-1] # remove parentheses
         else:
             argspec = '(...)'
-        result['decl'] = result['name'] + argspec
-        result['doc'] = getdoc(obj) or ''
-        return result
+        return name + argspec, self.getdoc(obj)
+
+    def getdoc(self, obj):
+        """Get the doc string or comments for an object."""
+        return self.strings.intern(profiled(self.profiler, 'getdoc', None,
+                                            getdoc, obj, self.sources) or '')
+
+    def classname(self, cls, modname):
+        """Get a class name and qualify it with a module name if necessary."""
+        name = classname(cls, modname)
+        return name and self.strings.intern(name)
 
     def struct_module(self, obj, name=None, mod=None):
         """Produce structure for a given module object."""
-        
-        result = dict()
+        if self.lazy:
+            return LazyStruct({}, _MODULE_MEMBERS,
+                                lambda: assemble(self.iter_module(obj, name, mod)))
+        return assemble(self.iter_module(obj, name, mod))
+
+    def iter_module(self, obj, name=None, mod=None):
+        """Generate structure for a given module object, item by item,
+        as (section, item) pairs, see assemble()."""
+        items = self._iter_module(obj, name, mod)
+        if self.profiler is None:
+            return items
+        return self.profiler.iterate('module', obj.__name__, items)
+
+    def _iter_module(self, obj, name=None, mod=None):
+
+        import pkgutil
 
         # if __all__ exists, believe it.  Otherwise use old heuristic.
         try:
@@ -172,31 +741,25 @@ class PyCodeStruct(object):
 
         docloc = getdocloc(obj)
         if docloc:
-            result['doc_location'] = docloc
+            yield None, {'doc_location': docloc}
 
         # classes
-        classes = list()
-        for key, value in inspect.getmembers(obj, inspect.isclass):
+        for key, value in profiled(self.profiler, 'getmembers', None,
+                                    inspect.getmembers, obj, inspect.isclass):
             if visiblename(key, _all, obj):
-                classes.append(self.struct_class(value, key))
-        if classes:
-            result['classes'] = classes
+                yield 'classes', self.struct_class(value, key)
 
         # functions
-        funcs = list()
-        for key, value in inspect.getmembers(obj, inspect.isroutine):
+        for key, value in profiled(self.profiler, 'getmembers', None,
+                                    inspect.getmembers, obj, inspect.isroutine):
             if visiblename(key, _all, obj):
-                funcs.append(self.struct_routine(value, key) )
-        if funcs:
-            result['funcs'] = funcs
+                yield 'funcs', self.struct_routine(value, key)
+
         # data
-        data = list()
-        for key, value in inspect.getmembers(obj, isdata):
+        for key, value in profiled(self.profiler, 'getmembers', None,
+                                    inspect.getmembers, obj, isdata):
             if visiblename(key, _all, obj) and value is not None:
-                data.append(self.struct_data(value, key, mod))
-        if data:
-            result['data'] = data
-        return result
+                yield 'data', self.struct_data(value, key, mod)
 
         # modules and packages
         modules = list()
@@ -210,58 +773,2043 @@ class PyCodeStruct(object):
                 else:
                     modules.append(modname)
             if packages:
-                result['packages'] = packages
+                yield None, {'packages': packages}
             if modules:
-                result['modules'] = modules
+                yield None, {'modules': modules}
 
         # Detect submodules as sometimes created by C extensions
         submodules = []
-        for key, value in inspect.getmembers(object, inspect.ismodule):
-            if value.__name__.startswith(name + '.') and key not in modpkgs_names:
+        for key, value in inspect.getmembers(obj, inspect.ismodule):
+            if value.__name__.startswith(obj.__name__ + '.') and key not in modpkgs_names:
                 submodules.append(key)
         if submodules:
-            result['submodules'] = submodules
+            yield None, {'submodules': submodules}
+
+
+class _NewStyleClass(object): pass
+
+
+class AstCodeStruct(object):
+    ''' extract code structure from source code, without importing it '''
+
+    _ROUTINE_TYPES = {
+        'method': 'method',
+        'class method': 'classmethod',
+        'static method': 'staticmethod',
+    }
+
+    def __init__(self, tree, modname=None, package=None, profiler=None, lazy=False,
+                 strings=None):
+
+        self.tree = tree
+        self.modname = modname
+        self.profiler = profiler
+        self.lazy = lazy
+        self.strings = StringTable() if strings is None else strings
+        # package for relative imports, the module itself for __init__ modules
+        if package is None and modname:
+            package = modname.rpartition('.')[0]
+        self.package = package
+        self._inspect = PyCodeStruct(profiler=profiler, strings=self.strings)
+        self._mro = dict()
+        # top-level definitions and imported names of the module
+        self.classes = dict()
+        self.imports = dict()
+        for node in walkbody(tree.body):
+            if isinstance(node, ast.ClassDef):
+                self.classes[node.name] = node
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = alias.name
+                    else:
+                        head = alias.name.split('.')[0]
+                        self.imports[head] = head
+            elif isinstance(node, ast.ImportFrom):
+                module = self.absmodule(node.module, node.level)
+                for alias in node.names:
+                    if alias.name != '*':
+                        self.imports[alias.asname or alias.name] = \
+                            '%s.%s' % (module, alias.name)
+
+    def absmodule(self, module, level):
+        ''' returns absolute module name for relative import '''
+        if not level or self.package is None:
+            return module or ''
+        parts = self.package.split('.')
+        parts = parts[:len(parts) - level + 1]
+        if module:
+            parts.append(module)
+        return '.'.join(parts)
+
+    def struct(self, node, name=None, *args):
+        """Generate structure for an ast node."""
+
+        args = (node, name) + args
+        if isinstance(node, ast.Module): return self.struct_module(*args)
+        if isinstance(node, ast.ClassDef): return self.struct_class(*args)
+        if isinstance(node, ast.FunctionDef): return self.struct_routine(*args)
+        return self.struct_data(*args)
+
+    def struct_data(self, node, name=None, mod=None, cl=None):
+        """Produce structure for a data node."""
+
+        value = literalvalue(node)
+        if isinstance(value, (bool, str, unicode, int, long, float, complex, tuple, list, dict)):
+            return dict([(name, value),])
+        result = DataNode()
+        if isinstance(node, ast.ClassDef):
+            result.type, realname = 'class', node.name
+            result.doc = self.getdoc(node)
+        else:
+            result.type, realname = type(node).__name__.lower(), ''
+            result.doc = ''
+        result.name = name or realname
+        if cl is not None:
+            cls_name = self.classname(cl, mod)
+            if cls_name:
+                result.belongs_to = cls_name
         return result
 
+    def struct_attr(self, attr, mod=None):
+        """Produce structure for a class attribute, as classified by
+        AstCodeStruct.classify_class_attrs()."""
+
+        name, kind, homecls, value = attr
+        if not isinstance(homecls, ast.ClassDef):
+            # attributes of built-in classes are described by the inspect engine,
+            # built-in modules are always imported already
+            return self._inspect.struct_attr(attr, mod)
+        if not isinstance(value, ast.AST):
+            result = self._inspect.struct_data(value, name, mod)
+        elif kind in self._ROUTINE_TYPES:
+            result = self.struct_routine(value, name, mod, homecls)
+        elif kind == 'property':
+            result = DataNode()
+            result.type, result.name = 'property', name
+            result.doc = self.getdoc(value)
+        else:
+            result = self.struct_data(value, name, mod, homecls)
+        if isinstance(result, (dict, StructNode)):
+            result['belongs_to'] = self.classname(homecls, mod)
+        return result
 
+    def struct_class(self, node, name=None, mod=None, *ignored):
+        """Produce structure for a given class definition."""
+        if self.lazy:
+            return LazyStruct(self._class_head(node, name), _CLASS_MEMBERS,
+                    lambda: self._profiled_class(node, name, mod))
+        return self._profiled_class(node, name, mod)
 
-# ------------------------------------------------
-# Utils
-# ------------------------------------------------
+    def _profiled_class(self, node, name=None, mod=None):
+        return profiled(self.profiler, 'class', self.classname(node, None),
+                        self._struct_class, node, name, mod)
 
-def dict2flat(root_name, source, removeEmptyFields=False):
-    ''' returns a simplified "flat" form of the complex hierarchical dictionary '''
-    
-    def is_simple_elements(source):
-        ''' check if the source contains simple element types,
-        not lists, tuples, dicts
-        '''
-        for i in source:
-            if isinstance(i, (list, tuple, dict)):
-                return False
-        return True
-    
-    flat_dict = {}
-    if isinstance(source, (list, tuple)):
-        if not is_simple_elements(source):
-            for i,e in enumerate(source):
-                new_root_name = "%s[%d]" % (root_name,i)
-                for k,v in dict2flat(new_root_name,e).items():
-                    flat_dict[k] = v
+    def _class_head(self, node, name=None):
+        """Produce structure for a given class definition, without attributes."""
+
+        result = ClassNode()
+        result.type, realname = 'class', node.name
+        result.name = name or realname
+
+        if name and name <> realname:
+            result.decl = name + ' = class ' + realname
+
+        result.doc = self.getdoc(node)
+
+        # List the mro, if non-trivial.
+        mro = self.getmro(node)
+        if len(mro) > 1:
+            result.bases = [self.classname(c, self.modname) for c in mro[1:]]
+        # bases of the class statement, unless the mro starts with the only one
+        if len(node.bases) > 1:
+            result.direct_bases = [self.classname(self.resolvebase(base), self.modname)
+                                    for base in node.bases]
+        return result
+
+    def _struct_class(self, node, name=None, mod=None):
+
+        def spill(attr):
+            return self.struct_attr(attr, mod)
+
+        result = self._class_head(node, name)
+        attrs = [attr for attr in self.classify_class_attrs(node)
+                      if visiblename(attr[0])]
+        result.class_attrs = [spill(attr) for attr in attrs if attr[2] is node]
+        result.inherited_attrs = [spill(attr) for attr in attrs if attr[2] is not node]
+        return result
+
+    def struct_routine(self, node, name=None, mod=None, cl=None):
+        """Produce code structure for a function or method definition."""
+
+        result = RoutineNode()
+        if cl is None:
+            result.type = 'function'
+        else:
+            result.type = self._ROUTINE_TYPES.get(routinekind(node), 'method')
+        realname = node.name
+        result.name = name or realname
+        result.decl = result.name + formatargs(node.args)
+        result.doc = self.getdoc(node)
+        return result
+
+    def struct_module(self, node, name=None, mod=None):
+        """Produce structure for a given module definition."""
+        if self.lazy:
+            return LazyStruct({}, _MODULE_MEMBERS,
+                                lambda: assemble(self.iter_module(node, name, mod)))
+        return assemble(self.iter_module(node, name, mod))
+
+    def iter_module(self, node, name=None, mod=None):
+        """Generate structure for a given module definition, item by item,
+        as (section, item) pairs, see assemble()."""
+        items = self._iter_module(node, name, mod)
+        if self.profiler is None:
+            return items
+        return self.profiler.iterate('module', self.modname, items)
+
+    def _iter_module(self, node, name=None, mod=None):
+
+        # if __all__ exists, believe it.  Otherwise use old heuristic.
+        _all = None
+        members = dict()
+        for child in walkbody(node.body):
+            if isinstance(child, (ast.ClassDef, ast.FunctionDef)):
+                members[child.name] = child
+            elif isinstance(child, ast.Assign):
+                for target in child.targets:
+                    if isinstance(target, ast.Name):
+                        members[target.id] = child.value
+                        if target.id == '__all__':
+                            _all = literalvalue(child.value, None)
+        members = sorted(members.items())
+
+        # classes
+        for key, value in members:
+            if isinstance(value, ast.ClassDef) and visiblename(key, _all):
+                yield 'classes', self.struct_class(value, key)
+
+        # functions
+        for key, value in members:
+            if isinstance(value, ast.FunctionDef) and visiblename(key, _all):
+                yield 'funcs', self.struct_routine(value, key)
+
+        # data
+        for key, value in members:
+            if isinstance(value, (ast.ClassDef, ast.FunctionDef)):
+                continue
+            if isinstance(value, ast.Name) and value.id == 'None':
+                continue
+            if visiblename(key, _all):
+                yield 'data', self.struct_data(value, key, mod)
+
+    def getdoc(self, node):
+        """Get the doc string for a class or function definition."""
+        result = ast.get_docstring(node)
+        return self.strings.intern(result and _LEADING_BLANK_LINE.sub('', result.rstrip()) or '')
+
+    def classname(self, cls, modname):
+        """Get a class name and qualify it with a module name if necessary."""
+        if isinstance(cls, ast.ClassDef):
+            if self.modname and self.modname != modname:
+                return self.strings.intern(self.modname + '.' + cls.name)
+            return cls.name
+        if inspect.isclass(cls):
+            return self._inspect.classname(cls, modname)
+        return cls
+
+    def resolvebase(self, node):
+        """Resolve a base class expression to a class definition of this module,
+        a built-in class or the qualified name of an external class."""
+
+        name = dottedname(node)
+        if name is None:
+            return '<%s>' % type(node).__name__.lower()
+        head, sep, tail = name.partition('.')
+        if not tail and head in self.classes:
+            return self.classes[head]
+        if head in self.imports:
+            return self.imports[head] + sep + tail
+        if not tail and inspect.isclass(getattr(_builtins, head, None)):
+            return getattr(_builtins, head)
+        if self.modname:
+            return self.modname + '.' + name
+        return name
+
+    def getmro(self, node):
+        """Return the method resolution order of a class definition.
+        Classes defined outside of this module contribute only their name."""
+
+        if node in self._mro:
+            return self._mro[node] or [node]
+        self._mro[node] = None    # guard against recursive definitions
+        bases = [self.resolvebase(base) for base in node.bases]
+        seqs = list()
+        for base in bases:
+            if isinstance(base, ast.ClassDef):
+                seqs.append(self.getmro(base))
+            elif inspect.isclass(base):
+                seqs.append(list(inspect.getmro(base)))
+            else:
+                seqs.append([base])
+        try:
+            mro = [node] + c3merge(seqs + [bases])
+        except TypeError:
+            mro = [node]
+            for seq in seqs:
+                mro.extend(c for c in seq if c not in mro)
+        self._mro[node] = mro
+        return mro
+
+    def classify_class_attrs(self, node):
+        """Return list of attribute-descriptor tuples (name, kind, homecls, value)
+        for a class definition, the same way inspect.classify_class_attrs() does."""
+
+        result = dict()
+        for cls in self.getmro(node):
+            if isinstance(cls, ast.ClassDef):
+                own = self._own_attrs(cls)
+            elif inspect.isclass(cls):
+                own = [attr for attr in inspect.classify_class_attrs(cls)
+                            if attr[2] is cls]
+            else:
+                own = list()
+            for attr in own:
+                result.setdefault(attr[0], attr)
+        return [result[name] for name in sorted(result)]
+
+    def _own_attrs(self, node):
+        ''' returns attributes defined in the body of class definition '''
+
+        result = list()
+        names = set()
+        for child in walkbody(node.body):
+            if isinstance(child, ast.FunctionDef):
+                result.append((child.name, routinekind(child), node, child))
+                names.add(child.name)
+            elif isinstance(child, ast.ClassDef):
+                result.append((child.name, 'data', node, child))
+                names.add(child.name)
+            elif isinstance(child, ast.Assign):
+                for target in child.targets:
+                    if isinstance(target, ast.Name):
+                        result.append((target.id, 'data', node, child.value))
+                        names.add(target.id)
+        # later definitions override earlier ones
+        result = dict((attr[0], attr) for attr in result).values()
+
+        # new-style classes derived from object directly get instance dict
+        # and weak references support, unless __slots__ are defined
+        bases = [self.resolvebase(base) for base in node.bases]
+        if bases and all(base is object for base in bases) and '__slots__' not in names:
+            for name in ('__dict__', '__weakref__'):
+                result.append((name, 'data', node, _NewStyleClass.__dict__[name]))
+        return result
+
+
+class _SQLiteStore(object):
+    ''' base of caches and indexes stored in SQLite database
+
+    The database is at path, or at the path of environment variable envvar,
+    or filename in ~/.cache/pycode. Statements of schema create its tables
+    and indexes if they do not exist. With shared, the connection may be
+    used by several threads, one at a time, holding _lock.
+    '''
+
+    envvar, filename, schema, shared = None, None, (), False
+
+    def __init__(self, path=None):
+
+        import sqlite3
+
+        self.path = path or os.environ.get(self.envvar,
+                        os.path.join(os.path.expanduser('~'), '.cache', 'pycode', self.filename))
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=not self.shared)
+        self._lock = thread.allocate_lock()
+        for statement in self.schema:
+            self._db.execute(statement)
+        self._db.commit()
+
+    @staticmethod
+    def _scope(column, value, name):
+        ''' returns SQL condition and its arguments selecting rows of the
+        object name and of its members, with value in column '''
+        return ('%s = ? AND (name = ? OR name >= ? AND name < ?)' % column,
+                (value, name, name + '.', name + '/'))
+
+    def close(self):
+        self._db.close()
+
+
+class StructCache(_SQLiteStore):
+    ''' persistent cache of code structures, stored in SQLite database
+
+    Entries are keyed by the analyzed name and engine, and are valid while
+    the module's source file has the same path, size and modification time,
+    or the same content hash, and pycode has the same version.
+    '''
+
+    # shared by threads of serve()
+    envvar, filename, shared = 'PYCODE_CACHE', 'structs.db', True
+    schema = ('''CREATE TABLE IF NOT EXISTS structs (
+                    name TEXT, engine TEXT, file TEXT, size INTEGER,
+                    mtime REAL, hash TEXT, version TEXT, result TEXT,
+                    PRIMARY KEY (name, engine))''',)
+
+    def _filehash(self, filename):
+        ''' returns hash of the file content '''
+        import hashlib
+
+        digest = hashlib.sha1()
+        file = open(filename, 'rb')
+        try:
+            for chunk in iter(lambda: file.read(65536), ''):
+                digest.update(chunk)
+        finally:
+            file.close()
+        return digest.hexdigest()
+
+    def get(self, name, engine, filename):
+        ''' returns cached code structure or None '''
+
+        import json
+
+        filename = os.path.abspath(filename)
+        self._lock.acquire()
+        try:
+            row = self._db.execute('''SELECT file, size, mtime, hash, version, result
+                                        FROM structs WHERE name = ? AND engine = ?''',
+                                        (name, engine)).fetchone()
+        finally:
+            self._lock.release()
+        if not row or row[0] != filename or row[4] != __version__:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if stat.st_size != row[1]:
+            return None
+        if stat.st_mtime != row[2]:
+            # touched but maybe not modified
+            if self._filehash(filename) != row[3]:
+                return None
+            self._lock.acquire()
+            try:
+                self._db.execute('UPDATE structs SET mtime = ? WHERE name = ? AND engine = ?',
+                                    (stat.st_mtime, name, engine))
+                self._db.commit()
+            finally:
+                self._lock.release()
+        return json.loads(row[5])
+
+    def put(self, name, engine, filename, result):
+        ''' store code structure of the module in the cache '''
+
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        row = (name, engine, filename, stat.st_size, stat.st_mtime,
+               self._filehash(filename), __version__, dumpjson(result))
+        self._lock.acquire()
+        try:
+            self._db.execute('INSERT OR REPLACE INTO structs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', row)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+
+class LocationIndex(_SQLiteStore):
+    ''' index of source locations by qualified names, stored in SQLite database
+
+    Locations are (file, line, col, end line, end col), see sourcelocations().
+    Names are the primary key, so a name is looked up by a single index
+    search and names sharing a prefix are read as one range of the index.
+    '''
+
+    envvar, filename = 'PYCODE_INDEX', 'locations.db'
+    schema = ('''CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY, file TEXT UNIQUE)''',
+              '''CREATE TABLE IF NOT EXISTS locations (
+                    name TEXT PRIMARY KEY, file INTEGER, line INTEGER,
+                    col INTEGER, end_line INTEGER, end_col INTEGER)''')
+
+    def _fileid(self, filename):
+        row = self._db.execute('SELECT id FROM files WHERE file = ?', (filename,)).fetchone()
+        if row:
+            return row[0]
+        return self._db.execute('INSERT INTO files (file) VALUES (?)', (filename,)).lastrowid
+
+    def update(self, result):
+        ''' store locations of code structure returned by struct_code(),
+        replacing locations previously stored for the same object '''
+
+        if 'locations' not in result:
+            return
+        fileid = self._fileid(result['file'])
+        scope, args = self._scope('file', fileid, result['name'])
+        self._db.execute('DELETE FROM locations WHERE ' + scope, args)
+        self._db.executemany('INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?)',
+                            [(k, fileid) + tuple(v) for k, v in result['locations'].items()])
+        self._db.commit()
+
+    def get(self, name):
+        ''' returns location of the object or None '''
+
+        row = self._db.execute('''SELECT files.file, line, col, end_line, end_col
+                                    FROM locations JOIN files ON locations.file = files.id
+                                    WHERE name = ?''', (name,)).fetchone()
+        return row and tuple(row)
+
+    def prefix(self, prefix):
+        ''' generates (name, location) of objects with names starting with
+        prefix, sorted by names '''
+
+        query = '''SELECT name, files.file, line, col, end_line, end_col
+                    FROM locations JOIN files ON locations.file = files.id'''
+        if prefix:
+            # names from prefix up to, not including, the next possible prefix
+            upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+            rows = self._db.execute(query + ' WHERE name >= ? AND name < ? ORDER BY name',
+                                        (prefix, upper))
+        else:
+            rows = self._db.execute(query + ' ORDER BY name')
+        for row in rows:
+            yield row[0], tuple(row[1:])
+
+
+class SymbolIndex(_SQLiteStore):
+    ''' index of symbols of analyzed code, stored in SQLite database
+
+    Symbols are {'name', 'kind', 'module', 'signature', 'summary'} dicts,
+    see codesymbols(). Prefix lookups read a range of the index of qualified
+    names. Substring lookups of 3 and more characters search an index of
+    trigrams of names if SQLite has the FTS5 extension, names are scanned
+    otherwise. Substring and fuzzy lookups are case insensitive.
+    '''
+
+    _fields = ('name', 'kind', 'module', 'signature', 'summary')
+
+    envvar, filename = 'PYCODE_SYMBOLS', 'symbols.db'
+    schema = ('''CREATE TABLE IF NOT EXISTS symbols (
+                    name TEXT PRIMARY KEY, kind TEXT, module TEXT,
+                    signature TEXT, summary TEXT)''',
+              'CREATE INDEX IF NOT EXISTS symbols_module ON symbols (module)')
+
+    def __init__(self, path=None):
+
+        import sqlite3
+
+        _SQLiteStore.__init__(self, path)
+        self.trigrams = bool(self._db.execute(
+                            "SELECT 1 FROM sqlite_master WHERE name = 'symbol_trigrams'").fetchone())
+        if not self.trigrams:
+            try:
+                self._db.execute('''CREATE VIRTUAL TABLE symbol_trigrams
+                                        USING fts5(name, detail='none', tokenize='trigram')''')
+            except sqlite3.OperationalError:
+                pass
+            else:
+                self._db.execute('''INSERT INTO symbol_trigrams (rowid, name)
+                                        SELECT rowid, name FROM symbols''')
+                self.trigrams = True
+        self._db.commit()
+
+    def update(self, result):
+        ''' store symbols of code structure returned by struct_code(),
+        replacing symbols previously stored for the same object '''
+
+        symbols = list(codesymbols(result))
+        names = [symbol[:1] for symbol in symbols]
+        # trigrams are updated by whole statements, not by triggers: FTS5
+        # writes its pending changes at every statement of a trigger
+        scope, args = self._scope('module', result.get('module_name'), result['name'])
+        if self.trigrams:
+            self._db.execute('''DELETE FROM symbol_trigrams WHERE rowid IN
+                                    (SELECT rowid FROM symbols WHERE %s)''' % scope, args)
+            self._db.executemany('''DELETE FROM symbol_trigrams WHERE rowid =
+                                    (SELECT rowid FROM symbols WHERE name = ?)''', names)
+        self._db.execute('DELETE FROM symbols WHERE ' + scope, args)
+        self._db.executemany('DELETE FROM symbols WHERE name = ?', names)
+        self._db.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?, ?)', symbols)
+        if self.trigrams:
+            self._db.execute('''INSERT INTO symbol_trigrams (rowid, name)
+                                    SELECT rowid, name FROM symbols WHERE %s''' % scope, args)
+        self._db.commit()
+
+    def _symbols(self, where, args, limit=None, tables='symbols'):
+        query = '''SELECT symbols.name, kind, module, signature, summary
+                    FROM %s WHERE %s''' % (tables, where)
+        if limit is not None:
+            query, args = query + ' LIMIT ?', args + (limit,)
+        return [dict(zip(self._fields, row)) for row in self._db.execute(query, args)]
+
+    def get(self, name):
+        ''' returns the symbol or None '''
+
+        symbols = self._symbols('name = ?', (name,))
+        return symbols and symbols[0] or None
+
+    def prefix(self, prefix, limit=50):
+        ''' returns symbols with qualified names starting with prefix,
+        sorted by names '''
+
+        if not prefix:
+            return self._symbols('1 ORDER BY name', (), limit)
+        upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        return self._symbols('name >= ? AND name < ? ORDER BY name', (prefix, upper), limit)
+
+    def substring(self, text, limit=50):
+        ''' returns symbols with qualified names containing text, shortest
+        names first '''
+
+        pattern = '%' + likepattern(text) + '%'
+        if self.trigrams and len(text) >= 3:
+            # trigrams are not searched for patterns with ESCAPE, they only
+            # select candidates, with '_' and '%' in text matching any characters
+            return self._symbols('''symbol_trigrams.name LIKE ? AND symbols.rowid = symbol_trigrams.rowid
+                                    AND symbols.name LIKE ? ESCAPE '\\'
+                                    ORDER BY length(symbols.name), symbols.name''',
+                                    ('%' + text + '%', pattern), limit,
+                                    'symbol_trigrams, symbols')
+        return self._symbols("name LIKE ? ESCAPE '\\' ORDER BY length(name), name",
+                                (pattern,), limit)
+
+    def fuzzy(self, text, limit=50):
+        ''' returns symbols with qualified names containing characters of
+        text in the same order, best matches first, see fuzzyscore() '''
+
+        import heapq
+
+        # names containing text are the best matches, see fuzzyscore()
+        symbols = self.substring(text, limit)
+        if len(symbols) == limit or len(text) < 2:
+            return symbols
+        found = set(symbol['name'] for symbol in symbols)
+        text = text.lower()
+        pattern = '%' + '%'.join(likepattern(c) for c in text) + '%'
+        names = self._db.execute("SELECT name FROM symbols WHERE name LIKE ? ESCAPE '\\'",
+                                    (pattern,))
+        scored = ((fuzzyscore(name, text), name) for name, in names if name not in found)
+        for score, name in heapq.nsmallest(limit - len(symbols),
+                                            (item for item in scored if item[0] is not None)):
+            symbols.extend(self._symbols('name = ?', (name,)))
+        return symbols
+
+
+class ClassIndex(_SQLiteStore):
+    ''' index of the class hierarchy of analyzed code, stored in SQLite database
+
+    The method resolution order of each class is stored, one row per base,
+    see codeclasses(). As it lists all base classes, it is the transitive
+    closure of inheritance: the bases of a class are read as one range of
+    the primary key, its subclasses at any depth as one range of the index
+    of bases. Rows of the bases the class statement lists are marked direct.
+    '''
+
+    envvar, filename = 'PYCODE_CLASSES', 'classes.db'
+    schema = ('''CREATE TABLE IF NOT EXISTS classes (
+                    name TEXT PRIMARY KEY, module TEXT)''',
+              '''CREATE TABLE IF NOT EXISTS mro (
+                    name TEXT, position INTEGER, base TEXT, direct INTEGER,
+                    PRIMARY KEY (name, position))''',
+              'CREATE INDEX IF NOT EXISTS mro_base ON mro (base, name)',
+              'CREATE INDEX IF NOT EXISTS classes_module ON classes (module)')
+
+    def update(self, result):
+        ''' store classes of code structure returned by struct_code(),
+        replacing classes previously stored for the same object '''
+
+        classes = list(codeclasses(result))
+        names = [(name,) for name, module, bases, direct in classes]
+        scope, args = self._scope('module', result.get('module_name'), result['name'])
+        self._db.execute('''DELETE FROM mro WHERE name IN
+                                (SELECT name FROM classes WHERE %s)''' % scope, args)
+        self._db.execute('DELETE FROM classes WHERE ' + scope, args)
+        self._db.executemany('DELETE FROM mro WHERE name = ?', names)
+        self._db.executemany('INSERT OR REPLACE INTO classes VALUES (?, ?)',
+                                [(name, module) for name, module, bases, direct in classes])
+        self._db.executemany('INSERT OR REPLACE INTO mro VALUES (?, ?, ?, ?)',
+                                [(name, position, base, base in direct)
+                                    for name, module, bases, direct in classes
+                                    for position, base in enumerate(bases)])
+        self._db.commit()
+
+    def mro(self, name):
+        ''' returns qualified names of base classes of the class in method
+        resolution order, or None if the class is not indexed '''
+
+        rows = self._db.execute('''SELECT base FROM classes LEFT JOIN mro USING (name)
+                                    WHERE name = ? ORDER BY position''', (name,)).fetchall()
+        if not rows:
+            return None
+        return [base for base, in rows if base is not None]
+
+    def subclasses(self, name, direct=False):
+        ''' returns sorted qualified names of indexed classes deriving from
+        the class, directly or through other classes unless direct '''
+
+        where = direct and 'base = ? AND direct' or 'base = ?'
+        return [row[0] for row in self._db.execute(
+                    'SELECT name FROM mro WHERE %s ORDER BY name' % where, (name,))]
+
+class CallGraph(_SQLiteStore):
+    ''' index of names referenced and called by analyzed code, stored in
+    SQLite database
+
+    References are (qualified name, referenced name, called) rows, see
+    coderefs(). Names a function uses are read as one range of the primary
+    key, the functions using a name as one range of the index of referenced
+    names.
+    '''
+
+    envvar, filename = 'PYCODE_CALLS', 'calls.db'
+    schema = ('''CREATE TABLE IF NOT EXISTS refs (
+                    name TEXT, ref TEXT, called INTEGER, module TEXT,
+                    PRIMARY KEY (name, ref))''',
+              'CREATE INDEX IF NOT EXISTS refs_ref ON refs (ref, called, name)',
+              'CREATE INDEX IF NOT EXISTS refs_module ON refs (module)')
+
+    def update(self, result):
+        ''' store references of code structure returned by struct_code(...,
+        refs=True), replacing references previously stored for the same object '''
+
+        if 'refs' not in result:
+            return
+        module = result.get('module_name')
+        scope, args = self._scope('module', module, result['name'])
+        self._db.execute('DELETE FROM refs WHERE ' + scope, args)
+        rows = list()
+        for name, refs in result['refs'].items():
+            rows.extend((name, ref, 1, module) for ref in refs['calls'])
+            rows.extend((name, ref, 0, module) for ref in refs['names'])
+        self._db.executemany('INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?)', rows)
+        self._db.commit()
+
+    def uses(self, name, calls=False):
+        ''' returns sorted names referenced by the code of name, or only
+        the names it calls '''
+
+        where = calls and 'name = ? AND called' or 'name = ?'
+        return [row[0] for row in self._db.execute(
+                    'SELECT ref FROM refs WHERE %s ORDER BY ref' % where, (name,))]
+
+    def usedby(self, name, calls=False):
+        ''' returns sorted qualified names of code referencing name, or
+        only of code calling it '''
+
+        where = calls and 'ref = ? AND called' or 'ref = ?'
+        return [row[0] for row in self._db.execute(
+                    'SELECT name FROM refs WHERE %s ORDER BY name' % where, (name,))]
+
+class DependencyGraph(object):
+    ''' import and inheritance dependencies between modules of a package
+    or of a directory, found by parsing their source code
+
+    Dependency records of modules are kept in the cache (StructCache)
+    under the 'deps' engine name, if cache is given.
+    '''
+
+    def __init__(self, root, cache=None):
+
+        self.basedir, names = findmodules(root)
+        self.files = dict()     # module name -> source file
+        self.imports = dict()   # module name -> set of imported modules
+        self.importers = dict() # module name -> set of modules importing it
+        self.aliases = dict()   # module name -> {local name: qualified name}
+        self.bases = dict()     # module name -> {class name: [qualified base names]}
+
+        records = dict()
+        for name in names:
+            filename = modulefile(self.basedir, name)
+            record = None
+            if cache is not None:
+                record = cache.get(name, 'deps', filename)
+            if record is None:
+                record = self._record(name, filename)
+                if cache is not None:
+                    cache.put(name, 'deps', filename, record)
+            self.files[name] = os.path.abspath(filename)
+            records[name] = record
+
+        for name, record in records.items():
+            self.imports[name] = set()
+            for imported in record['imports']:
+                while imported and imported not in self.files:
+                    imported = imported.rpartition('.')[0]
+                if imported and imported != name:
+                    self.imports[name].add(imported)
+                    self.importers.setdefault(imported, set()).add(name)
+            self.aliases[name] = record['aliases']
+            self.bases[name] = record['bases']
+
+    def _record(self, modname, filename):
+        ''' returns dependency record of a module '''
+
+        try:
+            tree = parsefile(filename)
+        except ErrorDuringImport:
+            return {'imports': [], 'aliases': {}, 'bases': {}}
+        if os.path.basename(filename).startswith('__init__.'):
+            code = AstCodeStruct(tree, modname, modname)
+        else:
+            code = AstCodeStruct(tree, modname)
+
+        imports = list()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                module = code.absmodule(node.module, node.level)
+                imports.append(module)
+                imports.extend('%s.%s' % (module, alias.name) for alias in node.names)
+
+        bases = dict()
+        for name, node in code.classes.items():
+            bases[name] = [code.classname(base, None)
+                            for base in map(code.resolvebase, node.bases)
+                            if not inspect.isclass(base)]
+        return {'imports': sorted(set(imports)), 'aliases': code.imports, 'bases': bases}
+
+    def modules(self, filenames):
+        ''' returns names of modules for given source files '''
+        names = dict((filename, name) for name, filename in self.files.items())
+        return set(names[os.path.abspath(f)] for f in filenames if os.path.abspath(f) in names)
+
+    def dependents(self, modnames):
+        ''' returns modules which import given modules, directly or not,
+        including given modules '''
+        result = set(modnames)
+        stack = list(result)
+        while stack:
+            for name in self.importers.get(stack.pop(), ()):
+                if name not in result:
+                    result.add(name)
+                    stack.append(name)
+        return result
+
+    def resolve(self, qualname, depth=0):
+        ''' returns (module name, name) where a qualified name is defined,
+        following names imported from other modules, or None if the name
+        is defined outside of the graph or is a module '''
+        if qualname in self.files:
+            return None
+        modname, _, name = qualname.rpartition('.')
+        if modname not in self.files:
+            return None
+        if name not in self.bases[modname] and name in self.aliases[modname] and depth < 32:
+            return self.resolve(self.aliases[modname][name], depth + 1)
+        return modname, name
+
+    def touches(self, modname, classname, changed, seen=None):
+        ''' returns True if the MRO of a class touches changed modules '''
+        if modname in changed:
+            return True
+        seen = seen or set()
+        for base in self.bases.get(modname, {}).get(classname, ()):
+            owner = self.resolve(base)
+            if owner and owner not in seen:
+                seen.add(owner)
+                if self.touches(owner[0], owner[1], changed, seen):
+                    return True
+        return False
+
+    def affected(self, changed):
+        ''' returns modules affected by changes in given modules, as
+        {module name: None} for modules to be analyzed again entirely and
+        {module name: [class names]} where only classes touching changed
+        modules by their MRO are affected, including classes imported from
+        other modules. Modules importing functions or data from changed
+        modules are affected entirely. '''
+        changed = set(changed)
+        result = dict.fromkeys(changed)
+        for modname in self.dependents(changed) - changed:
+            classnames = set(name for name in self.bases[modname]
+                                if self.touches(modname, name, changed))
+            for name, qualname in self.aliases[modname].items():
+                owner = self.resolve(qualname)
+                if owner is None:
+                    continue
+                if owner[1] in self.bases[owner[0]]:
+                    if self.touches(owner[0], owner[1], changed):
+                        classnames.add(name)
+                elif owner[0] in changed:
+                    classnames = None
+                    break
+            if classnames is None:
+                result[modname] = None
+            elif classnames:
+                result[modname] = sorted(classnames)
+        return result
+
+class StructService(object):
+    ''' answers JSON-RPC 2.0 requests for code structures, see serve()
+
+    Results are kept in memory (LRUCache) while source files of analyzed
+    modules are unchanged. When a source file changes, modules imported
+    from it are unloaded, so the inspect engine imports them again.
+
+    Only the source file of the analyzed module itself is checked: results
+    of the inspect engine stay stale when a module they depend on changes,
+    e.g. the module of a base class or of a re-exported object, and this
+    module stays imported. invalidate() without thing forgets all results
+    and unloads the modules imported by analyses.
+
+    Methods: struct_code(thing, engine='inspect', depth=None, select=None),
+    invalidate(thing=None), version()
+    '''
+
+    def __init__(self, cache=None, maxsize=1024):
+
+        import threading
+
+        self.cache = cache
+        self.results = LRUCache(maxsize)
+        self.files = dict()     # source file -> signature when last analyzed
+        self.imported = set()   # names of modules imported by analyses
+        self._lock = threading.Lock()
+
+    def _checkfile(self, filename):
+        ''' returns signature of the source file, unloading modules
+        imported from it if the file changed since the last check '''
+        if not filename:
+            return None
+        filename = os.path.abspath(filename)
+        signature = filesignature(filename)
+        if self.files.get(filename, signature) != signature:
+            source = os.path.splitext(filename)[0]
+            for name, module in sys.modules.items():
+                modfile = getattr(module, '__file__', None)
+                if modfile and os.path.splitext(os.path.abspath(modfile))[0] == source:
+                    del sys.modules[name]
+        self.files[filename] = signature
+        return signature
+
+    def struct_code(self, thing, engine='inspect', depth=None, select=None):
+        ''' returns code structure, see struct_code() and expandstruct() '''
+        thing, engine = str(thing), str(engine)
+        signature = self._checkfile(sourcefile(thing))
+        entry = self.results.get((thing, engine))
+        if entry is None or entry[0] != signature:
+            loaded = set(sys.modules)
+            try:
+                entry = (signature, struct_code(thing, engine, self.cache))
+            finally:
+                self.imported.update(set(sys.modules) - loaded)
+            self.results.put((thing, engine), entry)
+        result = entry[1]
+        if depth is not None or select is not None:
+            result = dict(result)
+            result['struct'] = expandstruct(result['struct'], depth, select)
+        return result
+
+    def invalidate(self, thing=None):
+        ''' forget results for thing, or all results and modules imported
+        by analyses, so that changed dependencies are imported again '''
+        if thing is None:
+            self.results.clear()
+            for name in self.imported:
+                sys.modules.pop(name, None)
+            self.imported.clear()
+        else:
+            for engine in ('inspect', 'ast'):
+                self.results.pop((str(thing), engine))
+        return True
+
+    def version(self):
+        return __version__
+
+    def _checkparams(self, method, params):
+        ''' returns why params of a call of method are invalid, or None '''
+        if method == 'struct_code':
+            depth, select = params['depth'], params['select']
+            if not isinstance(params['thing'], basestring):
+                return 'thing is not a string'
+            if params['engine'] not in ('inspect', 'ast'):
+                return 'unknown engine %r' % (params['engine'],)
+            if depth is not None and (type(depth) not in (int, long) or depth < 0):
+                return 'depth is not a non-negative integer'
+            if select is not None and not (isinstance(select, list) and
+                                            all(isinstance(path, basestring) for path in select)):
+                return 'select is not an array of strings'
+        return None
+
+    def handle(self, request):
+        ''' returns JSON-RPC response to request, None for notifications '''
+
+        if not isinstance(request, dict):
+            request = {'id': None}
+        # nothing is returned for notifications, requests without id, even
+        # for errors
+        notification = 'id' not in request
+
+        def error(code, message):
+            if notification:
+                return None
+            return {'jsonrpc': '2.0', 'id': request['id'],
+                    'error': {'code': code, 'message': message}}
+
+        if not isinstance(request.get('method'), basestring):
+            return error(-32600, 'Invalid Request')
+        method = request['method']
+        if method not in ('struct_code', 'invalidate', 'version'):
+            return error(-32601, 'Method not found: %s' % method)
+        params = request.get('params', [])
+        if isinstance(params, dict):
+            args, kwargs = [], dict((str(k), v) for k, v in params.items())
+        elif isinstance(params, list):
+            args, kwargs = params, {}
+        else:
+            return error(-32602, 'Invalid params: not an array or object')
+        # params are checked before the call, errors raised by the analysis
+        # itself, of any type, are reported as server errors
+        try:
+            callargs = inspect.getcallargs(getattr(self, method), *args, **kwargs)
+        except TypeError, err:
+            return error(-32602, 'Invalid params: %s' % err)
+        invalid = self._checkparams(method, callargs)
+        if invalid:
+            return error(-32602, 'Invalid params: %s' % invalid)
+        try:
+            self._lock.acquire()
+            try:
+                result = getattr(self, method)(*args, **kwargs)
+            finally:
+                self._lock.release()
+        except Exception, err:
+            return error(-32000, str(err))
+        if notification:
+            return None
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def serve(self, input, output):
+        ''' answer requests read from input, one per line, until end of input '''
+        import json
+
+        for line in iter(input.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'jsonrpc': '2.0', 'id': None,
+                            'error': {'code': -32700, 'message': 'Parse error'}}
+            else:
+                response = self.handle(request)
+            if response is not None:
+                output.write(dumpjson(response) + '\n')
+                output.flush()
+
+
+class StructFuture(object):
+    ''' result of a request submitted to StructExecutor
+
+    Callbacks added by add_done_callback() are called with the future when
+    it is done or cancelled, in the thread which finished it. Event loops
+    should pass the future to their own thread from there.
+    '''
+
+    def __init__(self):
+
+        import threading
+
+        self._state = 'pending'
+        self._result = self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def cancel(self):
+        ''' cancel the request if it is not running yet, returns True if
+        the request is cancelled '''
+        self._lock.acquire()
+        try:
+            if self._state == 'pending':
+                self._state = 'cancelled'
+            elif self._state != 'cancelled':
+                return False
+        finally:
+            self._lock.release()
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def running(self):
+        return self._state == 'running'
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        ''' returns the result, waiting up to timeout seconds, raises the
+        error of the request, CancelledError or TimeoutError '''
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' returns the error of the request or None, waiting as result() '''
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise TimeoutError('Request not done in %s seconds' % timeout)
+        if self._state == 'cancelled':
+            raise CancelledError('Request cancelled')
+        return self._error
+
+    def add_done_callback(self, func):
+        self._lock.acquire()
+        try:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        finally:
+            self._lock.release()
+        func(self)
+
+    def _run(self):
+        ''' mark the request as running, returns False if it is cancelled '''
+        self._lock.acquire()
+        try:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+            return True
+        finally:
+            self._lock.release()
+
+    def _finish(self, result=None, error=None):
+        self._lock.acquire()
+        try:
+            if self._state == 'running':
+                self._state = 'done'
+                self._result, self._error = result, error
+            callbacks, self._callbacks = self._callbacks, []
+            self._event.set()
+        finally:
+            self._lock.release()
+        for func in callbacks:
+            func(self)
+
+
+class StructExecutor(object):
+    ''' runs struct_code() in background threads, for services which must
+    not block while modules are imported or source files are read and parsed
+
+    At most maxpending requests wait for one of the threads. submit() blocks
+    when there are more, or raises Queue.Full if block is False, so callers
+    are slowed down instead of queueing unlimited work.
+    '''
+
+    def __init__(self, threads=4, maxpending=64):
+
+        import Queue
+        import threading
+
+        self.requests = Queue.Queue(maxpending)
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self._work, name='pycode-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, thing, engine='inspect', depth=None, select=None,
+               block=True, timeout=None):
+        ''' returns StructFuture of struct_code(thing, engine), expanded if
+        depth or select is given, see expandstruct() '''
+        future = StructFuture()
+        self.requests.put((future, (thing, engine, depth, select)), block, timeout)
+        return future
+
+    def batch(self, root, engine='inspect', processes=None, maxpending=64, **limits):
+        ''' returns StructBatch of struct_batch(root, engine, processes, **limits) '''
+        return StructBatch(root, engine, processes, maxpending, **limits)
+
+    def shutdown(self, wait=True):
+        ''' stop threads after requests submitted so far '''
+        for thread in self.threads:
+            self.requests.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            future, (thing, engine, depth, select) = request
+            if not future._run():
+                continue
+            try:
+                result = struct_code(thing, engine)
+                if depth is not None or select is not None:
+                    result['struct'] = expandstruct(result['struct'], depth, select)
+            except (Exception, SystemExit), err:
+                future._finish(error=err)
+            else:
+                future._finish(result)
+
+
+class StructBatch(object):
+    ''' code structures of a batch analysis run in a background thread, see
+    struct_batch(); iterate, or call get(), to receive results
+
+    At most maxpending results wait to be received, the analysis is paused
+    while there are more. cancel() stops the analysis.
+    '''
+
+    def __init__(self, root, engine='inspect', processes=None, maxpending=64, **limits):
+
+        import Queue
+        import threading
+
+        self.results = Queue.Queue(maxpending)
+        self._cancelled = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._work,
+                                        args=(root, engine, processes), kwargs=limits)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self, root, engine, processes, **limits):
+        import Queue
+
+        results = None
+        try:
+            results = struct_batch(root, engine, processes, **limits)
+            for result in results:
+                while not self._cancelled.is_set():
+                    try:
+                        self.results.put((result, None), timeout=0.1)
+                        break
+                    except Queue.Full:
+                        pass
+                if self._cancelled.is_set():
+                    break
+        except (Exception, SystemExit), err:
+            self.results.put((None, err))
+        finally:
+            if results is not None:
+                results.close()
+            self.results.put((None, None))
+
+    def get(self, block=True, timeout=None):
+        ''' returns the next result, None after the last one; raises
+        Queue.Empty if no result is ready in time, or the error of the
+        analysis '''
+        if self._finished:
+            return None
+        result, error = self.results.get(block, timeout)
+        if error is not None:
+            self._finished = True
+            raise error
+        if result is None:
+            self._finished = True
+        return result
+
+    def __iter__(self):
+        while True:
+            result = self.get()
+            if result is None:
+                break
+            yield result
+
+    def cancel(self):
+        ''' stop the analysis, results not received yet are dropped '''
+        import Queue
+
+        self._cancelled.set()
+        self._finished = True
+        while self._thread.is_alive():
+            try:
+                self.results.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+class SandboxPool(object):
+    ''' pool of worker processes running tasks in isolation
+
+    Each task is run by func(task) in a worker process, so the modules it
+    imports do not stay in the calling process. A worker running a task for
+    more than timeout seconds, or whose resident memory grows over memlimit
+    bytes, is killed and replaced, and the task fails. Memory is measured
+    on systems with /proc only. Workers are replaced after maxtasks tasks,
+    if given, releasing the modules they imported.
+    '''
+
+    # seconds between checks of running workers
+    interval = 0.05
+
+    def __init__(self, func, processes=None, initializer=None, initargs=(),
+                 maxtasks=None, timeout=None, memlimit=None):
+        import multiprocessing
+
+        self.func = func
+        self.processes = processes or multiprocessing.cpu_count()
+        self.initializer = initializer
+        self.initargs = initargs
+        self.maxtasks = maxtasks
+        self.timeout = timeout
+        self.memlimit = memlimit
+        self.workers = []
+
+    def _start(self):
+        import multiprocessing
+
+        conn, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_sandbox_worker,
+                        args=(child, self.func, self.initializer, self.initargs))
+        process.daemon = True
+        process.start()
+        child.close()
+        worker = _SandboxWorker(process, conn)
+        self.workers.append(worker)
+        return worker
+
+    def _stop(self, worker, kill=False):
+        import signal
+
+        self.workers.remove(worker)
+        if kill:
+            try:
+                os.kill(worker.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        else:
+            try:
+                worker.conn.send(None)
+            except IOError:
+                pass
+        worker.conn.close()
+        worker.process.join()
+
+    def imap_unordered(self, tasks):
+        ''' generates (task, result, error) for tasks, in the order of
+        completion: error is None or the reason why the task failed '''
+        import select
+
+        pending = collections.deque(tasks)
+        try:
+            while pending or self.workers:
+                idle = [worker for worker in self.workers if worker.task is None]
+                while pending and len(self.workers) < self.processes:
+                    idle.append(self._start())
+                for worker in idle[:len(pending)]:
+                    worker.run(pending.popleft())
+
+                busy = [worker for worker in self.workers if worker.task is not None]
+                if not busy:
+                    break
+                ready, _, _ = select.select([worker.conn for worker in busy], [], [],
+                                            self.interval)
+                for worker in busy:
+                    task = worker.task
+                    if worker.conn in ready:
+                        try:
+                            result = worker.conn.recv()
+                        except (EOFError, IOError):
+                            self._stop(worker, kill=True)
+                            yield task, None, 'worker exited with code %s' % worker.process.exitcode
+                            continue
+                        worker.task = None
+                        worker.done += 1
+                        if ((self.maxtasks and worker.done >= self.maxtasks) or
+                                (self.memlimit and _rss(worker.process.pid) > self.memlimit)):
+                            self._stop(worker)
+                        yield task, result, None
+                    elif self.timeout and time.time() - worker.started > self.timeout:
+                        self._stop(worker, kill=True)
+                        yield task, None, 'timed out after %s seconds' % self.timeout
+                    elif self.memlimit and _rss(worker.process.pid) > self.memlimit:
+                        self._stop(worker, kill=True)
+                        yield task, None, 'resident memory over %s bytes' % self.memlimit
+        finally:
+            self.close()
+
+    def close(self):
+        ''' stop all workers, killing the busy ones '''
+        for worker in list(self.workers):
+            self._stop(worker, kill=worker.task is not None)
+
+
+class _SandboxWorker(object):
+    ''' worker process of SandboxPool and its current task '''
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.task = None
+        self.started = None
+        self.done = 0
+
+    def run(self, task):
+        self.task, self.started = task, time.time()
+        self.conn.send(task)
+
+
+class _RefScope(object):
+    ''' scope of names of a module, class or function, see coderefs() '''
+
+    def __init__(self, kind, record, parent=None, aliases=None):
+        self.kind = kind        # 'module', 'class' or 'function'
+        self.record = record    # qualified name references are recorded for
+        self.parent = parent
+        self.aliases = aliases or dict()    # imported name -> qualified name
+        self.names = set()      # names bound in the scope
+        self.globals = set()
+        self.instance = None    # (name of self or cls argument, qualified class name)
+        self.loads = []         # (dotted name, called)
+
+    def prefix(self):
+        ''' returns the prefix of qualified names defined in the scope '''
+        return self.record + '.'
+
+    def resolve(self, dotted):
+        ''' returns the qualified name of a dotted name loaded in the scope,
+        None for local variables, the dotted name itself if it is unknown '''
+        head, dot, tail = dotted.partition('.')
+        scope = self
+        while scope is not None:
+            if head in scope.globals:
+                while scope.parent is not None:
+                    scope = scope.parent
+                # names declared global are bound in the module
+                scope.names.add(head)
+            if head in scope.aliases:
+                return scope.aliases[head] + dot + tail
+            if scope.instance and head == scope.instance[0]:
+                return tail and scope.instance[1] + dot + tail or None
+            if head in scope.names:
+                if scope.kind == 'function':
+                    return None
+                return scope.prefix() + dotted
+            scope = scope.parent
+            # names of a class are not visible in its methods
+            while scope is not None and scope.kind == 'class' and self is not scope:
+                scope = scope.parent
+        if hasattr(_builtins, head):
+            return '__builtin__.' + dotted
+        return dotted
+
+
+class _StructEncoder(object):
+    ''' encodes code structures in the format of BinaryWriter
+
+    Values are appended to a bytearray by _encode(). Strings, keys of dicts
+    and dicts of strings are written by _string(), _shape() and _shared()
+    of subclasses, which keep the tables of strings, shapes and values.
+    '''
+
+    def _encode(self, value, data):
+
+        kind = type(value)
+        if kind is str or kind is unicode:
+            self._string(value, data)
+        elif kind is dict or isinstance(value, (StructNode, LazyStruct)):
+            for k in value:
+                if type(k) is not str and type(k) is not unicode:
+                    # keys are strings as in JSON
+                    value = dict((_jsonkey(k), v) for k, v in value.iteritems())
+                    break
+            for item in value.itervalues():
+                if type(item) is not str and type(item) is not unicode:
+                    self._dict(value, data)
+                    break
+            else:
+                self._shared(value, data)
+        elif kind is list or kind is tuple:
+            data.append('l')
+            data.extend(_varint(len(value)))
+            for item in value:
+                self._encode(item, data)
+        elif value is None or kind is bool:
+            data.append('c')
+            data.append(value is not None and int(value) + 1 or 0)
+        elif kind is int or kind is long:
+            data.append('i')
+            data.extend(_varint(value < 0 and -value * 2 - 1 or value * 2))
+        elif kind is float:
+            value = repr(value)
+            data.append('f')
+            data.extend(_varint(len(value)))
+            data.extend(value)
+        else:
+            raise TypeError('%r is not serializable' % (value,))
+
+    def _dict(self, value, data):
+
+        keys = tuple(sorted(value))
+        self._shape(keys, data)
+        for k in keys:
+            self._encode(value[k], data)
+
+    @staticmethod
+    def _utf8(value):
+        ''' returns UTF-8 bytes of a string '''
+        if type(value) is unicode:
+            return value.encode('utf-8')
+        # fails as JSON does for strings not in UTF-8
+        value.decode('utf-8')
+        return value
+
+
+class BinaryWriter(_StructEncoder):
+    ''' writes code structures to a file in compact binary format
+
+    The file starts with BINARY_MAGIC, each structure follows as a varint
+    length and encoded value. A value is a tag byte, a varint and, for some
+    tags, more data:
+
+        's' <length> <utf-8>    string, stored in the table of strings
+        'r' <index>             string from the table of strings
+        'D' <count> <keys> ...  dict, keys are stored in the table of shapes
+        'd' <index> ...         dict with keys from the table of shapes,
+                                followed by values in the order of keys
+        'V' 0 <value>           value, stored in the table of values
+        'v' <index>             value from the table of values
+        'l' <count> ...         list or tuple of count values
+        'i' <zigzag int>        integer
+        'f' <length> <repr>     float
+        'c' <0|1|2>             None, False or True
+
+    Tables are shared by all structures in the file, so every string, e.g.
+    docs inherited by many classes, and every dict of strings, e.g. an
+    attribute inherited by many classes, is written once.
+    '''
+
+    def __init__(self, file):
+
+        self.file = file
+        self.strings = dict()
+        self.shapes = dict()
+        self.values = dict()
+        self.file.write(BINARY_MAGIC)
+
+    def write(self, value):
+        ''' write the structure '''
+
+        data = bytearray()
+        self._encode(value, data)
+        self.file.write(_varint(len(data)) + str(data))
+
+    def _string(self, value, data):
+
+        index = self.strings.get(value)
+        if index is None:
+            self.strings[value] = len(self.strings)
+            value = self._utf8(value)
+            data.append('s')
+            data.extend(_varint(len(value)))
+            data.extend(value)
+        else:
+            data.append('r')
+            data.extend(_varint(index))
+
+    def _shape(self, keys, data):
+
+        index = self.shapes.get(keys)
+        if index is None:
+            self.shapes[keys] = len(self.shapes)
+            data.append('D')
+            data.extend(_varint(len(keys)))
+            for k in keys:
+                self._string(k, data)
+        else:
+            data.append('d')
+            data.extend(_varint(index))
+
+    def _shared(self, value, data):
+
+        key = frozenset(value.iteritems())
+        index = self.values.get(key)
+        if index is None:
+            self.values[key] = len(self.values)
+            data.extend('V\x00')
+            self._dict(value, data)
+        else:
+            data.append('v')
+            data.extend(_varint(index))
+
+
+class _StructDecoder(object):
+    ''' decodes code structures written by _StructEncoder
+
+    Strings, keys of dicts and dicts of strings referred to by index are
+    looked up by _string(), _shape() and _shared() of subclasses, the ones
+    defined in place are added to their tables by _define(). With raw,
+    subclasses may return strings as buffers of their UTF-8 bytes.
+    '''
+
+    def _decode(self, data, pos, raw=False):
+        ''' returns the value at pos of data and the position after it '''
+
+        tag = data[pos]
+        n, pos = _readvarint(data, pos + 1)
+        if tag == 'r':
+            return self._string(n, raw), pos
+        if tag == 'v':
+            return self._shared(n, raw), pos
+        if tag == 'd' or tag == 'D':
+            if tag == 'D':
+                keys = []
+                for i in xrange(n):
+                    key, pos = self._decode(data, pos, raw)
+                    keys.append(key)
+                self._define('shapes', keys)
+            else:
+                keys = self._shape(n)
+            items = []
+            for key in keys:
+                item, pos = self._decode(data, pos, raw)
+                items.append(item)
+            return dict(zip(keys, items)), pos
+        if tag == 's':
+            value = data[pos:pos + n].decode('utf-8')
+            self._define('strings', value)
+            return value, pos + n
+        if tag == 'V':
+            value, pos = self._decode(data, pos, raw)
+            self._define('values', value)
+            return value, pos
+        if tag == 'l':
+            items = []
+            for i in xrange(n):
+                item, pos = self._decode(data, pos, raw)
+                items.append(item)
+            return items, pos
+        if tag == 'i':
+            return (n >> 1) ^ -(n & 1), pos
+        if tag == 'c':
+            return (None, False, True)[n], pos
+        if tag == 'f':
+            return float(data[pos:pos + n]), pos + n
+        raise ValueError('Unknown tag %r in pycode file' % tag)
+
+
+class BinaryReader(_StructDecoder):
+    ''' reads code structures written by BinaryWriter
+
+    Strings are read as unicode, tuples as lists, as from JSON. Equal dicts
+    of strings are read as the same object.
+    '''
+
+    def __init__(self, file):
+
+        self.file = file
+        self.strings = list()
+        self.shapes = list()
+        self.values = list()
+        if self.file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError('Not a pycode binary file')
+
+    def read(self):
+        ''' returns the next structure, raises EOFError at the end of file '''
+
+        size, shift = 0, 0
+        while True:
+            byte = self.file.read(1)
+            if not byte:
+                if shift:
+                    raise ValueError('Truncated pycode binary file')
+                raise EOFError
+            size |= (ord(byte) & 0x7f) << shift
+            if not ord(byte) & 0x80:
+                break
+            shift += 7
+        data = self.file.read(size)
+        if len(data) != size:
+            raise ValueError('Truncated pycode binary file')
+        try:
+            return self._decode(data, 0)[0]
+        except (IndexError, UnicodeDecodeError):
+            raise ValueError('Corrupted pycode binary file')
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except EOFError:
+                return
+
+    def _string(self, index, raw):
+        return self.strings[index]
+
+    def _shape(self, index):
+        return self.shapes[index]
+
+    def _shared(self, index, raw):
+        return self.values[index]
+
+    def _define(self, table, value):
+        getattr(self, table).append(value)
+
+
+class DumpWriter(_StructEncoder):
+    ''' writes code structures to a file with an index of qualified names,
+    for random access with DumpReader
+
+    The file starts with DUMP_MAGIC and a header of ten little-endian 64-bit
+    integers: the end of the structures, and the position and the number of
+    items of the tables of strings, shapes, values and names, then the
+    position of the targets. Structures follow the header as in BinaryWriter,
+    a varint length and encoded value, but the tables are written after them,
+    and values only refer to the tables:
+
+        'r' <index>             string from the table of strings
+        'd' <index> ...         dict with keys from the table of shapes,
+                                followed by values in the order of keys
+        'v' <index>             value from the table of values
+        'l', 'i', 'f', 'c'      as in BinaryWriter
+
+    Each table is its items one after another, followed by the positions
+    of the items and of the end of the last one. Strings are UTF-8, shapes
+    a varint count and varint indexes of the strings of keys, values are
+    encoded dicts of strings. Names are the qualified names of structures
+    and of their classes, functions, data and class attributes (see
+    codeitems()), sorted by UTF-8 bytes, the targets the positions of their
+    encoded values.
+
+    The file must be seekable, the header is written by finish().
+    '''
+
+    def __init__(self, file):
+
+        self.file = file
+        self.strings = dict()
+        self.shapes = dict()
+        self.shapedata = list()
+        self.values = dict()
+        self.valuedata = list()
+        self.names = dict()
+        self.offset = len(DUMP_MAGIC) + _DUMP_HEADER.size
+        self.file.write(DUMP_MAGIC + _DUMP_HEADER.pack(*(0,) * 10))
+
+    def write(self, value):
+        ''' write the structure, result of struct_code() '''
+
+        # names of members by their identity, a member may have several
+        # names, e.g. a class and its alias in a module
+        self._marks, self._positions = dict(), dict()
+        if 'type' in value and 'name' in value:
+            for name, member, kind in _codemembers(value):
+                self._marks.setdefault(id(member), []).append(name)
+        data = bytearray()
+        self._encode(value, data)
+        head = _varint(len(data))
+        start = self.offset + len(head)
+        self.file.write(head + str(data))
+        for name, position in self._positions.iteritems():
+            self.names[name] = start + position
+        if 'name' in value:
+            self.names[value['name']] = start
+        self.offset = start + len(data)
+
+    def _encode(self, value, data):
+
+        for name in self._marks.get(id(value), ()):
+            self._positions[name] = len(data)
+        _StructEncoder._encode(self, value, data)
+
+    def _index(self, value):
+        ''' returns the index of a string in the table of strings '''
+
+        index = self.strings.get(value)
+        if index is None:
+            self._utf8(value)
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def _string(self, value, data):
+
+        data.append('r')
+        data.extend(_varint(self._index(value)))
+
+    def _shape(self, keys, data):
+
+        index = self.shapes.get(keys)
+        if index is None:
+            index = self.shapes[keys] = len(self.shapedata)
+            self.shapedata.append(_varint(len(keys)) +
+                                    ''.join(_varint(self._index(k)) for k in keys))
+        data.append('d')
+        data.extend(_varint(index))
+
+    def _shared(self, value, data):
+
+        key = frozenset(value.iteritems())
+        index = self.values.get(key)
+        if index is None:
+            encoded = bytearray()
+            self._dict(value, encoded)
+            index = self.values[key] = len(self.valuedata)
+            self.valuedata.append(str(encoded))
+        data.append('v')
+        data.extend(_varint(index))
+
+    def _table(self, items):
+        ''' writes items and their positions, returns the position of these '''
+
+        positions = [self.offset]
+        for item in items:
+            self.file.write(item)
+            positions.append(positions[-1] + len(item))
+        self.file.write(struct.pack('<%dQ' % len(positions), *positions))
+        self.offset = positions[-1] + 8 * len(positions)
+        return positions[-1]
+
+    def finish(self):
+        ''' write the tables and the header, no structure can be written after it '''
+
+        strings = sorted(self.strings.iteritems(), key=lambda item: item[1])
+        strings = [self._utf8(s) for s, index in strings]
+        names = sorted((self._utf8(name), target) for name, target in self.names.iteritems())
+        header = [self.offset]
+        for items in (strings, self.shapedata, self.valuedata, [name for name, target in names]):
+            header += [self._table(items), len(items)]
+        header.append(self.offset)
+        self.file.write(struct.pack('<%dQ' % len(names), *[target for name, target in names]))
+        self.file.seek(len(DUMP_MAGIC))
+        self.file.write(_DUMP_HEADER.pack(*header))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+
+class DumpReader(_StructDecoder):
+    ''' reads code structures written by DumpWriter by qualified name
+
+    The file is mapped into memory, get() decodes only the structure of the
+    name, strings of the mapping are decoded on first use. file may be a
+    path or a file object.
+    '''
+
+    def __init__(self, file):
+
+        import mmap
+
+        if isinstance(file, basestring):
+            file = open(file, 'rb')
+        self.file = file
+        try:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError('Not a pycode dump file')
+        if self.data[:len(DUMP_MAGIC)] != DUMP_MAGIC:
+            self.data.close()
+            raise ValueError('Not a pycode dump file')
+        header = _DUMP_HEADER.unpack_from(self.data, len(DUMP_MAGIC))
+        self.end, self.targets = header[0], header[-1]
+        self.tables = dict(zip(('strings', 'shapes', 'values', 'names'),
+                                zip(header[1:-1:2], header[2:-1:2])))
+        self.strings = dict()
+        self.shapes = dict()
+        self.values = dict()
+
+    def __len__(self):
+        return self.tables['names'][1]
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def __iter__(self):
+        return self.names()
+
+    def _item(self, table, index):
+        ''' returns (start, end) of the item in the table '''
+
+        position, count = self.tables[table]
+        if not 0 <= index < count:
+            raise ValueError('Corrupted pycode dump file')
+        return struct.unpack_from('<2Q', self.data, position + 8 * index)
+
+    def _name(self, index):
+        start, end = self._item('names', index)
+        return self.data[start:end]
+
+    def _find(self, name):
+        ''' returns the index of name in the table of names, or None '''
+
+        import bisect
+
+        if type(name) is unicode:
+            name = name.encode('utf-8')
+        index = bisect.bisect_left(_DumpNames(self), name)
+        if index < len(self) and self._name(index) == name:
+            return index
+        return None
+
+    def names(self, prefix=''):
+        ''' generates qualified names starting with prefix, in the order of
+        UTF-8 bytes '''
+
+        import bisect
+
+        if type(prefix) is unicode:
+            prefix = prefix.encode('utf-8')
+        for index in xrange(bisect.bisect_left(_DumpNames(self), prefix), len(self)):
+            name = self._name(index)
+            if not name.startswith(prefix):
+                break
+            yield name.decode('utf-8')
+
+    def string(self, index, raw=False):
+        ''' returns the string of the table of strings, or with raw, its
+        UTF-8 bytes as a buffer of the mapping, without copying them '''
+
+        if raw:
+            start, end = self._item('strings', index)
+            return buffer(self.data, start, end - start)
+        value = self.strings.get(index)
+        if value is None:
+            start, end = self._item('strings', index)
+            value = self.strings[index] = self.data[start:end].decode('utf-8')
+        return value
+
+    def get(self, name, raw=False):
+        ''' returns the structure of qualified name, as returned by
+        struct_code() for the names of results, or a member of it for the
+        names of classes, functions, data and class attributes, or None
+        if name is not in the file. With raw, strings which are not keys
+        are buffers of their UTF-8 bytes in the mapping. '''
+
+        index = self._find(name)
+        if index is None:
+            return None
+        position = struct.unpack_from('<Q', self.data, self.targets + 8 * index)[0]
+        return self._read(position, raw)
+
+    def results(self):
+        ''' generates all structures written to the file, in order '''
+
+        position = len(DUMP_MAGIC) + _DUMP_HEADER.size
+        while position < self.end:
+            size, position = _readvarint(self.data, position)
+            yield self._read(position)
+            position += size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def _read(self, position, raw=False):
+
+        try:
+            return self._decode(self.data, position, raw)[0]
+        except (IndexError, UnicodeDecodeError):
+            raise ValueError('Corrupted pycode dump file')
+
+    def _string(self, index, raw):
+        return self.string(index, raw)
+
+    def _shape(self, index):
+
+        keys = self.shapes.get(index)
+        if keys is None:
+            start, end = self._item('shapes', index)
+            count, position = _readvarint(self.data, start)
+            keys = []
+            for i in xrange(count):
+                key, position = _readvarint(self.data, position)
+                keys.append(self.string(key))
+            self.shapes[index] = keys
+        return keys
+
+    def _shared(self, index, raw):
+
+        value = not raw and self.values.get(index) or None
+        if value is None:
+            start, end = self._item('values', index)
+            value = self._read(start, raw)
+            if not raw:
+                self.values[index] = value
+        return value
+
+    def _define(self, table, value):
+        # tables of dumps are written after the structures
+        raise ValueError('Corrupted pycode dump file')
+
+
+class _DumpNames(object):
+    ''' the sorted table of names of DumpReader as a sequence, for bisect '''
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index):
+        return self.reader._name(index)
+
+
+# ------------------------------------------------
+# Utils
+# ------------------------------------------------
+
+def profiled(profiler, event, name, func, *args):
+    """Call func(*args), timed by profiler under event and name, if given."""
+    if profiler is None:
+        return func(*args)
+    return profiler.call(event, name, func, *args)
+
+def assemble(items):
+    """Build module structure from (section, item) pairs, as generated by
+    iter_module() methods: items of named sections are collected in lists,
+    items without section are fields of the structure."""
+    result = ModuleNode()
+    for section, item in items:
+        if section:
+            result.setdefault(section, []).append(item)
         else:
-            flat_dict[root_name] = source
-    elif isinstance(source, dict):
-        for k,v in source.items():
-            if root_name:
-                new_root_name = "%s.%s" % (root_name, k)
+            result.update(item)
+    return result
+
+def iterflat(root_name, source, removeEmptyFields=False):
+    ''' generates (path, value) pairs of the "flat" form of the complex
+    hierarchical dictionary, see dict2flat()
+
+    Nested dicts and lists are walked iteratively, without recursion. Lists of
+    simple elements (not lists, tuples, dicts) are values. None values are
+    skipped, with removeEmptyFields empty strings and lists are skipped too.
+    '''
+    stack = [(root_name, source)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, (dict, StructNode, LazyStruct)):
+            items = [("%s.%s" % (path, k) if path else "%s" % k, v) for k, v in value.items()]
+            items.reverse()
+            stack.extend(items)
+        elif isinstance(value, (list, tuple)):
+            for e in value:
+                if isinstance(e, (list, tuple, dict, StructNode, LazyStruct)):
+                    items = [("%s[%d]" % (path, i), e) for i, e in enumerate(value)]
+                    items.reverse()
+                    stack.extend(items)
+                    break
             else:
-                new_root_name = "%s" % k
-            for kk, vv in dict2flat(new_root_name,v).items():
-                flat_dict[kk] = vv
-    else:
-        if source is not None:
-            flat_dict[root_name] = source
-    return flat_dict
+                if value or not removeEmptyFields:
+                    yield path, value
+        elif value is not None:
+            if value != '' or not removeEmptyFields:
+                yield path, value
+
+def dict2flat(root_name, source, removeEmptyFields=False, sink=None):
+    ''' returns a simplified "flat" form of the complex hierarchical dictionary
+
+    If sink is given, sink(path, value) is called for every flat item
+    instead, without building the flat dictionary.
+    '''
+    items = iterflat(root_name, source, removeEmptyFields)
+    if sink is None:
+        return dict(items)
+    for path, value in items:
+        sink(path, value)
 
 def importfile(path):
     """Import a Python source file or compiled file given its path."""
@@ -405,10 +2953,51 @@ def classname(obj, modname):
         name = obj.__module__ + '.' + name
     return name
 
-def getdoc(obj):
-    """Get the doc string or comments for an object."""
-    result = inspect.getdoc(obj) or inspect.getcomments(obj)
-    return result and re.sub('^ *\n', '', result.rstrip()) or ''
+def getdoc(obj, sources=None):
+    """Get the doc string or comments for an object.
+
+    Source files are scanned for comments once per sources, a dict of
+    file names and SourceComments, see getcomments()."""
+    result = inspect.getdoc(obj) or getcomments(obj, sources)
+    return result and _LEADING_BLANK_LINE.sub('', result.rstrip()) or ''
+
+def getcomments(obj, sources=None):
+    """Get the comments right above the definition of an object, or at the
+    top of the file of a module, the same as inspect.getcomments() does.
+    The file is scanned once, its SourceComments are kept in sources."""
+    import linecache
+
+    try:
+        filename = inspect.getfile(obj)
+    except TypeError:
+        return None
+    if sources is None:
+        sources = dict()
+    if filename not in sources:
+        sourcefile = inspect.getsourcefile(obj)
+        lines = None
+        if sourcefile or filename[:1] + filename[-1:] == '<>':
+            sourcefile = sourcefile or filename
+            module = inspect.getmodule(obj, sourcefile)
+            linecache.checkcache(sourcefile)
+            lines = (module and linecache.getlines(sourcefile, module.__dict__) or
+                        linecache.getlines(sourcefile))
+        sources[filename] = lines and SourceComments(lines) or None
+    comments = sources[filename]
+    if comments is None:
+        return None
+
+    if inspect.ismodule(obj):
+        return comments.module
+    if inspect.isclass(obj):
+        lnum = comments.classline(obj.__name__)
+    else:
+        if inspect.ismethod(obj): obj = obj.im_func
+        if inspect.isfunction(obj): obj = obj.func_code
+        if inspect.istraceback(obj): obj = obj.tb_frame
+        if inspect.isframe(obj): obj = obj.f_code
+        lnum = comments.codeline(obj.co_firstlineno)
+    return lnum and comments.above(lnum)
 
 def getdocloc(obj):
     """Return the location of module docs or None"""
@@ -456,10 +3045,566 @@ def visiblename(name, all=None, obj=None):
     else:
         return not name.startswith('_')
 
-def struct_code(thing):
-    """ returns code structure, given an object or a path to an object."""
+def walkbody(body):
+    """Iterate over statements of a module or class body, including
+    statements nested in conditional and exception handling blocks."""
+    for node in body:
+        yield node
+        if isinstance(node, ast.If):
+            nested = node.body + node.orelse
+        elif isinstance(node, ast.TryExcept):
+            nested = node.body + node.orelse
+            for handler in node.handlers:
+                nested = nested + handler.body
+        elif isinstance(node, ast.TryFinally):
+            nested = node.body + node.finalbody
+        else:
+            continue
+        for child in walkbody(nested):
+            yield child
+
+def literalvalue(node, default=None):
+    """Return the value of a literal expression node or default."""
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError):
+        # TypeError for unhashable keys of dicts and items of sets
+        return default
+
+def dottedname(node):
+    """Return the dotted name of a Name or Attribute node or None."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        head = dottedname(node.value)
+        if head is not None:
+            return head + '.' + node.attr
+    return None
+
+def routinekind(node):
+    """Classify a function definition inside a class body by its decorators,
+    the same way inspect.classify_class_attrs() does."""
+    for decorator in node.decorator_list:
+        name = dottedname(decorator) or ''
+        if name == 'staticmethod':
+            return 'static method'
+        if name == 'classmethod':
+            return 'class method'
+        if name == 'property' or name.endswith(('.getter', '.setter', '.deleter')):
+            return 'property'
+    return 'method'
+
+def formatargs(args):
+    """Format ast.arguments the way inspect.formatargspec() does."""
+
+    def formatarg(arg):
+        if isinstance(arg, ast.Tuple):
+            names = [formatarg(elt) for elt in arg.elts]
+            if len(names) == 1:
+                return '(' + names[0] + ',)'
+            return '(' + ', '.join(names) + ')'
+        return getattr(arg, 'id', '?')
+
+    def formatvalue(node):
+        try:
+            return '=' + repr(ast.literal_eval(node))
+        except (ValueError, TypeError):
+            return '=' + (dottedname(node) or '...')
+
+    specs = []
+    firstdefault = len(args.args) - len(args.defaults)
+    for i, arg in enumerate(args.args):
+        spec = formatarg(arg)
+        if i >= firstdefault:
+            spec = spec + formatvalue(args.defaults[i - firstdefault])
+        specs.append(spec)
+    if args.vararg is not None:
+        specs.append('*' + args.vararg)
+    if args.kwarg is not None:
+        specs.append('**' + args.kwarg)
+    return '(' + ', '.join(specs) + ')'
+
+def c3merge(seqs):
+    """Merge linearizations of base classes by C3 algorithm.
+    Raises TypeError if consistent order does not exist."""
+    result = []
+    seqs = [list(seq) for seq in seqs if seq]
+    while seqs:
+        for seq in seqs:
+            head = seq[0]
+            if not [s for s in seqs if head in s[1:]]:
+                break
+        else:
+            raise TypeError('Cannot create a consistent method resolution order')
+        result.append(head)
+        seqs = [seq[1:] if seq[0] == head else seq for seq in seqs]
+        seqs = [seq for seq in seqs if seq]
+    return result
+
+def parsefile(path):
+    """Parse a Python source file given its path, without executing it."""
+    file = open(path, 'rU')
+    try:
+        source = file.read()
+    finally:
+        file.close()
+    return parsesource(source, path)
+
+def parsesource(source, path='<string>'):
+    """Parse Python source code read from path, without executing it.
+    Lines must end with '\\n', as in files opened with universal newlines."""
+    try:
+        return ast.parse(source, path)
+    except (SyntaxError, TypeError):
+        raise ErrorDuringImport(path, sys.exc_info())
+
+def locatesource(path):
+    """Locate the source file of a module by dotted path, without importing it.
+
+    returns (filename, module name, remaining parts of the path) or None"""
+    import imp
+
+    parts = [part for part in path.split('.') if part]
+    filename, searchpath, n = None, None, 0
+    while n < len(parts):
+        try:
+            file, pathname, (suffix, mode, kind) = imp.find_module(parts[n], searchpath)
+        except ImportError:
+            break
+        if file:
+            file.close()
+        if kind == imp.PKG_DIRECTORY:
+            pathname = os.path.join(pathname, '__init__.py')
+            if not os.path.isfile(pathname):
+                break
+            filename, searchpath, n = pathname, [os.path.dirname(pathname)], n + 1
+        elif kind == imp.PY_SOURCE:
+            filename, n = pathname, n + 1
+            break
+        else:
+            break
+    if filename is None:
+        return None
+    return filename, '.'.join(parts[:n]), parts[n:]
+
+def sourcefile(thing):
+    """Return the source file of a module given its path or a dotted path
+    to an object in the module, or None if there is no source."""
+    if os.path.isfile(thing):
+        return thing
+    located = locatesource(thing)
+    if located:
+        return located[0]
+    return None
+
+_SKIPPED_LINE = re.compile(r'\s*((else|finally|try)\s*:)?\s*(#.*)?$')
+
+def sourcelocations(filename, modname, tree=None, source=None):
+    """Return locations of classes, functions, methods and attributes defined
+    in a source file, as {qualified name: [line, col, end line, end col]}.
+
+    Lines are numbered from 1 and columns from 0, as in ast. A definition ends
+    on the last line of code before the next statement of the same block.
+    tree is the parsed source file, the file is parsed if it is not given.
+    source is the text of the file, the file is read if it is not given."""
+    if source is None:
+        file = open(filename, 'rU')
+        try:
+            source = file.read()
+        finally:
+            file.close()
+    if tree is None:
+        tree = parsesource(source, filename)
+    lines = source.splitlines()
+    locations = dict()
+
+    def record(name, node, limit):
+        end = min(limit, len(lines))
+        while end > node.lineno and _SKIPPED_LINE.match(lines[end - 1]):
+            end -= 1
+        locations[name] = [node.lineno, node.col_offset, end, len(lines[end - 1].rstrip())]
+
+    def visit(body, limit, prefix):
+        for i, node in enumerate(body):
+            if i + 1 < len(body):
+                stop = body[i + 1].lineno - 1
+            else:
+                stop = limit
+            if isinstance(node, ast.ClassDef):
+                record(prefix + node.name, node, stop)
+                visit(node.body, stop, prefix + node.name + '.')
+            elif isinstance(node, ast.FunctionDef):
+                record(prefix + node.name, node, stop)
+            elif isinstance(node, ast.Assign):
+                targets = list(node.targets)
+                while targets:
+                    target = targets.pop(0)
+                    if isinstance(target, ast.Name):
+                        record(prefix + target.id, node, stop)
+                    elif isinstance(target, (ast.Tuple, ast.List)):
+                        targets.extend(target.elts)
+            elif isinstance(node, ast.If):
+                visit(node.body, node.orelse and node.orelse[0].lineno - 1 or stop, prefix)
+                visit(node.orelse, stop, prefix)
+            elif isinstance(node, ast.TryExcept):
+                ends = [handler.lineno - 1 for handler in node.handlers]
+                ends.append(node.orelse and node.orelse[0].lineno - 1 or stop)
+                visit(node.body, ends[0], prefix)
+                for handler, end in zip(node.handlers, ends[1:]):
+                    visit(handler.body, end, prefix)
+                visit(node.orelse, stop, prefix)
+            elif isinstance(node, ast.TryFinally):
+                visit(node.body, node.finalbody[0].lineno - 1, prefix)
+                visit(node.finalbody, stop, prefix)
+
+    visit(tree.body, len(lines), modname + '.')
+    return locations
+
+def _add_locations(result, filename, modname, tree=None, profiler=None, source=None):
+    """Add locations of the analyzed object and of its members defined in
+    the source file to result, see sourcelocations()."""
+    if source is None and (not filename.endswith('.py') or not os.path.isfile(filename)):
+        return
+    locations = profiled(profiler, 'locate', None, sourcelocations, filename, modname, tree,
+                            source)
+    name = result['name']
+    if name != modname:
+        locations = dict((k, v) for k, v in locations.items()
+                            if k == name or k.startswith(name + '.'))
+    result['locations'] = locations
+
+def coderefs(tree, modname, package=None):
+    """Return names referenced and called by the code of a module, as
+    {qualified name: {'calls': [names], 'names': [names]}}.
+
+    References are recorded for the module, classes, functions and methods,
+    nested functions and lambdas count for the function they are defined in.
+    Names are resolved to qualified names through imports, definitions of the
+    module, 'self' and 'cls' arguments of methods and built-in names. Local
+    variables and attributes of other expressions are skipped, unknown names
+    are kept as written. The tree is traversed once."""
+
+    code = AstCodeStruct(tree, modname, package)
+    module = _RefScope('module', modname, aliases=dict(code.imports))
+    module.names.update(('__name__', '__file__', '__doc__', '__package__', '__path__'))
+    scopes = [module]
+
+    def bind(target, scope):
+        if isinstance(target, ast.Name):
+            scope.names.add(target.id)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                bind(elt, scope)
+
+    def dottedload(node):
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+        parts.append(node.id)
+        return '.'.join(reversed(parts))
+
+    def function(node, scope, record):
+        inner = _RefScope('function', record, scope)
+        scopes.append(inner)
+        args = node.args
+        for arg in args.args:
+            bind(arg, inner)
+        inner.names.update(name for name in (args.vararg, args.kwarg) if name)
+        return inner
+
+    # the order of traversal does not matter, names are resolved at the end
+    stack = [(node, module) for node in tree.body]
+    AST, Name, Attribute, Call, Load = ast.AST, ast.Name, ast.Attribute, ast.Call, ast.Load
+    while stack:
+        node, scope = stack.pop()
+        kind = type(node)
+        children = None
+        if kind is Name:
+            if type(node.ctx) is Load:
+                if node.id not in ('None', 'True', 'False'):
+                    scope.loads.append((node.id, False))
+            else:
+                scope.names.add(node.id)
+        elif kind is Attribute and type(node.ctx) is Load:
+            dotted = dottedload(node)
+            if dotted is None:
+                stack.append((node.value, scope))
+            else:
+                scope.loads.append((dotted, False))
+        elif kind is Call:
+            dotted = dottedload(node.func)
+            children = node.args + [keyword.value for keyword in node.keywords]
+            children.extend(arg for arg in (node.starargs, node.kwargs) if arg is not None)
+            if dotted is None:
+                children.append(node.func)
+            else:
+                scope.loads.append((dotted, True))
+        elif kind is ast.FunctionDef:
+            scope.names.add(node.name)
+            record = scope.record if scope.kind == 'function' else scope.prefix() + node.name
+            inner = function(node, scope, record)
+            decorators = [dottedname(d) for d in node.decorator_list]
+            if (scope.kind == 'class' and node.args.args and
+                    type(node.args.args[0]) is Name and 'staticmethod' not in decorators):
+                inner.instance = (node.args.args[0].id, scope.record)
+            stack.extend((child, inner) for child in node.body)
+            children = node.decorator_list + node.args.defaults
+        elif kind is ast.ClassDef:
+            scope.names.add(node.name)
+            record = scope.record if scope.kind == 'function' else scope.prefix() + node.name
+            inner = _RefScope('class', record, scope)
+            scopes.append(inner)
+            stack.extend((child, inner) for child in node.body)
+            children = node.decorator_list + node.bases
+        elif kind is ast.Lambda:
+            inner = function(node, scope, scope.record)
+            stack.append((node.body, inner))
+            children = node.args.defaults
+        elif kind is ast.Global:
+            scope.globals.update(node.names)
+        elif kind is ast.Import and scope is not module:
+            for alias in node.names:
+                if alias.asname:
+                    scope.aliases[alias.asname] = alias.name
+                else:
+                    head = alias.name.split('.')[0]
+                    scope.aliases[head] = head
+        elif kind is ast.ImportFrom and scope is not module:
+            imported = code.absmodule(node.module, node.level)
+            for alias in node.names:
+                if alias.name != '*':
+                    scope.aliases[alias.asname or alias.name] = '%s.%s' % (imported, alias.name)
+        else:
+            for field in node._fields:
+                # contexts and operators hold no names
+                if field in ('ctx', 'op', 'ops'):
+                    continue
+                value = getattr(node, field, None)
+                if isinstance(value, AST):
+                    stack.append((value, scope))
+                elif type(value) is list:
+                    stack.extend((item, scope) for item in value if isinstance(item, AST))
+        if children:
+            stack.extend((child, scope) for child in children)
+
+    refs = dict()
+    for scope in scopes:
+        for dotted, called in scope.loads:
+            name = scope.resolve(dotted)
+            if name is None:
+                continue
+            if scope.record not in refs:
+                refs[scope.record] = {'calls': set(), 'names': set()}
+            refs[scope.record][called and 'calls' or 'names'].add(name)
+    for record in refs.values():
+        record['names'] -= record['calls']
+        for key in record:
+            record[key] = sorted(record[key])
+    return refs
+
+def _add_refs(result, filename, modname, tree=None, profiler=None):
+    """Add names referenced by the analyzed object and by its members to
+    result, see coderefs()."""
+    if tree is None:
+        if not filename.endswith('.py') or not os.path.isfile(filename):
+            return
+        tree = profiled(profiler, 'parse', None, parsefile, filename)
+    package = os.path.basename(filename).startswith('__init__.') and modname or None
+    refs = profiled(profiler, 'refs', None, coderefs, tree, modname, package)
+    name = result['name']
+    if name != modname:
+        refs = dict((k, v) for k, v in refs.items() if k == name or k.startswith(name + '.'))
+    result['refs'] = refs
+
+def struct_code(thing, engine='inspect', cache=None, profiler=None, lazy=False, refs=False,
+                locations=False):
+    """ returns code structure, given an object or a path to an object.
+
+    If locations and the object is defined in a Python source file,
+    'locations' maps qualified names of the object and of its members to
+    their positions in the 'file', see sourcelocations(). With engine 'ast'
+    the source code is
+    parsed instead of being imported, see struct_source(). If cache
+    (StructCache) is given, results for unchanged source files are taken
+    from it. If profiler (Profiler) is given, the analysis is timed by
+    phases, modules and classes. If lazy, members of modules and classes
+    in 'struct' are analyzed on first access and the cache is not used,
+    see LazyStruct and expandstruct(). Structures of modules, classes,
+    routines and data are mappings (StructNode), use dumpjson() for JSON.
+    If refs, 'refs' maps qualified names of the object and of its members
+    to names they reference and call, see coderefs()."""
+    if cache is not None and isinstance(thing, str) and not lazy:
+        filename = sourcefile(thing)
+        if filename:
+            key = _cachekey(engine, refs, locations)
+            result = cache.get(thing, key, filename)
+            if result is None:
+                result = struct_code(thing, engine, None, profiler, refs=refs,
+                                        locations=locations)
+                cache.put(thing, key, filename, result)
+            return result
+
+    result, code_struct, args = _code_target(thing, engine, profiler, lazy, refs, locations)
+    result['struct'] = code_struct.struct(*args)
+    return result
+
+def expandstruct(struct, depth=None, select=None):
+    """ returns code structure as plain dicts and lists, analyzing members
+    of lazy structures as needed, see LazyStruct.
+
+    Members of modules ('classes', 'funcs', 'data') and of classes
+    ('class_attrs', 'inherited attrs') are levels of the structure tree,
+    only depth levels are included if depth is given. If select is given,
+    only members on paths in select are included, a path is a dotted list
+    of member keys and names, e.g. 'classes.JSONDecoder.class_attrs.decode'.
+    Members at the end of a path are included with all their members."""
+    if select is not None:
+        select = [path.split('.') for path in select]
+    return _expand(struct, depth, select)
+
+def _expand(struct, depth, paths):
+    """Expand a structure or a list of members, see expandstruct().
+    paths are lists of keys and names below struct, None for all."""
+    if paths is not None and [] in paths:
+        paths = None
+    if isinstance(struct, list):
+        result = []
+        for item in struct:
+            if paths is None:
+                result.append(_expand(item, depth, None))
+            elif isinstance(item, collections.Mapping):
+                name = itemname(item)
+                subpaths = [path[1:] for path in paths if path[0] == name]
+                if subpaths:
+                    result.append(_expand(item, depth, subpaths))
+        return result
+    if not isinstance(struct, collections.Mapping):
+        return struct
+    subdepth = depth
+    if depth is not None:
+        subdepth = depth - 1
+    result = dict()
+    # members first, loading of lazy structures adds other fields
+    for key in _MODULE_MEMBERS + _CLASS_MEMBERS:
+        if isinstance(struct, LazyStruct):
+            if key not in struct.fields and (struct.loaded or key not in struct.lazykeys):
+                continue
+        elif key not in struct:
+            continue
+        if depth is not None and depth < 1:
+            continue
+        if paths is None:
+            subpaths = None
+        else:
+            subpaths = [path[1:] for path in paths if path[0] == key]
+            if not subpaths:
+                continue
+        value = struct.get(key)
+        if value is not None:
+            result[key] = _expand(value, subdepth, subpaths)
+    if isinstance(struct, LazyStruct):
+        struct = struct.fields
+    for key, value in struct.items():
+        if key not in _MODULE_MEMBERS and key not in _CLASS_MEMBERS:
+            result[key] = _expand(value, depth, None)
+    return result
+
+def itemname(item):
+    """Return the name of a member in code structure: a class, routine or
+    descriptor structure, or {name: value} of a data member."""
+    if 'type' in item and 'name' in item:
+        return item['name']
+    for key in item:
+        if key != 'belongs_to':
+            return key
+
+def sharestrings(result, table):
+    """ returns a copy of result of struct_code() where docs and class names
+    in 'struct' are replaced by their ids in table (StringTable). 'strings'
+    lists strings added to the table by the result, so ids refer to strings
+    of all results sharing the table, in order, see expandstrings()."""
+
+    def share(value):
+        if isinstance(value, (list, tuple)):
+            return [share(item) for item in value]
+        if not isinstance(value, collections.Mapping):
+            return value
+        described = 'type' in value and 'name' in value
+        shared = dict()
+        for key, item in value.iteritems():
+            if not described or key not in _SHARED_FIELDS:
+                shared[key] = share(item)
+            elif isinstance(item, list):
+                shared[key] = [table.index(text) for text in item]
+            elif isinstance(item, basestring):
+                shared[key] = table.index(item)
+            else:
+                shared[key] = item
+        return shared
+
+    start = len(table)
+    result = dict(result)
+    if result.get('struct') is not None:
+        result['struct'] = share(result['struct'])
+    result['strings'] = table.texts[start:]
+    return result
+
+def expandstrings(result, strings):
+    """ returns a copy of result of sharestrings() with docs and class names
+    in 'struct' instead of their ids. strings is the list of strings of
+    previous results, it is extended by 'strings' of the result."""
+
+    def expand(value):
+        if isinstance(value, list):
+            return [expand(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        described = 'type' in value and 'name' in value
+        expanded = dict()
+        for key, item in value.iteritems():
+            if not described or key not in _SHARED_FIELDS:
+                expanded[key] = expand(item)
+            elif isinstance(item, list):
+                expanded[key] = [strings[index] for index in item]
+            elif isinstance(item, (int, long)):
+                expanded[key] = strings[item]
+            else:
+                expanded[key] = item
+        return expanded
+
+    result = dict(result)
+    strings.extend(result.pop('strings', ()))
+    if result.get('struct') is not None:
+        result['struct'] = expand(result['struct'])
+    return result
+
+def filesignature(filename):
+    """Return (size, modification time) of a file, or None if it is missing."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+def _cachekey(engine, refs=False, locations=False):
+    """Key of results of an engine in StructCache: results with references
+    or locations are cached apart from the ones without."""
+    return engine + (locations and '+locations' or '') + (refs and '+refs' or '')
+
+def _code_target(thing, engine, profiler=None, lazy=False, refs=False, locations=False):
+    """Prepare analysis of a thing by an engine.
+
+    returns (result without struct, engine instance, arguments of its struct())"""
+    if engine == 'ast':
+        return _source_target(thing, profiler, lazy, refs, locations)
+    elif engine != 'inspect':
+        raise ValueError('Unknown engine: %r' % engine)
+
     result = dict()
-    obj, result['name'] = resolve(thing)    
+    obj, result['name'] = profiled(profiler, 'import', None, resolve, thing)
     result['type'], name = describe(obj)
     module = inspect.getmodule(obj)
     result['module_name'] = module.__name__
@@ -469,6 +3614,11 @@ def struct_code(thing):
         result['file'] = inspect.getabsfile(obj)
     except TypeError:
         result['file'] = '(built-in)'
+    else:
+        if locations:
+            _add_locations(result, result['file'], result['module_name'], profiler=profiler)
+        if refs:
+            _add_refs(result, result['file'], result['module_name'], profiler=profiler)
     
     if type(obj) is _OLD_INSTANCE_TYPE:
         # If the passed object is an instance of an old-style class,
@@ -483,10 +3633,808 @@ def struct_code(thing):
         # If the passed object is a piece of data or an instance,
         # document its available methods instead of its value.
         obj = type(obj)
-    code_struct = PyCodeStruct()
-    result['struct'] = code_struct.struct(obj, result['name'])
+    return result, PyCodeStruct(profiler=profiler, lazy=lazy), (obj, result['name'])
+
+def struct_source(thing):
+    """ returns code structure, given a path to a source file or a dotted path
+    to a module, class or function. The module is parsed, never imported, so
+    its top-level code is not executed. Only names defined in the module
+    itself are reported, imported classes and functions are not."""
+    result, code_struct, args = _source_target(thing)
+    result['struct'] = code_struct.struct(*args)
     return result
-        
+
+def _source_target(thing, profiler=None, lazy=False, refs=False, locations=False):
+    """Prepare analysis of a thing by the ast engine, see _code_target()."""
+    if os.path.isfile(thing):
+        filename, parts = thing, []
+        modname = name = os.path.splitext(os.path.basename(thing))[0]
+    else:
+        located = locatesource(thing)
+        if not located:
+            raise ImportError, 'Cannot detect code structure for %r' % thing
+        filename, modname, parts = located
+        name = thing
+
+    tree = profiled(profiler, 'parse', None, parsefile, filename)
+    return _tree_target(name, tree, filename, modname, parts, profiler, lazy, refs,
+                        locations)
+
+def _tree_target(name, tree, filename, modname, parts=(), profiler=None, lazy=False,
+                 refs=False, locations=False, source=None):
+    """Prepare analysis of the object at parts of a parsed source file by
+    the ast engine, see _code_target(). source is the text of the file if
+    it is not on disk, e.g. read from an archive."""
+    result = dict()
+    result['name'] = name
+    node, parent = tree, None
+    for part in parts:
+        found = None
+        for child in walkbody(node.body):
+            if isinstance(child, (ast.ClassDef, ast.FunctionDef)) and child.name == part:
+                found = child
+        if found is None:
+            raise ImportError, 'Cannot detect code structure for %r' % name
+        node, parent = found, node
+
+    if isinstance(node, ast.ClassDef):
+        result['type'] = 'class'
+    elif isinstance(node, ast.FunctionDef):
+        result['type'] = isinstance(parent, ast.ClassDef) and 'method' or 'function'
+    elif os.path.basename(filename).startswith('__init__.'):
+        result['type'] = 'package'
+    else:
+        result['type'] = 'module'
+    result['module_name'] = modname
+    result['module_doc'] = ast.get_docstring(tree, clean=False)
+    if source is None:
+        result['file'] = os.path.normcase(os.path.abspath(filename))
+    else:
+        result['file'] = filename
+    if locations:
+        _add_locations(result, filename, modname, tree, profiler, source)
+    if refs:
+        _add_refs(result, filename, modname, tree, profiler)
+
+    if os.path.basename(filename).startswith('__init__.'):
+        code_struct = AstCodeStruct(tree, modname, modname, profiler, lazy)
+    else:
+        code_struct = AstCodeStruct(tree, modname, None, profiler, lazy)
+    if isinstance(parent, ast.ClassDef):
+        return result, code_struct, (node, result['name'], None, parent)
+    return result, code_struct, (node, result['name'])
+
+def struct_records(thing, engine='inspect', profiler=None):
+    """ generates code structure, given an object or a path to an object,
+    as a stream of records produced while the analysis goes on.
+
+    The first record {'record': 'code', ...} holds the fields of struct_code()
+    result except 'struct'. For modules, each class, function and data item
+    follows in its own record {'record': 'classes'|'funcs'|'data',
+    'name': <name>, 'struct': <item>}, other fields of the module structure
+    in {'record': 'module', 'name': <name>, 'struct': <fields>}. Other objects
+    are described by a single {'record': 'struct', ...} record.
+    See loadrecords() for the reverse transformation."""
+    result, code_struct, args = _code_target(thing, engine, profiler)
+    result['record'] = 'code'
+    yield result
+    if isinstance(args[0], ast.Module) or inspect.ismodule(args[0]):
+        for section, item in code_struct.iter_module(*args):
+            yield {'record': section or 'module', 'name': result['name'], 'struct': item}
+    else:
+        yield {'record': 'struct', 'name': result['name'], 'struct': code_struct.struct(*args)}
+
+def coderecords(result):
+    """ generates records of code structure returned by struct_code(),
+    the same as struct_records() does."""
+    header = dict((k, v) for k, v in result.items() if k != 'struct')
+    header['record'] = 'code'
+    yield header
+    struct = result.get('struct')
+    if result.get('type') in _MODULE_TYPES:
+        for key, value in sorted(struct.items()):
+            if key in ('classes', 'funcs', 'data'):
+                for item in value:
+                    yield {'record': key, 'name': result['name'], 'struct': item}
+            else:
+                yield {'record': 'module', 'name': result['name'], 'struct': {key: value}}
+    elif struct is not None:
+        yield {'record': 'struct', 'name': result['name'], 'struct': struct}
+
+def codesymbols(result):
+    """ generates symbols of code structure returned by struct_code(), as
+    (qualified name, kind, module, signature, doc summary): the object itself
+    and, for modules, its classes, functions and data, for classes, their
+    own attributes."""
+
+    def summary(doc):
+        lines = (doc or '').strip().splitlines()
+        return lines and lines[0].strip() or None
+
+    def classsymbols(qualname, struct):
+        yield qualname, 'class', module, None, summary(struct.get('doc'))
+        for attr in struct.get('class_attrs', []):
+            if len(attr) > 2:
+                yield (qualname + '.' + attr['name'], attr['type'], module,
+                        attr.get('decl'), summary(attr.get('doc')))
+            else:
+                # {name: value, 'belongs_to': class} of literal values
+                for key in attr:
+                    if key != 'belongs_to':
+                        yield qualname + '.' + key, 'data', module, None, None
+
+    name, module, struct = result['name'], result.get('module_name'), result.get('struct') or {}
+    if result['type'] in _MODULE_TYPES:
+        yield name, result['type'], module, None, summary(result.get('module_doc'))
+        for cls in struct.get('classes', []):
+            for symbol in classsymbols(name + '.' + cls['name'], cls):
+                yield symbol
+        for func in struct.get('funcs', []):
+            yield (name + '.' + func['name'], func['type'], module,
+                    func.get('decl'), summary(func.get('doc')))
+        for item in struct.get('data', []):
+            if len(item) > 1:
+                yield name + '.' + item['name'], 'data', module, None, summary(item.get('doc'))
+            else:
+                # {name: value} of literal values
+                for key in item:
+                    yield name + '.' + key, 'data', module, None, None
+    elif result['type'] == 'class':
+        for symbol in classsymbols(name, struct):
+            yield symbol
+    else:
+        yield name, result['type'], module, struct.get('decl'), summary(struct.get('doc'))
+
+def codeclasses(result):
+    """ generates classes of code structure returned by struct_code(), as
+    (qualified name, module, qualified names of base classes in method
+    resolution order, qualified names of the bases of the class statement).
+    Names of bases defined in the same module, which are not qualified in
+    structures, are qualified by the module name."""
+
+    def qualify(bases):
+        return [base if '.' in base else module + '.' + base for base in bases]
+
+    module = result.get('module_name') or result['name']
+    classes = [member for member in _codemembers(result) if member[2] == 'class']
+    if result['type'] == 'class':
+        classes.insert(0, (result['name'], result.get('struct') or {}, 'class'))
+    for name, struct, kind in classes:
+        bases = qualify(struct.get('bases') or [])
+        # direct bases are stored for multiple inheritance only
+        yield name, module, bases, qualify(struct.get('direct_bases') or bases[:1])
+
+def codeitems(result):
+    """ generates (qualified name, fields) of objects in code structure
+    returned by struct_code(): the object itself and, for modules, its
+    classes, functions and data, for classes, their own attributes. Fields
+    are the ones compared by diffstruct(): 'type' and, if known, 'decl',
+    'bases' and 'doc'."""
+
+    def fields(struct, kind=None):
+        if not ('type' in struct and 'name' in struct):
+            # {name: value} of literal values
+            return {'type': kind or 'data'}
+        result = {'type': kind or struct['type']}
+        for key in ('decl', 'bases', 'doc'):
+            if struct.get(key) is not None:
+                result[key] = struct[key]
+        return result
+
+    name, struct = result['name'], result.get('struct') or {}
+    if result['type'] in _MODULE_TYPES:
+        module = {'type': result['type']}
+        if result.get('module_doc') is not None:
+            module['doc'] = result['module_doc']
+        yield name, module
+    elif result['type'] == 'class':
+        yield name, fields(struct, 'class')
+    else:
+        yield name, fields(struct, result['type'])
+    for qualname, member, kind in _codemembers(result):
+        yield qualname, fields(member, kind)
+
+def _codemembers(result):
+    """ generates (qualified name, structure, kind) of the members of code
+    structure returned by struct_code(), in the order of codeitems(): for
+    modules, classes and their own attributes, functions and data, for
+    classes, their own attributes. kind is 'class' for classes, None for
+    other members."""
+
+    def classmembers(qualname, struct):
+        yield qualname, struct, 'class'
+        for attr in struct.get('class_attrs', []):
+            yield qualname + '.' + itemname(attr), attr, None
+
+    name, struct = result['name'], result.get('struct') or {}
+    if result['type'] in _MODULE_TYPES:
+        for cls in struct.get('classes', []):
+            for member in classmembers(name + '.' + cls['name'], cls):
+                yield member
+        for func in struct.get('funcs', []):
+            yield name + '.' + func['name'], func, None
+        for item in struct.get('data', []):
+            yield name + '.' + itemname(item), item, None
+    elif result['type'] == 'class':
+        for attr in struct.get('class_attrs', []):
+            yield name + '.' + itemname(attr), attr, None
+
+def diffstruct(old, new):
+    """ generates changes between two results of struct_code(), matching
+    objects by qualified names, see codeitems(). A change is a dict of
+    'name', 'type' and 'change': 'added', 'removed' or 'changed'. For changed
+    objects, fields which differ ('type', 'decl', 'bases', 'doc') are
+    given as [old value, new value]."""
+    return _diffitems(dict(codeitems(old)), codeitems(new))
+
+def diffdumps(old, new):
+    """ generates changes between two snapshots, sequences of results of
+    struct_code() in any order, e.g. loaded by loadresults(). Results are
+    matched by names, results with errors are reported once as changes
+    {'name': <name>, 'change': 'error', 'error': <message>}, with the error
+    of the new snapshot if both have one. Only objects of the old snapshot,
+    without inherited attributes, are kept in memory, the new snapshot is
+    streamed. Objects of results with errors in either snapshot are not
+    compared. See diffstruct()."""
+    snapshot, failed = dict(), dict()
+    for result in old:
+        if 'error' in result:
+            failed[result['name']] = result['error']
+        else:
+            snapshot[result['name']] = dict(codeitems(result))
+    for result in new:
+        name = result['name']
+        if 'error' in result:
+            snapshot.pop(name, None)
+            failed.pop(name, None)
+            yield {'name': name, 'change': 'error', 'error': result['error']}
+        elif name in failed:
+            yield {'name': name, 'change': 'error', 'error': failed.pop(name)}
+        else:
+            for change in _diffitems(snapshot.pop(name, {}), codeitems(result)):
+                yield change
+    # results with errors in the old snapshot only, missing from the new one
+    for name in sorted(failed):
+        yield {'name': name, 'change': 'error', 'error': failed[name]}
+    for name in sorted(snapshot):
+        for change in _diffitems(snapshot[name], ()):
+            yield change
+
+def _diffitems(olditems, newitems):
+    """Generate changes between olditems ({name: fields}) and newitems
+    ((name, fields) pairs), see diffstruct(). olditems are consumed."""
+    for name, fields in newitems:
+        oldfields = olditems.pop(name, None)
+        if oldfields is None:
+            yield {'name': name, 'type': fields['type'], 'change': 'added'}
+        elif oldfields != fields:
+            change = {'name': name, 'type': fields['type'], 'change': 'changed'}
+            for key in ('type', 'decl', 'bases', 'doc'):
+                if oldfields.get(key) != fields.get(key):
+                    change[key] = [oldfields.get(key), fields.get(key)]
+            yield change
+    for name in sorted(olditems):
+        yield {'name': name, 'type': olditems[name]['type'], 'change': 'removed'}
+
+def loadresults(file):
+    """ generates code structures from a file written by the command line:
+    JSON documents or records, one per line, with or without shared strings
+    (see sharestrings()), the binary format (see dumpbinary()) or a dump
+    (see DumpWriter)."""
+    import json
+    import itertools
+
+    magic = file.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        file.seek(0)
+        for result in loadbinary(file):
+            yield result
+        return
+    if magic == DUMP_MAGIC:
+        reader = DumpReader(file)
+        try:
+            for result in reader.results():
+                yield result
+        finally:
+            reader.data.close()
+        return
+    file.seek(0)
+    lines = iter(file)
+    for line in lines:
+        if line.strip():
+            break
+    else:
+        return
+    first = json.loads(line)
+    if 'record' in first:
+        results = loadrecords(itertools.chain([first], lines))
+    else:
+        results = itertools.chain([first], (json.loads(line) for line in lines if line.strip()))
+    strings = []
+    for result in results:
+        if 'strings' in result:
+            result = expandstrings(result, strings)
+        yield result
+
+def likepattern(text):
+    """Escape special characters of SQL LIKE patterns in text, by '\\'."""
+    return _LIKE_SPECIAL.sub(r'\\\1', text)
+
+def fuzzyscore(name, text):
+    """Return the score of a fuzzy match of lower case text in name, lower is
+    better, or None if characters of text are not in name in the same order.
+    Characters are matched from the end of the name, the score is the length
+    of the matched part of the name, then the length of the name."""
+    name = name.lower()
+    if text in name:
+        return len(text), len(name)
+    pos, end = len(name), None
+    for c in reversed(text):
+        pos = name.rfind(c, 0, pos)
+        if pos < 0:
+            return None
+        if end is None:
+            end = pos + 1
+    return (end or pos) - pos, len(name)
+
+def dumpjson(value):
+    """ returns JSON of value, structure nodes and lazy structures are JSON
+    objects """
+    import json
+
+    return json.dumps(value, default=_jsonnode)
+
+def _jsonnode(value):
+    if isinstance(value, StructNode):
+        return value.todict()
+    if isinstance(value, LazyStruct):
+        # loads the members, nested lazy structures are loaded in turn
+        return dict(value)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+def dumprecords(records, file=None):
+    """ write records as newline delimited JSON, one line per record """
+    file = file or sys.stdout
+    for record in records:
+        file.write(dumpjson(record) + '\n')
+        file.flush()
+
+def loadrecords(records):
+    """ generates code structures, as returned by struct_code(), from
+    records or from lines of newline delimited JSON """
+    import json
+
+    result = None
+    for record in records:
+        if isinstance(record, basestring):
+            if not record.strip():
+                continue
+            record = json.loads(record)
+        kind = record['record']
+        if kind == 'code':
+            if result is not None:
+                yield result
+            result = dict((k, v) for k, v in record.items() if k != 'record')
+            if result.get('type') in _MODULE_TYPES:
+                result['struct'] = dict()
+        elif kind == 'struct':
+            result['struct'] = record['struct']
+        elif kind == 'module':
+            result['struct'].update(record['struct'])
+        else:
+            result['struct'].setdefault(kind, []).append(record['struct'])
+    if result is not None:
+        yield result
+
+def _varint(n):
+    """Encode a non-negative integer as varint: 7 bits per byte, low bits
+    first, the high bit set in all bytes but the last."""
+    output = []
+    while n >= 0x80:
+        output.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    output.append(chr(n))
+    return ''.join(output)
+
+def _readvarint(data, pos):
+    """Decode the varint at pos of data, return it and the position after it."""
+    n, shift = 0, 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def _jsonkey(key):
+    """Key of a dict as in JSON: strings as they are, None, booleans and
+    numbers as their JSON text."""
+    if type(key) is str or type(key) is unicode:
+        return key
+    elif key is None or isinstance(key, (bool, int, long, float)):
+        import json
+        return json.dumps(key)
+    raise TypeError('key %r is not a string' % (key,))
+
+def dumpbinary(results, file=None):
+    """ write code structures in compact binary format, see BinaryWriter """
+    writer = BinaryWriter(file or sys.stdout)
+    for result in results:
+        writer.write(result)
+    writer.file.flush()
+
+def loadbinary(file):
+    """ generates code structures from a file written by dumpbinary() """
+    return iter(BinaryReader(file))
+
+def findmodules(root):
+    """Discover modules of a package or of a directory, without importing them.
+    root may be a path to a directory or source file, or a dotted package name.
+
+    returns (base directory, list of module names)"""
+    if not os.path.exists(root):
+        located = locatesource(root)
+        if not located or located[2]:
+            raise ImportError, 'Cannot find modules for %r' % root
+        root = located[0]
+        if os.path.basename(root).startswith('__init__.'):
+            root = os.path.dirname(root)
+    root = os.path.abspath(root)
+
+    if os.path.isfile(root):
+        modname = os.path.splitext(os.path.basename(root))[0]
+        return os.path.dirname(root), [modname]
+
+    if os.path.isfile(os.path.join(root, '__init__.py')):
+        # package: module names are prefixed by the package name,
+        # parent packages are found by walking up the directory tree
+        basedir, prefix = root, []
+        while os.path.isfile(os.path.join(basedir, '__init__.py')):
+            basedir, name = os.path.split(basedir)
+            prefix.insert(0, name)
+    else:
+        basedir, prefix = root, []
+
+    names = list()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames
+                                if os.path.isfile(os.path.join(dirpath, d, '__init__.py')))
+        parts = prefix + os.path.relpath(dirpath, root).split(os.sep)
+        parts = [part for part in parts if part != '.']
+        for filename in sorted(filenames):
+            modname, ext = os.path.splitext(filename)
+            if ext != '.py':
+                continue
+            if modname == '__init__':
+                if parts:
+                    names.append('.'.join(parts))
+            else:
+                names.append('.'.join(parts + [modname]))
+    return basedir, names
+
+def isarchive(path):
+    """Return True if path is an archive file analyzed by struct_archive(),
+    judging by its suffix: a wheel, egg, zip or tar archive."""
+    return os.path.isfile(path) and path.lower().endswith(_ARCHIVE_SUFFIXES)
+
+def archivesources(path):
+    """ generates (module name, member name, source) of Python modules in a
+    wheel, egg, zip or tar archive, e.g. an sdist, reading members in memory,
+    without extracting them. Modules are named as findmodules() names them
+    in directories: by the package directories above them, the ones with an
+    __init__.py. Lines of sources end with '\\n'."""
+    import tarfile
+    import zipfile
+
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        try:
+            members = [name for name in archive.namelist() if name.endswith('.py')]
+            names = _archivemodules(members)
+            for member in sorted(members):
+                if names[member]:
+                    source = archive.read(member).replace('\r\n', '\n').replace('\r', '\n')
+                    yield names[member], member, source
+        finally:
+            archive.close()
+        return
+
+    # compressed tar archives are read in one pass, they cannot be read
+    # at random without decompressing them again
+    archive = tarfile.open(path, 'r|*')
+    try:
+        sources = dict((member.name, archive.extractfile(member).read())
+                        for member in archive
+                        if member.isfile() and member.name.endswith('.py'))
+    finally:
+        archive.close()
+    names = _archivemodules(sources)
+    for member in sorted(sources):
+        if names[member]:
+            source = sources.pop(member).replace('\r\n', '\n').replace('\r', '\n')
+            yield names[member], member, source
+
+def _archivemodules(members):
+    """Return {member name: module name} of source files in an archive,
+    see archivesources(). Module names of __init__.py files outside of
+    packages are empty."""
+    import posixpath
+
+    paths = dict((member, posixpath.normpath(member).lstrip('/')) for member in members)
+    packages = set(posixpath.dirname(path) for path in paths.itervalues()
+                    if posixpath.basename(path) == '__init__.py')
+    names = dict()
+    for member, path in paths.iteritems():
+        dirpath, filename = posixpath.split(path)
+        parts = filename != '__init__.py' and [filename[:-3]] or []
+        while dirpath and dirpath in packages:
+            dirpath, name = posixpath.split(dirpath)
+            parts.insert(0, name)
+        names[member] = '.'.join(parts)
+    return names
+
+def struct_classes(modname, classnames, engine='inspect', profiler=None):
+    """ returns code structures of given classes of a module, the same
+    as they appear in the structure of the module."""
+    if engine == 'ast':
+        filename = sourcefile(modname)
+        if not filename:
+            raise ImportError, 'Cannot detect code structure for %r' % modname
+        if os.path.basename(filename).startswith('__init__.'):
+            code_struct = AstCodeStruct(parsefile(filename), modname, modname, profiler)
+        else:
+            code_struct = AstCodeStruct(parsefile(filename), modname, None, profiler)
+        return [code_struct.struct_class(code_struct.classes[name], name)
+                    for name in classnames if name in code_struct.classes]
+
+    module = profiled(profiler, 'import', None, safeimport, modname)
+    if module is None:
+        raise ImportError, 'Cannot detect code structure for %r' % modname
+    code_struct = PyCodeStruct(profiler=profiler)
+    return [code_struct.struct_class(getattr(module, name), name)
+                for name in classnames if inspect.isclass(getattr(module, name, None))]
+
+def _batch_init(basedir):
+    """Prepare a worker process of struct_batch()."""
+    if basedir is not None and basedir not in sys.path:
+        sys.path.insert(0, basedir)
+
+def _sandbox_worker(conn, func, initializer, initargs):
+    """Run tasks received from conn in a worker process of SandboxPool."""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        conn.send(func(task))
+
+def _rss(pid):
+    """Return resident memory of a process in bytes, 0 if it is unknown."""
+    try:
+        file = open('/proc/%d/statm' % pid)
+        try:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            file.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+def _batch_struct(args):
+    """Analyze a module in a worker process of struct_batch().
+    returns (result, profiler stats or None)"""
+    modname, engine, classnames, refs, locations, profile = args
+    profiler = profile and Profiler() or None
+    try:
+        if classnames is not None:
+            classes = struct_classes(modname, classnames, engine, profiler)
+            result = {'name': modname, 'classes': classes}
+        else:
+            result = struct_code(modname, engine, profiler=profiler, refs=refs,
+                                    locations=locations)
+    except (Exception, SystemExit), err:
+        result = {'name': modname, 'error': str(err)}
+    return result, profiler and profiler.stats()
+
+def _batch_archive(args):
+    """Analyze the modules of an archive in a worker process of
+    struct_archives(). returns (list of results, profiler stats or None)"""
+    path, refs, locations, profile = args
+    profiler = profile and Profiler() or None
+    try:
+        results = list(struct_archive(path, refs, profiler, locations))
+    except Exception, err:
+        results = [{'name': path, 'error': str(err)}]
+    return results, profiler and profiler.stats()
+
+def modulefile(basedir, modname):
+    """Return the source file of a module found by findmodules()."""
+    path = os.path.join(basedir, *modname.split('.'))
+    if os.path.isdir(path):
+        return os.path.join(path, '__init__.py')
+    return path + '.py'
+
+def struct_batch(root, engine='inspect', processes=None, maxtasks=None, cache=None,
+                 profiler=None, timeout=None, memlimit=None, refs=False, locations=False):
+    """ generates code structures for all modules of a package or a directory.
+
+    Modules are analyzed by a pool of worker processes, each one importing
+    modules into its own interpreter. Workers are replaced after maxtasks
+    modules, if given. If timeout (seconds) or memlimit (bytes of resident
+    memory) is given, a worker exceeding it while analyzing a module is
+    killed and replaced, see SandboxPool. Results are yielded as soon as
+    they are ready, in the order of completion. Modules which cannot be
+    analyzed are reported as {'name': <module name>, 'error': <message>}.
+    If cache (StructCache) is given, only modules changed since the last
+    run are analyzed. Timings of workers are collected by profiler
+    (Profiler), if given. If refs, results include names referenced by
+    the code, see coderefs(), and if locations, source locations, see
+    sourcelocations(), found by the workers too."""
+    basedir, names = findmodules(root)
+    key = _cachekey(engine, refs, locations)
+    tasks = list()
+    for name in names:
+        result = None
+        if cache is not None:
+            result = cache.get(name, key, modulefile(basedir, name))
+        if result is not None:
+            yield result
+        else:
+            tasks.append((name, engine, None, refs, locations))
+
+    for result in _batch_run(basedir, tasks, processes, maxtasks, profiler, timeout, memlimit):
+        if cache is not None and 'error' not in result:
+            cache.put(result['name'], key, modulefile(basedir, result['name']), result)
+        yield result
+
+def _batch_run(basedir, tasks, processes=None, maxtasks=None, profiler=None,
+               timeout=None, memlimit=None, func=_batch_struct):
+    """Run analysis tasks in a pool of worker processes, func analyzes a task
+    in a worker, see _batch_struct(). basedir is None for tasks which do not
+    import modules."""
+    import multiprocessing
+
+    if not tasks:
+        return
+    tasks = [task + (profiler is not None,) for task in tasks]
+    if timeout or memlimit:
+        pool = SandboxPool(func, processes, _batch_init, (basedir,), maxtasks,
+                            timeout, memlimit)
+        for task, value, error in pool.imap_unordered(tasks):
+            if error is not None:
+                modname = task[0]
+                filename = basedir is None and modname or modulefile(basedir, modname)
+                err = ErrorDuringImport(filename, (WorkerError, WorkerError(error), None))
+                yield {'name': modname, 'error': str(err)}
+                continue
+            result, stats = value
+            if stats is not None:
+                profiler.merge(stats)
+            yield result
+        return
+    pool = multiprocessing.Pool(processes, _batch_init, (basedir,), maxtasks)
+    try:
+        for result, stats in pool.imap_unordered(func, tasks):
+            if stats is not None:
+                profiler.merge(stats)
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def struct_changed(root, changed, engine='inspect', processes=None, maxtasks=None, cache=None,
+                   profiler=None, timeout=None, memlimit=None, refs=False, locations=False):
+    """ generates code structures for modules of a package or a directory
+    affected by changes of given source files.
+
+    With the inspect engine, classes inherit attributes from base classes of
+    other modules, so modules importing changed modules are analyzed again
+    too: entirely if they re-export names of changed modules, otherwise only
+    the classes whose MRO touches changed modules, which are then updated in
+    the cached structure of the module. With the ast engine, only changed
+    modules are analyzed again. Results are yielded, and limits of workers,
+    refs and locations apply, as in struct_batch()."""
+
+    graph = DependencyGraph(root, cache)
+    key = _cachekey(engine, refs, locations)
+    changed = graph.modules(changed)
+    if engine == 'ast':
+        affected = dict.fromkeys(changed)
+    else:
+        affected = graph.affected(changed)
+
+    tasks, cached = list(), dict()
+    for name, classnames in sorted(affected.items()):
+        if classnames is not None:
+            if cache is not None:
+                cached[name] = cache.get(name, key, graph.files[name])
+            if cached.get(name) is None:
+                classnames = None
+        tasks.append((name, engine, classnames, refs, locations))
+
+    for result in _batch_run(graph.basedir, tasks, processes, maxtasks, profiler,
+                             timeout, memlimit):
+        if 'error' not in result and 'classes' in result and 'struct' not in result:
+            classes = dict((c['name'], c) for c in result['classes'])
+            result = cached[result['name']]
+            result['struct']['classes'] = [classes.get(c['name'], c)
+                                            for c in result['struct']['classes']]
+        if cache is not None and 'error' not in result:
+            cache.put(result['name'], key, graph.files[result['name']], result)
+        yield result
+
+def struct_archive(path, refs=False, profiler=None, locations=False):
+    """ generates code structures of all modules of a wheel, egg, zip or
+    tar archive, see archivesources(). Modules are read in memory and parsed
+    with the ast engine, never extracted nor imported, 'file' of results is
+    the path of the archive followed by the path of the member. Modules which
+    cannot be analyzed are reported as in struct_batch(). refs, profiler and
+    locations are as in struct_code()."""
+    archive = os.path.abspath(path)
+    for modname, member, source in archivesources(path):
+        filename = os.path.join(archive, member)
+        try:
+            tree = profiled(profiler, 'parse', None, parsesource, source, filename)
+            result, code_struct, args = _tree_target(modname, tree, filename, modname, (),
+                                                        profiler, refs=refs, locations=locations,
+                                                        source=source)
+            result['struct'] = code_struct.struct(*args)
+        except Exception, err:
+            result = {'name': modname, 'error': str(err)}
+        yield result
+
+def struct_archives(paths, processes=None, maxtasks=None, profiler=None, timeout=None,
+                    memlimit=None, refs=False, locations=False):
+    """ generates code structures of all modules of many archives, see
+    struct_archive(). Archives are analyzed by a pool of worker processes,
+    one archive per task, and results of an archive are yielded as soon as
+    it is done, in the order of completion. Archives which cannot be read,
+    or analyzed within limits of workers, are reported as
+    {'name': <path>, 'error': <message>}. processes, maxtasks, timeout,
+    memlimit, profiler, refs and locations are as in struct_batch()."""
+    tasks = [(path, refs, locations) for path in paths]
+    for results in _batch_run(None, tasks, processes, maxtasks, profiler, timeout, memlimit,
+                              _batch_archive):
+        if isinstance(results, dict):
+            # the worker was killed
+            yield results
+            continue
+        for result in results:
+            yield result
+
+def serve(path, service=None):
+    """ serve JSON-RPC 2.0 requests for code structures, one request per
+    line, on a Unix socket at path or on stdin/stdout if path is '-'.
+    The process stays warm: imported modules and results are kept between
+    requests, see StructService."""
+    import stat
+    import SocketServer
+
+    service = service or StructService()
+    if path == '-':
+        service.serve(sys.stdin, sys.stdout)
+        return
+
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            service.serve(self.rfile, self.wfile)
+
+    # a socket left behind by a previous server
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+    server = SocketServer.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
 def cli():
     """Command-line interface (looks at sys.argv to decide what to do)."""
 
@@ -503,23 +4451,381 @@ def cli():
             sys.path.remove(scriptdir)
         sys.path.insert(0, '.')
     
-    if len(sys.argv) <= 2:
-        for arg in sys.argv[1:]:
-            if ispath(arg) and os.path.exists(arg):
+    class BadUsage: pass
+
+    def output(result):
+        if index is not None:
+            index.update(result)
+        if symbols is not None:
+            symbols.update(result)
+        if classes is not None:
+            classes.update(result)
+        if callgraph is not None:
+            callgraph.update(result)
+        if depth is not None or select is not None:
+            result = dict(result)
+            result['struct'] = expandstruct(result['struct'], depth, select)
+        if strings is not None:
+            result = sharestrings(result, strings)
+        if dump is not None:
+            dump.write(result)
+        elif binary is not None:
+            binary.write(result)
+            sys.stdout.flush()
+        elif ndjson:
+            dumprecords(coderecords(result))
+        else:
+            print dumpjson(result)
+            sys.stdout.flush()
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'bc:e:i:lnp:s:y:',
+                                    ['batch', 'binary', 'cache=', 'callgraph=', 'changed=',
+                                     'classes=', 'depth=', 'diff', 'dump=', 'engine=', 'index=',
+                                     'load=',
+                                     'locate', 'maxtasks=', 'memory=', 'mro', 'ndjson',
+                                     'processes=', 'profile', 'refs', 'search=', 'select=',
+                                     'serve=', 'strings', 'subclasses=', 'symbols=', 'timeout=',
+                                     'used-by=', 'uses='])
+        engine, batch, processes, cache, changed = 'inspect', False, None, None, []
+        ndjson, server, profiler, index, locate = False, None, None, None, False
+        symbols, search, depth, select = None, None, None, None
+        binary, load, strings, dump = None, None, None, None
+        maxtasks, memlimit, timeout, diff = None, None, None, False
+        classes, hierarchy = None, None
+        callgraph, refs, xref = None, False, None
+        for opt, val in opts:
+            if opt == '--callgraph':
+                callgraph, refs = CallGraph(val), True
+            if opt == '--refs':
+                refs = True
+            if opt in ('--uses', '--used-by'):
+                if val not in ('all', 'calls'):
+                    raise BadUsage
+                xref = opt[2:], val == 'calls'
+            if opt == '--classes':
+                classes = ClassIndex(val)
+            if opt == '--mro':
+                hierarchy = 'mro'
+            if opt == '--subclasses':
+                if val not in ('all', 'direct'):
+                    raise BadUsage
+                hierarchy = val
+            if opt == '--diff':
+                diff = True
+            if opt == '--maxtasks':
+                if not val.isdigit():
+                    raise BadUsage
+                maxtasks = int(val)
+            if opt == '--memory':
+                if not val.isdigit():
+                    raise BadUsage
+                memlimit = int(val) * 1024 * 1024
+            if opt == '--timeout':
+                try:
+                    timeout = float(val)
+                except ValueError:
+                    raise BadUsage
+            if opt == '--strings':
+                strings = StringTable()
+            if opt == '--binary':
+                binary = True
+            if opt == '--load':
+                load = val
+            if opt == '--dump':
+                dump = val
+            if opt == '--depth':
+                if not val.isdigit():
+                    raise BadUsage
+                depth = int(val)
+            if opt == '--select':
+                select = (select or []) + [val]
+            if opt in ('-y', '--symbols'):
+                symbols = SymbolIndex(val)
+            if opt == '--search':
+                if val not in ('prefix', 'substring', 'fuzzy'):
+                    raise BadUsage
+                search = val
+            if opt in ('-i', '--index'):
+                index = LocationIndex(val)
+            if opt in ('-l', '--locate'):
+                locate = True
+            if opt == '--profile':
+                profiler = Profiler()
+            if opt in ('-s', '--serve'):
+                server = val
+            if opt in ('-n', '--ndjson'):
+                ndjson = True
+            if opt == '--changed':
+                changed.append(val)
+            if opt in ('-b', '--batch'):
+                batch = True
+            if opt in ('-c', '--cache'):
+                cache = StructCache(val)
+            if opt in ('-e', '--engine'):
+                engine = val
+            if opt in ('-p', '--processes'):
+                if not val.isdigit():
+                    raise BadUsage
+                processes = int(val)
+        if engine not in ('inspect', 'ast'):
+            raise BadUsage
+        # locations are found only to be stored in the location index
+        locations = index is not None
+
+        if len(filter(None, (binary, ndjson, dump))) > 1:
+            raise BadUsage
+        if diff:
+            if len(args) != 2:
+                raise BadUsage
+            old, new = open(args[0], 'rb'), open(args[1], 'rb')
+            try:
+                for change in diffdumps(loadresults(old), loadresults(new)):
+                    print dumpjson(change)
+            finally:
+                old.close()
+                new.close()
+            return
+        if load:
+            if binary or dump:
+                raise BadUsage
+            file = open(load, 'rb')
+            try:
+                if args:
+                    reader = DumpReader(file)
+                    for arg in args:
+                        print dumpjson(reader.get(arg))
+                else:
+                    for result in loadresults(file):
+                        output(result)
+            finally:
+                file.close()
+            return
+        if binary:
+            binary = BinaryWriter(sys.stdout)
+        if dump:
+            dump = DumpWriter(open(dump, 'wb'))
+
+        if locate:
+            if index is None:
+                raise BadUsage
+            for arg in args:
+                for name, location in index.prefix(arg):
+                    print dumpjson(dict(zip(('name', 'file', 'line', 'col', 'end_line', 'end_col'),
+                                              (name,) + location)))
+            return
+
+        if search:
+            if symbols is None:
+                raise BadUsage
+            for arg in args:
+                for symbol in getattr(symbols, search)(arg):
+                    print dumpjson(symbol)
+            return
+
+        if xref:
+            if callgraph is None:
+                raise BadUsage
+            query, calls = xref
+            for arg in args:
+                if query == 'uses':
+                    print dumpjson({'name': arg, 'uses': callgraph.uses(arg, calls)})
+                else:
+                    print dumpjson({'name': arg, 'used_by': callgraph.usedby(arg, calls)})
+            return
+
+        if hierarchy:
+            if classes is None:
+                raise BadUsage
+            for arg in args:
+                if hierarchy == 'mro':
+                    print dumpjson({'name': arg, 'mro': classes.mro(arg)})
+                else:
+                    print dumpjson({'name': arg, 'subclasses':
+                                      classes.subclasses(arg, hierarchy == 'direct')})
+            return
+
+        if server:
+            if args:
+                raise BadUsage
+            serve(server, StructService(cache))
+            return
+
+        if batch:
+            archives = [arg for arg in args if isarchive(arg)]
+            if archives:
+                for result in struct_archives(archives, processes, maxtasks, profiler, timeout,
+                                              memlimit, refs, locations):
+                    profiled(profiler, 'serialize', None, output, result)
+            for arg in args:
+                if arg in archives:
+                    continue
+                try:
+                    if changed:
+                        results = struct_changed(arg, changed, engine, processes, maxtasks,
+                                                    cache, profiler, timeout, memlimit, refs,
+                                                    locations)
+                    else:
+                        results = struct_batch(arg, engine, processes, maxtasks,
+                                                    cache, profiler, timeout, memlimit, refs,
+                                                    locations)
+                    for result in results:
+                        profiled(profiler, 'serialize', None, output, result)
+                except ImportError, err:
+                    print err
+            if dump:
+                dump.finish()
+                dump.file.close()
+            if profiler:
+                profiler.report(file=sys.stderr)
+            return
+
+        if len(args) > 1:
+            raise BadUsage
+        for arg in args:
+            if isarchive(arg):
+                for result in struct_archive(arg, refs, profiler, locations):
+                    profiled(profiler, 'serialize', None, output, result)
+                continue
+            if engine == 'inspect' and ispath(arg) and os.path.exists(arg):
                 arg = importfile(arg)
             try:
                 #pprint.pprint(struct_code(arg))
-                print json.dumps(struct_code(arg))
-            except ImportError, err:
+                partial = depth is not None or select is not None
+                if (ndjson and cache is None and index is None and symbols is None
+                        and classes is None and strings is None and not partial and not refs):
+                    dumprecords(struct_records(arg, engine, profiler))
+                else:
+                    result = struct_code(arg, engine, cache, profiler,
+                                            lazy=partial and index is None and symbols is None
+                                                and classes is None, refs=refs,
+                                            locations=locations)
+                    profiled(profiler, 'serialize', None, output, result)
+            except (ImportError, ErrorDuringImport), err:
                 print err
-    else:
+        if dump:
+            dump.finish()
+            dump.file.close()
+        if profiler:
+            profiler.report(file=sys.stderr)
+
+    except (getopt.error, BadUsage):
         cmd = os.path.basename(sys.argv[0])
         print """pycode.py - python code analysis
 
-%s <name> ...
+%s [-e <engine>] <name> ...
     <name> may be the name of a Python function, module, or package, 
     or a dotted reference to a class or function within a module or 
-    module in a package.""" % cmd
+    module in a package.
+
+%s -e ast <name>
+    Parse the source code instead of importing it, the module's code
+    is never executed. <name> may also be a path to a source file.
+
+%s -b [-p <processes>] [-e <engine>] <root> ...
+    Analyze all modules of a package or of a directory in a pool of
+    worker processes. <root> may be a path or a dotted package name.
+    One JSON document per module is printed as soon as it is ready.
+
+%s [-b] <archive> ...
+    Analyze all modules of wheels, eggs, zip or tar archives (sdists)
+    with the ast engine, reading them in memory without extracting them.
+    With -b, archives are analyzed by a pool of worker processes.
+
+%s -b --timeout=<seconds> --memory=<MB> --maxtasks=<N> ...
+    Kill a worker process analyzing a module for more than <seconds>, or
+    using more than <MB> of resident memory, and report the module as an
+    error. Replace worker processes after <N> modules.
+
+%s -c <path> ...
+    Keep results in the cache database at <path>, modules whose source
+    files are unchanged are not analyzed again.
+
+%s -b -c <path> --changed=<file> ... <root>
+    Analyze again only modules affected by changed source files: the
+    changed modules and classes of other modules deriving from them.
+
+%s -n ...
+    Print newline delimited JSON, one record per class, function and data
+    item as soon as it is analyzed, instead of one document per module.
+
+%s -s <path>
+    Serve JSON-RPC 2.0 requests, one per line, on a Unix socket at <path>,
+    or on stdin/stdout if <path> is '-'. Method struct_code(thing, engine)
+    returns the same result as the command line, results are kept in
+    memory until source files of analyzed modules change. Method
+    invalidate() forgets them, e.g. when modules they depend on change.
+
+%s --profile ...
+    Print time spent in analysis phases and the slowest modules and
+    classes to stderr.
+
+%s -i <path> ...
+    Store source locations of analyzed classes, functions and attributes
+    in the location index at <path>.
+
+%s -i <path> -l <prefix> ...
+    Print locations of objects with qualified names starting with <prefix>
+    from the location index, one JSON document per object.
+
+%s -y <path> ...
+    Store symbols of analyzed modules, classes, functions and attributes
+    in the symbol index at <path>.
+
+%s -y <path> --search=prefix|substring|fuzzy <text> ...
+    Print symbols with qualified names starting with <text>, containing
+    <text>, or containing its characters in the same order, from the
+    symbol index, one JSON document per symbol.
+
+%s --classes=<path> ...
+    Store the method resolution order of analyzed classes in the class
+    index at <path>.
+
+%s --classes=<path> --mro|--subclasses=all|direct <class> ...
+    Print base classes of classes, or classes deriving from them, at any
+    depth or directly, from the class index, one JSON document per class.
+
+%s --refs ...
+    Include names referenced and called by analyzed modules, classes,
+    functions and methods, resolved to qualified names where possible.
+
+%s --callgraph=<path> ...
+    Store names referenced and called by analyzed code in the call graph
+    at <path>.
+
+%s --callgraph=<path> --uses|--used-by=all|calls <name> ...
+    Print names referenced, or only called, by the code of <name>, or the
+    code referencing or calling <name>, one JSON document per name.
+
+%s --depth=<levels> --select=<path> ... <name>
+    Print only <levels> levels of members of modules and classes, or only
+    members on the dotted path of member keys and names, for example
+    classes.JSONDecoder.class_attrs.decode. Other members are not analyzed.
+
+%s --binary ...
+    Print results in compact binary format instead of JSON, strings and
+    attributes repeated in results are written once.
+
+%s --load=<path>
+    Print results from a file written with --binary or --dump, as JSON.
+
+%s --dump=<path> ...
+    Write results to a dump file at <path>, in the binary format with an
+    index of qualified names of modules, classes, functions, data and
+    attributes.
+
+%s --load=<path> <name> ...
+    Print the structures of qualified names from a dump file, reading only
+    these from the file, one JSON document per name, null if not found.
+
+%s --strings ...
+    Print ids instead of docs and class names in structures, each result
+    lists 'strings' it uses first, ids are positions in these lists of
+    all printed results.
+
+%s --diff <old> <new>
+    Print changes of objects between two files written by the command
+    line, one JSON document per added, removed or changed object.""" % ((cmd,) * 26)
 
 if __name__ == '__main__':
     cli()    		
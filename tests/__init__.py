@@ -0,0 +1,19 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class IndexTestCase(unittest.TestCase):
+    ''' tests of a cache or an index stored in SQLite database: setUp()
+    opens a new one of indexclass as self.index, in a temporary directory '''
+
+    indexclass = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = self.indexclass(os.path.join(self.tmpdir, 'index', self.indexclass.filename))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
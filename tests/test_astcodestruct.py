@@ -0,0 +1,133 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import ast
+import pycode
+import unittest
+
+from tests import test_pycodestruct
+
+SOURCE = '''
+""" module doc """
+import os.path
+from collections import OrderedDict as ODict
+
+__all__ = ['E', 'F', 'f', 'X']
+
+X = 1
+Y = 2
+
+class E(ODict):
+    """ Class E """
+    a = 1
+    @staticmethod
+    def s(x=3, *args, **kwargs):
+        """ E.s() """
+    @classmethod
+    def c(cls):
+        pass
+    @property
+    def p(self):
+        """ E.p """
+
+class F:
+    pass
+
+def f(a, (b, c), d=None, e=os.sep):
+    """ f() """
+'''
+
+
+def struct_fixture(name):
+    ''' returns code structures from ast and inspect engines for test class '''
+    tree = pycode.parsefile(test_pycodestruct.__file__.replace('.pyc', '.py'))
+    code = pycode.AstCodeStruct(tree, test_pycodestruct.__name__)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == name:
+            break
+    return code.struct(node), pycode.PyCodeStruct().struct(getattr(test_pycodestruct, name))
+
+
+class AstCodeStructTests(unittest.TestCase):
+
+    def setUp(self):
+        self.code = pycode.AstCodeStruct(ast.parse(SOURCE), 'm')
+        self.struct = self.code.struct(self.code.tree)
+
+    def test_struct_module(self):
+
+        self.assertEqual([c['name'] for c in self.struct['classes']], ['E', 'F'])
+        self.assertEqual(self.struct['funcs'], [{
+            'decl': 'f(a, (b, c), d=None, e=os.sep)',
+            'doc': 'f()',
+            'name': 'f',
+            'type': 'function'
+        }])
+        self.assertEqual(self.struct['data'], [{'X': 1}, {'__all__': ['E', 'F', 'f', 'X']}])
+
+    def test_struct_class_E(self):
+
+        struct_class = self.struct['classes'][0]
+        self.assertEqual(struct_class['doc'], 'Class E')
+        self.assertEqual(struct_class['bases'], ['collections.OrderedDict'])
+        self.assertEqual(struct_class['inherited attrs'], [])
+        attrs = dict((a.get('name', 'a'), a) for a in struct_class['class_attrs'])
+        self.assertEqual(sorted(attrs), ['a', 'c', 'p', 's'])
+        self.assertEqual(attrs['a'], {'a': 1, 'belongs_to': 'm.E'})
+        self.assertEqual(attrs['c']['type'], 'classmethod')
+        self.assertEqual(attrs['p']['type'], 'property')
+        self.assertEqual(attrs['p']['doc'], 'E.p')
+        self.assertEqual(attrs['s']['type'], 'staticmethod')
+        self.assertEqual(attrs['s']['decl'], 's(x=3, *args, **kwargs)')
+
+    def test_struct_class_old_style(self):
+
+        self.assertEqual(self.struct['classes'][1], {
+            'class_attrs': [],
+            'doc': '',
+            'inherited attrs': [],
+            'name': 'F',
+            'type': 'class'
+        })
+
+    def test_struct_unhashable_literals(self):
+
+        # literal_eval() raises TypeError for unhashable keys
+        code = pycode.AstCodeStruct(ast.parse('X = {[]: 1}\ndef f(a={[]: 2}, b=len):\n    pass\n'), 'm')
+        struct = code.struct(code.tree)
+        self.assertEqual(struct['data'], [{'name': 'X', 'type': 'dict', 'doc': ''}])
+        self.assertEqual(struct['funcs'][0]['decl'], 'f(a=..., b=len)')
+
+    def test_same_as_inspect(self):
+
+        def names(attrs):
+            return sorted((a['name'], a['belongs_to']) for a in attrs)
+
+        for name in ('A', 'B', 'C', 'D'):
+            from_ast, from_inspect = struct_fixture(name)
+            for key in ('name', 'type', 'doc', 'bases'):
+                self.assertEqual(from_ast.get(key), from_inspect.get(key))
+            for key in ('class_attrs', 'inherited attrs'):
+                self.assertEqual(names(from_ast[key]), names(from_inspect[key]))
+
+    def test_struct_source(self):
+
+        result = pycode.struct_code('pycode.AstCodeStruct.getmro', engine='ast')
+        self.assertEqual(result['type'], 'method')
+        self.assertEqual(result['module_name'], 'pycode')
+        self.assertEqual(result['struct']['decl'], 'pycode.AstCodeStruct.getmro(self, node)')
+        self.assertRaises(ImportError, pycode.struct_code, 'sys', 'ast')
+        self.assertRaises(ImportError, pycode.struct_code, 'pycode.unknown', 'ast')
+
+    def test_struct_source_no_import(self):
+
+        self.assertEqual(pycode.locatesource('tests.test_pycodestruct')[1:],
+                            ('tests.test_pycodestruct', []))
+        sys.modules.pop('tests.test_utils', None)
+        result = pycode.struct_code('tests.test_utils', engine='ast')
+        self.assertEqual(result['type'], 'module')
+        self.assertNotIn('tests.test_utils', sys.modules)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import ast
+import pycode
+import unittest
+
+from tests import IndexTestCase
+
+SOURCE = '''
+import os.path
+from json import decoder as dec
+from . import sibling
+
+LIMIT = 10
+
+def helper(path, *args):
+    import re
+    value = os.path.join(path, 'x')
+    re.compile(value).match
+    def inner(item):
+        return len(item) + LIMIT
+    return sorted(args, key=lambda arg: inner(arg) or unknown(arg))
+
+class Base(object):
+    size = LIMIT
+    default = helper
+
+    def run(self):
+        global counter
+        counter = self.prepare()
+        return dec.JSONDecoder().decode(self.size), counter
+
+    @classmethod
+    def create(cls):
+        return cls.prepare(sibling.value, None)
+
+    @staticmethod
+    def prepare(self):
+        return self.upper()
+'''
+
+
+class CallGraphTests(IndexTestCase):
+
+    indexclass = pycode.CallGraph
+
+    def setUp(self):
+        IndexTestCase.setUp(self)
+        for name in ('tests', 'tests.test_callgraph', 'tests.test_classindex'):
+            self.index.update(pycode.struct_code(name, 'ast', refs=True))
+
+    def test_coderefs(self):
+
+        refs = pycode.coderefs(ast.parse(SOURCE), 'pkg.mod')
+        self.assertEqual(sorted(refs), ['pkg.mod', 'pkg.mod.Base', 'pkg.mod.Base.create',
+                            'pkg.mod.Base.run', 'pkg.mod.helper'])
+        self.assertEqual(refs['pkg.mod'], {'calls': [], 'names': ['__builtin__.object']})
+        self.assertEqual(refs['pkg.mod.helper'], {
+            'calls': ['__builtin__.len', '__builtin__.sorted', 'os.path.join',
+                      're.compile', 'unknown'],
+            'names': ['pkg.mod.LIMIT']})
+        self.assertEqual(refs['pkg.mod.Base'], {
+            'calls': [], 'names': ['__builtin__.classmethod', '__builtin__.staticmethod',
+                                   'pkg.mod.LIMIT', 'pkg.mod.helper']})
+        self.assertEqual(refs['pkg.mod.Base.run'], {
+            'calls': ['json.decoder.JSONDecoder', 'pkg.mod.Base.prepare'],
+            'names': ['pkg.mod.Base.size', 'pkg.mod.counter']})
+        self.assertEqual(refs['pkg.mod.Base.create'], {
+            'calls': ['pkg.mod.Base.prepare'], 'names': ['pkg.sibling.value']})
+
+    def test_struct_code(self):
+
+        result = pycode.struct_code('tests.test_callgraph.CallGraphTests', refs=True)
+        self.assertIn('tests.test_callgraph.CallGraphTests.setUp', result['refs'])
+        self.assertNotIn('tests.test_callgraph', result['refs'])
+        self.assertNotIn('refs', pycode.struct_code('tests.test_callgraph', 'ast'))
+        results = pycode.struct_batch('tests', 'ast', processes=2, refs=True)
+        self.assertTrue(all('refs' in result for result in results))
+
+    def test_uses(self):
+
+        self.assertIn('pycode.CallGraph', self.index.uses('tests.test_callgraph.CallGraphTests'))
+        self.assertEqual(self.index.uses('tests.test_callgraph.CallGraphTests.setUp', calls=True),
+                            ['pycode.struct_code', 'tests.IndexTestCase.setUp',
+                             'tests.test_callgraph.CallGraphTests.index.update'])
+        self.assertEqual(self.index.uses('tests.IndexTestCase.tearDown', calls=True),
+                            ['shutil.rmtree', 'tests.IndexTestCase.index.close'])
+
+    def test_usedby(self):
+
+        self.assertEqual(self.index.usedby('pycode.CallGraph'),
+                            ['tests.test_callgraph.CallGraphTests'])
+        self.assertEqual(self.index.usedby('tempfile.mkdtemp', calls=True),
+                            ['tests.IndexTestCase.setUp'])
+        self.assertEqual(self.index.usedby('tests.IndexTestCase.setUp', calls=True),
+                            ['tests.test_callgraph.CallGraphTests.setUp',
+                             'tests.test_classindex.ClassIndexTests.setUp'])
+        self.assertEqual(self.index.usedby('tests.test_callgraph.SOURCE', calls=True), [])
+
+    def test_update(self):
+
+        result = pycode.struct_code('tests.test_callgraph', 'ast', refs=True)
+        del result['refs']['tests.test_callgraph.CallGraphTests.setUp']
+        self.index.update(result)
+        self.assertEqual(self.index.usedby('tests.IndexTestCase.setUp'),
+                            ['tests.test_classindex.ClassIndexTests.setUp'])
+        self.assertEqual(self.index.usedby('pycode.CallGraph'),
+                            ['tests.test_callgraph.CallGraphTests'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import pycode
+import unittest
+
+from tests import IndexTestCase
+
+
+class Base(object):
+    pass
+
+class Derived(Base):
+    pass
+
+class Both(Derived, Base):
+    pass
+
+
+class ClassIndexTests(IndexTestCase):
+
+    indexclass = pycode.ClassIndex
+
+    def setUp(self):
+        IndexTestCase.setUp(self)
+        for name in ('tests.test_pycodestruct', 'tests.test_classindex'):
+            self.index.update(pycode.struct_code(name, 'ast'))
+
+    def test_codeclasses(self):
+
+        classes = dict((c[0], c[1:]) for c in
+                        pycode.codeclasses(pycode.struct_code('tests.test_pycodestruct', 'ast')))
+        self.assertEqual(classes['tests.test_pycodestruct.B'], ('tests.test_pycodestruct',
+                            ['tests.test_pycodestruct.A', '__builtin__.object'],
+                            ['tests.test_pycodestruct.A']))
+        classes = list(pycode.codeclasses(pycode.struct_code('json.decoder.JSONDecoder')))
+        self.assertEqual(classes, [('json.decoder.JSONDecoder', 'json.decoder',
+                                    ['__builtin__.object'], ['__builtin__.object'])])
+        for engine in ('inspect', 'ast'):
+            classes = list(pycode.codeclasses(pycode.struct_code('tests.test_classindex.Both', engine)))
+            self.assertEqual(classes, [('tests.test_classindex.Both', 'tests.test_classindex',
+                                ['tests.test_classindex.Derived', 'tests.test_classindex.Base',
+                                 '__builtin__.object'],
+                                ['tests.test_classindex.Derived', 'tests.test_classindex.Base'])])
+
+    def test_mro(self):
+
+        self.assertEqual(self.index.mro('tests.test_pycodestruct.D'),
+                            ['tests.test_pycodestruct.B', 'tests.test_pycodestruct.A',
+                             'tests.test_pycodestruct.C', '__builtin__.object'])
+        self.assertEqual(self.index.mro('tests.test_pycodestruct.missing'), None)
+
+    def test_subclasses(self):
+
+        self.assertEqual(self.index.subclasses('tests.test_pycodestruct.A'),
+                            ['tests.test_pycodestruct.B', 'tests.test_pycodestruct.D'])
+        self.assertEqual(self.index.subclasses('tests.test_pycodestruct.A', direct=True),
+                            ['tests.test_pycodestruct.B'])
+        self.assertEqual(self.index.subclasses('__builtin__.object', direct=True),
+                            ['tests.test_classindex.Base', 'tests.test_pycodestruct.A',
+                             'tests.test_pycodestruct.C'])
+        # Both lists Base, from which Derived, its first base, derives too
+        self.assertEqual(self.index.subclasses('tests.test_classindex.Base', direct=True),
+                            ['tests.test_classindex.Both', 'tests.test_classindex.Derived'])
+        self.assertEqual(self.index.subclasses('tests.IndexTestCase'),
+                            ['tests.test_classindex.ClassIndexTests'])
+        self.assertEqual(self.index.subclasses('unittest.TestCase'),
+                            ['tests.test_pycodestruct.PyCodeStructTests'])
+
+    def test_update(self):
+
+        result = pycode.struct_code('tests.test_pycodestruct', 'ast')
+        result['struct']['classes'] = [cls for cls in result['struct']['classes']
+                                        if cls['name'] != 'B']
+        self.index.update(result)
+        self.assertEqual(self.index.mro('tests.test_pycodestruct.B'), None)
+        self.assertEqual(self.index.subclasses('tests.test_pycodestruct.A'),
+                            ['tests.test_pycodestruct.D'])
+        self.index.update(pycode.struct_code('tests.test_pycodestruct.B', 'ast'))
+        self.assertEqual(self.index.subclasses('tests.test_pycodestruct.A', direct=True),
+                            ['tests.test_pycodestruct.B'])
+
+if __name__ == '__main__':
+    unittest.main()
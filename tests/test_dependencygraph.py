@@ -0,0 +1,88 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import os
+import time
+import shutil
+import pycode
+import tempfile
+import unittest
+
+MODULES = {
+    '__init__.py': '',
+    'a.py': 'class A(object):\n    def method1(self): pass\ndef f(): pass\n',
+    'b.py': 'from graphpkg.a import A\nclass B(A): pass\nclass C(object): pass\n',
+    'c.py': 'from .a import A as AA\ndef g(): pass\n',
+    'f.py': 'from .a import f\n',
+    'd.py': 'import graphpkg.b\nclass D(graphpkg.b.B): pass\n',
+    'e.py': 'class E(object): pass\n',
+}
+
+
+class DependencyGraphTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pkgdir = os.path.join(self.tmpdir, 'graphpkg')
+        os.mkdir(self.pkgdir)
+        for filename, source in MODULES.items():
+            self.write(filename, source)
+        self.cache = pycode.StructCache(os.path.join(self.tmpdir, 'structs.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, filename, source):
+        with open(os.path.join(self.pkgdir, filename), 'w') as file:
+            file.write(source)
+
+    def test_imports(self):
+
+        graph = pycode.DependencyGraph(self.pkgdir)
+        self.assertEqual(graph.imports['graphpkg.b'], set(['graphpkg.a']))
+        self.assertEqual(graph.imports['graphpkg.c'], set(['graphpkg.a']))
+        self.assertEqual(graph.imports['graphpkg.d'], set(['graphpkg.b']))
+        self.assertEqual(graph.bases['graphpkg.d'], {'D': ['graphpkg.b.B']})
+        self.assertEqual(graph.importers['graphpkg.b'], set(['graphpkg.d']))
+        self.assertEqual(graph.dependents(['graphpkg.a']),
+                            set(['graphpkg.a', 'graphpkg.b', 'graphpkg.c', 'graphpkg.d', 'graphpkg.f']))
+
+    def test_affected(self):
+
+        graph = pycode.DependencyGraph(self.pkgdir, self.cache)
+        changed = graph.modules([os.path.join(self.pkgdir, 'a.py')])
+        self.assertEqual(graph.affected(changed), {
+            'graphpkg.a': None,
+            'graphpkg.b': ['A', 'B'],
+            'graphpkg.c': ['AA'],
+            'graphpkg.d': ['D'],
+            'graphpkg.f': None,
+        })
+        self.assertEqual(graph.affected(['graphpkg.e']), {'graphpkg.e': None})
+
+    def test_struct_changed(self):
+
+        results = list(pycode.struct_batch(self.pkgdir, processes=1, cache=self.cache))
+        self.assertEqual(len(results), len(MODULES))
+        self.write('a.py', 'class A(object):\n    def method2(self): pass\ndef f(): pass\n')
+        os.utime(os.path.join(self.pkgdir, 'a.py'), (time.time() + 10, time.time() + 10))
+
+        changed = [os.path.join(self.pkgdir, 'a.py')]
+        results = dict((r['name'], r) for r in
+                        pycode.struct_changed(self.pkgdir, changed, processes=1, cache=self.cache))
+        self.assertEqual(sorted(results), ['graphpkg.a', 'graphpkg.b', 'graphpkg.c',
+                                            'graphpkg.d', 'graphpkg.f'])
+        classes = dict((c['name'], c) for c in results['graphpkg.b']['struct']['classes'])
+        self.assertEqual(sorted(classes), ['A', 'B', 'C'])
+        inherited = [attr['name'] for attr in classes['B']['inherited attrs']]
+        self.assertIn('method2', inherited)
+        self.assertNotIn('method1', inherited)
+        self.assertIn('method2', [attr['name'] for attr in classes['A']['class_attrs']])
+        self.assertEqual(pycode.StructCache(self.cache.path).get(
+                            'graphpkg.b', 'inspect', os.path.join(self.pkgdir, 'b.py')),
+                         results['graphpkg.b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import os
+import pycode
+import unittest
+
+from tests import IndexTestCase
+
+
+SOURCE = '''\
+"""located module"""
+
+import os
+
+try:
+    import json
+except ImportError:
+    json = None
+else:
+    VERSION = 1
+
+class A(object):
+
+    attr, (x, y) = 1, (2, 3)
+
+    @property
+    def f(self):
+        return 1
+
+    # comment
+
+    def g(self,
+            a):
+        pass
+
+def h(): pass
+'''
+
+class LocationIndexTests(IndexTestCase):
+
+    indexclass = pycode.LocationIndex
+
+    def setUp(self):
+        IndexTestCase.setUp(self)
+        self.filename = os.path.join(self.tmpdir, 'located_mod.py')
+        with open(self.filename, 'w') as file:
+            file.write(SOURCE)
+
+    def test_sourcelocations(self):
+
+        self.assertEqual(pycode.sourcelocations(self.filename, 'm'), {
+            'm.json': [8, 4, 8, 15],
+            'm.VERSION': [10, 4, 10, 15],
+            'm.A': [12, 0, 24, 12],
+            'm.A.attr': [14, 4, 14, 28],
+            'm.A.x': [14, 4, 14, 28],
+            'm.A.y': [14, 4, 14, 28],
+            'm.A.f': [16, 4, 18, 16],
+            'm.A.g': [22, 4, 24, 12],
+            'm.h': [26, 0, 26, 13]})
+
+    def test_struct_code(self):
+
+        result = pycode.struct_code(self.filename, 'ast', locations=True)
+        self.assertEqual(result['locations']['located_mod.A.f'], [16, 4, 18, 16])
+        result = pycode.struct_code('json.decoder.JSONDecoder', 'ast', locations=True)
+        self.assertEqual(sorted(result['locations'])[0], 'json.decoder.JSONDecoder')
+        inspected = pycode.struct_code('json.decoder.JSONDecoder', locations=True)
+        self.assertEqual(inspected['locations'], result['locations'])
+        self.assertNotIn('locations', pycode.struct_code('sys', locations=True))
+        # locations are found only on request
+        profiler = pycode.Profiler()
+        self.assertNotIn('locations', pycode.struct_code('json.decoder', profiler=profiler))
+        self.assertNotIn('locate', profiler.phases)
+        results = pycode.struct_batch('tests', 'ast', processes=2, locations=True)
+        self.assertTrue(all('locations' in result for result in results))
+
+    def test_index(self):
+
+        self.index.update(pycode.struct_code(self.filename, 'ast', locations=True))
+        filename = os.path.abspath(self.filename)
+        self.assertEqual(self.index.get('located_mod.A.g'), (filename, 22, 4, 24, 12))
+        self.assertEqual(self.index.get('located_mod.B'), None)
+        self.assertEqual([name for name, location in self.index.prefix('located_mod.A')],
+                            ['located_mod.A', 'located_mod.A.attr', 'located_mod.A.f',
+                             'located_mod.A.g', 'located_mod.A.x', 'located_mod.A.y'])
+
+        with open(self.filename, 'w') as file:
+            file.write('def h(): pass\n')
+        self.index.update(pycode.struct_code(self.filename, 'ast', locations=True))
+        self.assertEqual(list(self.index.prefix('')), [('located_mod.h', (filename, 1, 0, 1, 13))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,10 @@ import sys
 if '' not in sys.path:
     sys.path.append('')
 
+import json
+import inspect
 import types
+import pickle
 import pycode
 import pprint
 import unittest
@@ -84,6 +87,146 @@ class PyCodeStructTests(unittest.TestCase):
         self.assertEqual(struct_class['doc'], 'Class D')
         self.assertEqual(len(struct_class['class_attrs']), 0)
 
+    def test_struct_memo(self):
+
+        memo = pycode.LRUCache(4096)
+        code = pycode.PyCodeStruct(memo)
+        struct_class = code.struct(D)
+        self.assertTrue(len(memo) > 0)
+        self.assertEqual(code.struct(D), struct_class)
+        self.assertEqual(pycode.PyCodeStruct(pycode.LRUCache(0)).struct(D), struct_class)
+        struct_class['name'] = 'E'
+        self.assertEqual(code.struct(D)['name'], 'D')
+
+    def test_lru_cache(self):
+
+        memo = pycode.LRUCache(2)
+        memo.put('a', 1)
+        memo.put('b', 2)
+        self.assertEqual(memo.get('a'), 1)
+        memo.put('c', 3)
+        self.assertEqual(memo.get('b'), None)
+        self.assertEqual((memo.get('a'), memo.get('c'), len(memo)), (1, 3, 2))
+
+    def test_string_table(self):
+
+        table = pycode.StringTable()
+        text = ''.join(['Class ', 'D'])
+        self.assertEqual((table.index('Class D'), table.index('x'), table.index(text)), (0, 1, 0))
+        self.assertIs(table.intern(text), table[0])
+        self.assertEqual(len(table), 2)
+
+        strings = pycode.StringTable()
+        struct_class = pycode.PyCodeStruct(pycode.LRUCache(0), strings=strings).struct(D)
+        owners = [attr['belongs_to'] for attr in struct_class['inherited attrs']]
+        self.assertIs(struct_class['bases'][-1], owners[owners.index('__builtin__.object')])
+        self.assertIs(strings.intern('Class D'), struct_class['doc'])
+
+        tree = pycode.parsefile('tests/test_pycodestruct.py')
+        code = pycode.AstCodeStruct(tree, 'tests.test_pycodestruct', strings=strings)
+        node = code.classes['D']
+        self.assertIs(code.struct(node)['doc'], code.struct(node)['doc'])
+        self.assertIs(code.struct(node)['doc'], struct_class['doc'])
+
+    def test_struct_nodes(self):
+
+        node = pycode.ClassNode({'type': 'class', 'name': 'D', 'doc': ''})
+        node.inherited_attrs = []
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertEqual(node, {'type': 'class', 'name': 'D', 'doc': '', 'inherited attrs': []})
+        self.assertNotEqual(node, {'type': 'class', 'name': 'D'})
+        self.assertEqual((len(node), 'decl' in node, node.get('decl'), node['inherited attrs']),
+                            (4, False, None, []))
+        self.assertRaises(KeyError, node.__getitem__, 'decl')
+        self.assertRaises(KeyError, node.__setitem__, 'other', 1)
+        copy = node.copy()
+        del copy['doc']
+        self.assertEqual(sorted(copy), ['inherited attrs', 'name', 'type'])
+        self.assertEqual(node['doc'], '')
+        self.assertEqual(pickle.loads(pickle.dumps(node)), node)
+        self.assertEqual(json.loads(pycode.dumpjson({'struct': [node]})), {'struct': [node]})
+
+        code = pycode.PyCodeStruct()
+        struct_class = code.struct(D)
+        self.assertIsInstance(struct_class, pycode.ClassNode)
+        inherited = dict((attr['name'], attr) for attr in struct_class['inherited attrs'])
+        self.assertIsInstance(inherited['method1'], pycode.RoutineNode)
+        struct_module = code.struct(pycode.locate('json.decoder'))
+        self.assertIsInstance(struct_module, pycode.ModuleNode)
+        self.assertIsInstance(struct_module['data'][-1], (dict, pycode.DataNode))
+
+    def test_source_comments(self):
+
+        lines = ['#!/usr/bin/env python\n', '#\n', '# module\n', '\n',
+                 '  # other\n', '#\n', '# class A\n', '#\n', 'class A:\n',
+                 '    # method\n', '    def f(self): pass\n',
+                 '# not above\n', '\n', '  class A: pass\n']
+        comments = pycode.SourceComments(lines)
+        self.assertEqual(comments.module, '# module\n')
+        self.assertEqual((comments.classline('A'), comments.classline('B')), (8, None))
+        self.assertEqual(comments.codeline(11), 10)
+        self.assertEqual(comments.above(8), '# class A\n')
+        self.assertEqual(comments.above(10), '# method\n')
+        self.assertEqual((comments.above(9), comments.above(12)), (None, None))
+
+        sources = dict()
+        for module in (pycode, json.decoder, pickle):
+            objs = [module] + vars(module).values()
+            objs += [attr for obj in objs if isinstance(obj, type) for attr in vars(obj).values()]
+            for obj in objs:
+                self.assertEqual(pycode.getcomments(obj, sources), inspect.getcomments(obj))
+        self.assertIn(pickle.__file__, sources)
+        self.assertEqual(pycode.getdoc(pycode.StructNode.__getitem__, sources), '')
+
+    def test_struct_lazy(self):
+
+        for engine in ('inspect', 'ast'):
+            result = pycode.struct_code('json.decoder', engine, lazy=True)
+            struct = result['struct']
+            self.assertFalse(struct.loaded)
+            decoder = struct['classes'][0]
+            self.assertEqual((decoder['name'], decoder.loaded), ('JSONDecoder', False))
+            self.assertIn('decode', [attr['name'] for attr in decoder['class_attrs']])
+            self.assertTrue(decoder.loaded)
+            self.assertEqual(pycode.expandstruct(struct),
+                                pycode.struct_code('json.decoder', engine)['struct'])
+
+    def test_struct_lazy_output(self):
+
+        import StringIO
+
+        expected = json.loads(pycode.dumpjson(pycode.struct_code('json.decoder')))
+        lazy = lambda: pycode.struct_code('json.decoder', lazy=True)
+        self.assertEqual(json.loads(pycode.dumpjson(lazy())), expected)
+        self.assertEqual(pycode.dict2flat('', lazy()), pycode.dict2flat('', expected))
+        output = StringIO.StringIO()
+        pycode.dumpbinary([lazy()], output)
+        self.assertEqual(list(pycode.loadbinary(StringIO.StringIO(output.getvalue()))), [expected])
+
+    def test_profiler(self):
+
+        events = []
+        profiler = pycode.Profiler(lambda *args: events.append(args[:2]))
+        result = pycode.struct_code('json', profiler=profiler)
+        self.assertEqual(result['name'], 'json')
+        self.assertIn('import', profiler.phases)
+        self.assertIn('getdoc', profiler.phases)
+        self.assertIn('json', profiler.objects['module'])
+        self.assertIn('json.decoder.JSONDecoder', profiler.objects['class'])
+        self.assertIn(('module', 'json'), events)
+
+        other = pycode.Profiler()
+        other.merge(profiler.stats())
+        other.merge(profiler.stats())
+        self.assertEqual(other.phases['import'][0], 2 * profiler.phases['import'][0])
+
+    def test_profiler_ast(self):
+
+        profiler = pycode.Profiler()
+        pycode.struct_code('json.decoder', 'ast', profiler=profiler)
+        self.assertIn('parse', profiler.phases)
+        self.assertIn('json.decoder.JSONDecoder', profiler.objects['class'])
+
     def test_struct_module_os(self):
         
         os_module = pycode.locate('os')
@@ -92,6 +235,14 @@ class PyCodeStructTests(unittest.TestCase):
         self.assertEqual(struct_os['doc_location'], 'http://docs.python.org/library/os')
         #pprint.pprint(struct_os)
 
+    def test_struct_module_package(self):
+
+        tests_module = pycode.locate('tests')
+        code = pycode.PyCodeStruct()
+        struct_tests = code.struct(tests_module)
+        self.assertIn('test_pycodestruct', struct_tests['modules'])
+        self.assertNotIn('packages', struct_tests)
+
     def test_struct_module_pycode(self):
         
         pycode_module = pycode.locate('pycode')
@@ -0,0 +1,71 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import os
+import time
+import shutil
+import pycode
+import tempfile
+import unittest
+
+
+class StructCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = pycode.StructCache(os.path.join(self.tmpdir, 'cache', 'structs.db'))
+        self.filename = os.path.join(self.tmpdir, 'cached_mod.py')
+        self.write('def f(a):\n    pass\n')
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, source, mtime=None):
+        with open(self.filename, 'w') as file:
+            file.write(source)
+        if mtime:
+            os.utime(self.filename, (mtime, mtime))
+
+    def test_get_put(self):
+
+        self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), None)
+        self.cache.put('cached_mod', 'ast', self.filename, {'name': 'cached_mod'})
+        self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), {'name': 'cached_mod'})
+        self.assertEqual(self.cache.get('cached_mod', 'inspect', self.filename), None)
+
+    def test_touched_file(self):
+
+        self.cache.put('cached_mod', 'ast', self.filename, {'name': 'cached_mod'})
+        self.write('def f(a):\n    pass\n', time.time() + 10)
+        self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), {'name': 'cached_mod'})
+        self.write('def f(b):\n    pass\n', time.time() + 20)
+        self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), None)
+
+    def test_version(self):
+
+        self.cache.put('cached_mod', 'ast', self.filename, {'name': 'cached_mod'})
+        version, pycode.__version__ = pycode.__version__, '0.0'
+        try:
+            self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), None)
+        finally:
+            pycode.__version__ = version
+
+    def test_struct_code(self):
+
+        result = pycode.struct_code(self.filename, 'ast', self.cache)
+        self.assertEqual(result['struct']['funcs'][0]['decl'], 'f(a)')
+        self.write('def f(a, b):\n    pass\n', time.time() + 10)
+        result = pycode.struct_code(self.filename, 'ast', self.cache)
+        self.assertEqual(result['struct']['funcs'][0]['decl'], 'f(a, b)')
+        self.assertEqual(pycode.struct_code(self.filename, 'ast', self.cache), result)
+
+    def test_struct_batch(self):
+
+        results = list(pycode.struct_batch(self.tmpdir, 'ast', 1, cache=self.cache))
+        self.assertEqual([r['name'] for r in results], ['cached_mod'])
+        self.assertEqual(self.cache.get('cached_mod', 'ast', self.filename), results[0])
+
+if __name__ == '__main__':
+    unittest.main()
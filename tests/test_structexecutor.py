@@ -0,0 +1,85 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import Queue
+import pycode
+import threading
+import unittest
+
+
+class StructExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = pycode.StructExecutor(threads=1, maxpending=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit(self):
+
+        done = []
+        future = self.executor.submit('json.decoder', 'ast', depth=0)
+        future.add_done_callback(done.append)
+        result = future.result(10)
+        self.assertEqual((result['name'], result['struct']), ('json.decoder', {}))
+        self.assertEqual(done, [future])
+        self.assertTrue(future.done())
+        self.assertEqual(self.executor.submit('json', 'inspect').result(10)['name'], 'json')
+
+        future = self.executor.submit('no_such_module_zz', 'ast')
+        self.assertRaises(ImportError, future.result, 10)
+        self.assertIsInstance(future.exception(), ImportError)
+
+    def test_cancel_and_backpressure(self):
+
+        # the thread waits in a callback, one more request waits in the queue
+        started, release = threading.Event(), threading.Event()
+        first = self.executor.submit('json.decoder', 'ast')
+        first.add_done_callback(lambda future: (started.set(), release.wait(10)))
+        self.assertTrue(started.wait(10))
+        second = self.executor.submit('json.encoder', 'ast')
+        self.assertRaises(Queue.Full, self.executor.submit, 'json', 'ast', block=False)
+        self.assertRaises(pycode.TimeoutError, second.result, 0.01)
+
+        self.assertTrue(second.cancel())
+        self.assertFalse(first.cancel())
+        release.set()
+        self.assertRaises(pycode.CancelledError, second.result)
+        self.assertTrue(second.cancelled())
+        self.assertEqual(first.result(10)['name'], 'json.decoder')
+
+    def test_batch(self):
+
+        batch = self.executor.batch('tests', 'ast', processes=2, maxpending=1)
+        names = sorted(result['name'] for result in batch)
+        self.assertEqual(names, pycode.findmodules('tests')[1])
+        self.assertEqual(batch.get(), None)
+
+        batch = pycode.StructBatch('tests', 'ast', processes=2, maxpending=1)
+        self.assertIn(batch.get(timeout=10)['name'], names)
+        batch.cancel()
+        self.assertEqual(batch.get(), None)
+
+        batch = pycode.StructBatch('no_such_module_zz', 'ast')
+        self.assertRaises(ImportError, batch.get, timeout=10)
+
+    def test_concurrent(self):
+
+        # threads share the memo of analyzed objects, a small one is
+        # updated and evicted all the time
+        names = ['json', 'json.decoder', 'pickle', 'textwrap', 'tarfile', 'zipfile', 'difflib',
+                 'argparse', 'decimal', 'logging', 'logging.handlers', 'collections', 'Queue',
+                 'threading', 'urllib2', 'httplib', 'socket', 'bdb', 'pdb', 'profile']
+        memo, pycode.STRUCT_MEMO = pycode.STRUCT_MEMO, pycode.LRUCache(64)
+        executor = pycode.StructExecutor(threads=4, maxpending=len(names) * 2)
+        try:
+            futures = [executor.submit(name, 'inspect') for name in names * 2]
+            for name, future in zip(names * 2, futures):
+                self.assertEqual(future.result(60)['name'], name)
+        finally:
+            executor.shutdown()
+            pycode.STRUCT_MEMO = memo
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import os
+import json
+import time
+import shutil
+import socket
+import pycode
+import tempfile
+import StringIO
+import unittest
+import threading
+
+
+class StructServiceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        sys.path.insert(0, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'served_mod.py')
+        self.write('def f(a):\n    pass\n')
+        self.service = pycode.StructService()
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        sys.modules.pop('served_mod', None)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, source, mtime=None):
+        with open(self.filename, 'w') as file:
+            file.write(source)
+        if mtime:
+            os.utime(self.filename, (mtime, mtime))
+
+    def request(self, method, params=None, id=1):
+        request = {'jsonrpc': '2.0', 'id': id, 'method': method}
+        if params is not None:
+            request['params'] = params
+        return self.service.handle(request)
+
+    def test_struct_code(self):
+
+        response = self.request('struct_code', ['served_mod'])
+        self.assertEqual(response['id'], 1)
+        self.assertEqual(response['result']['struct']['funcs'][0]['decl'], 'f(a)')
+        self.assertTrue(self.request('struct_code', ['served_mod'])['result'] is response['result'])
+
+        self.write('def f(a, b):\n    pass\n', time.time() + 10)
+        for engine in ('inspect', 'ast'):
+            response = self.request('struct_code', {'thing': 'served_mod', 'engine': engine})
+            self.assertEqual(response['result']['struct']['funcs'][0]['decl'], 'f(a, b)')
+
+    def test_struct_code_dependency(self):
+
+        base = os.path.join(self.tmpdir, 'served_base.py')
+        with open(base, 'w') as file:
+            file.write('class Base(object):\n    def f(self):\n        pass\n')
+        self.write('from served_base import Base\n\nclass A(Base):\n    pass\n')
+
+        def inherited():
+            result = self.request('struct_code', ['served_mod'])['result']
+            return [attr['name'] for attr in result['struct']['classes'][0]['inherited attrs']
+                        if attr['name'] in ('f', 'g')]
+
+        self.assertEqual(inherited(), ['f'])
+        with open(base, 'w') as file:
+            file.write('class Base(object):\n    def g(self):\n        pass\n')
+        os.utime(base, (time.time() + 10,) * 2)
+        # only the source file of the analyzed module is checked
+        self.assertEqual(inherited(), ['f'])
+        self.assertTrue(self.request('invalidate', [])['result'])
+        self.assertNotIn('served_base', sys.modules)
+        self.assertEqual(inherited(), ['g'])
+        sys.modules.pop('served_base', None)
+
+    def test_struct_code_partial(self):
+
+        self.write('class A(object):\n    def m(self):\n        pass\n\ndef f(a):\n    pass\n')
+        result = self.request('struct_code', {'thing': 'served_mod', 'depth': 1})['result']
+        self.assertEqual(sorted(result['struct']['classes'][0]), ['bases', 'doc', 'name', 'type'])
+        result = self.request('struct_code', {'thing': 'served_mod', 'select': ['funcs.f']})['result']
+        self.assertEqual(result['struct'].keys(), ['funcs'])
+        full = self.request('struct_code', ['served_mod'])['result']
+        self.assertEqual(sorted(full['struct']), ['classes', 'funcs'])
+
+    def test_errors(self):
+
+        self.assertEqual(self.request('unknown')['error']['code'], -32601)
+        self.assertEqual(self.request('struct_code', ['x', 'y', 0, [], 'z'])['error']['code'], -32602)
+        self.assertEqual(self.request('struct_code', ['no_such_mod'])['error']['code'], -32000)
+        self.assertEqual(self.service.handle([])['error']['code'], -32600)
+        self.assertEqual(self.service.handle({'method': 'version'}), None)
+        # no response to notifications, even for errors
+        for request in ({'method': 'unknown'}, {'method': 1}, {'method': 'struct_code'},
+                        {'method': 'struct_code', 'params': ['no_such_mod']}):
+            self.assertEqual(self.service.handle(dict(request, jsonrpc='2.0')), None)
+        self.assertEqual(self.request('unknown', id=None)['error']['code'], -32601)
+        self.assertEqual(self.request('struct_code', 'served_mod')['error']['code'], -32602)
+        self.assertEqual(self.request('struct_code', {'other': 1})['error']['code'], -32602)
+        for params in ({'select': 'funcs.f'}, {'select': [1]}, {'depth': '1'}, {'depth': -1},
+                        {'depth': True}, {'engine': 'other'}, {'thing': 1}):
+            response = self.request('struct_code', dict({'thing': 'served_mod'}, **params))
+            self.assertEqual(response['error']['code'], -32602)
+        # errors of the analysis, of any type, do not stop the service
+        response = self.request('struct_code', ['pycode.LazyStruct.loaded'])
+        self.assertEqual(response['error']['code'], -32000)
+        self.assertEqual(self.request('version')['result'], pycode.__version__)
+
+    def test_serve(self):
+
+        output = StringIO.StringIO()
+        self.service.serve(StringIO.StringIO(
+            '{"jsonrpc": "2.0", "id": 1, "method": "version"}\n\n'
+            'not json\n'
+            '{"jsonrpc": "2.0", "method": "unknown"}\n'
+            '{"jsonrpc": "2.0", "id": 2, "method": "invalidate", "params": ["served_mod"]}\n'), output)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(responses[0], {'jsonrpc': '2.0', 'id': 1, 'result': pycode.__version__})
+        self.assertEqual(responses[1]['error']['code'], -32700)
+        self.assertEqual(responses[2]['result'], True)
+        self.assertEqual(len(responses), 3)
+
+    def test_serve_socket(self):
+
+        path = os.path.join(self.tmpdir, 'pycode.sock')
+        cache = pycode.StructCache(os.path.join(self.tmpdir, 'structs.db'))
+        server = threading.Thread(target=pycode.serve, args=(path, pycode.StructService(cache)))
+        server.daemon = True
+        server.start()
+        for i in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+
+        def request(method, params):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            try:
+                client.sendall(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method,
+                                            'params': params}) + '\n')
+                return json.loads(client.makefile().readline())
+            finally:
+                client.close()
+
+        # handlers run in threads other than the one which opened the cache
+        for i in range(2):
+            response = request('struct_code', ['served_mod', 'ast'])
+            self.assertEqual(response['result']['struct']['funcs'][0]['decl'], 'f(a)')
+            request('invalidate', [])
+        self.assertEqual(cache.get('served_mod', 'ast', self.filename)['name'], 'served_mod')
+
+if __name__ == '__main__':
+    unittest.main()
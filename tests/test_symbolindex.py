@@ -0,0 +1,76 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+
+import pycode
+import unittest
+
+from tests import IndexTestCase
+
+
+class SymbolIndexTests(IndexTestCase):
+
+    indexclass = pycode.SymbolIndex
+
+    def setUp(self):
+        IndexTestCase.setUp(self)
+        for name in ('json', 'json.decoder', 'json.encoder'):
+            self.index.update(pycode.struct_code(name, 'ast'))
+
+    def names(self, symbols):
+        return [symbol['name'] for symbol in symbols]
+
+    def test_codesymbols(self):
+
+        symbols = dict((s[0], s) for s in pycode.codesymbols(pycode.struct_code('json.decoder', 'ast')))
+        self.assertEqual(symbols['json.decoder'],
+                            ('json.decoder', 'module', 'json.decoder', None, 'Implementation of JSONDecoder'))
+        self.assertEqual(symbols['json.decoder.JSONDecoder.decode'][1:4],
+                            ('method', 'json.decoder', 'decode(self, s, _w=WHITESPACE.match)'))
+        self.assertEqual(symbols['json.decoder.__all__'][1], 'data')
+        symbols = list(pycode.codesymbols(pycode.struct_code('json.dumps')))
+        self.assertEqual(symbols[0][:3], ('json.dumps', 'function', 'json'))
+
+    def test_get(self):
+
+        self.assertEqual(self.index.get('json.dumps')['kind'], 'function')
+        self.assertEqual(self.index.get('json.missing'), None)
+
+    def test_prefix(self):
+
+        self.assertEqual(self.names(self.index.prefix('json.decoder.JSONDecoder.')),
+                            ['json.decoder.JSONDecoder.__dict__', 'json.decoder.JSONDecoder.__init__',
+                             'json.decoder.JSONDecoder.__weakref__', 'json.decoder.JSONDecoder.decode',
+                             'json.decoder.JSONDecoder.raw_decode'])
+        self.assertEqual(len(self.index.prefix('json', limit=3)), 3)
+
+    def test_substring(self):
+
+        for trigrams in (True, False):
+            self.index.trigrams = trigrams
+            self.assertEqual(self.names(self.index.substring('w_deCODE')),
+                                ['json.decoder.JSONDecoder.raw_decode'])
+            self.assertEqual(self.names(self.index.substring('JSONDecoder_')), [])
+            self.assertEqual(self.names(self.index.substring('r.JSONEnc', 1)), ['json.encoder.JSONEncoder'])
+
+    def test_fuzzy(self):
+
+        names = self.names(self.index.fuzzy('jdecraw'))
+        self.assertEqual(names, ['json.decoder.JSONDecoder.raw_decode'])
+        names = self.names(self.index.fuzzy('dumps'))
+        self.assertEqual(names[0], 'json.dumps')
+        self.assertEqual(pycode.fuzzyscore('json.dumps', 'jdm'), (8, 10))
+
+    def test_update(self):
+
+        self.index.update(pycode.struct_code('json.decoder.JSONDecoder', 'ast'))
+        self.assertEqual(self.index.get('json.decoder.JSONDecoder')['kind'], 'class')
+        self.assertEqual(self.index.get('json.decoder.__all__')['kind'], 'data')
+        self.index.update({'name': 'json.decoder', 'type': 'module', 'module_name': 'json.decoder',
+                            'module_doc': None, 'struct': {}})
+        self.assertEqual(self.names(self.index.prefix('json.decoder')), ['json.decoder'])
+        self.assertEqual(self.names(self.index.substring('JSONDecoder.raw')), [])
+        self.assertEqual(self.names(self.index.substring('JSONEncoder'))[0], 'json.encoder.JSONEncoder')
+
+if __name__ == '__main__':
+    unittest.main()
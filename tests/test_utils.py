@@ -2,10 +2,22 @@ import sys
 if '' not in sys.path:
     sys.path.append('')
 
+import os
+import json
+import time
 import types
 import pycode
 import pprint
+import shutil
+import tarfile
+import zipfile
+import StringIO
+import tempfile
 import unittest
+import subprocess
+
+# seconds, the command line is run for each changed file by editor hooks
+STARTUP_BUDGET = 0.1
 
 
 class PyCodeUtilsTests(unittest.TestCase):
@@ -69,6 +81,337 @@ class PyCodeUtilsTests(unittest.TestCase):
         self.assertEqual(pycode.describe(f1),('function', 'f1'))
 
         
+    def test_findmodules(self):
+
+        basedir, names = pycode.findmodules('tests')
+        self.assertEqual(basedir, os.path.abspath('.'))
+        self.assertEqual(names[0], 'tests')
+        self.assertIn('tests.test_utils', names)
+        self.assertEqual(pycode.findmodules('tests/test_utils.py')[1], ['test_utils'])
+        self.assertEqual(pycode.findmodules('json')[1][:2], ['json', 'json.decoder'])
+        self.assertRaises(ImportError, pycode.findmodules, 'sys')
+
+    def test_struct_batch(self):
+
+        results = list(pycode.struct_batch('tests', engine='ast', processes=2))
+        self.assertEqual(sorted(r['name'] for r in results), pycode.findmodules('tests')[1])
+        for result in results:
+            self.assertNotIn('error', result)
+
+    def test_struct_archive(self):
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            wheel = os.path.join(tmpdir, 'pkg-1.0-py2-none-any.whl')
+            archive = zipfile.ZipFile(wheel, 'w')
+            archive.writestr('pkg/__init__.py', '"""Package"""\r\n')
+            archive.writestr('pkg/sub/__init__.py', '')
+            archive.writestr('pkg/sub/mod.py', 'class A(object):\n    def f(self):\n        g()\n')
+            archive.writestr('pkg/broken.py', 'def (')
+            archive.writestr('pkg-1.0.dist-info/METADATA', 'Name: pkg')
+            archive.close()
+            sdist = os.path.join(tmpdir, 'pkg-1.0.tar.gz')
+            archive = tarfile.open(sdist, 'w:gz')
+            archive.add('tests', 'pkg-1.0/tests')
+            archive.add('pycode.py', 'pkg-1.0/pycode.py')
+            archive.close()
+
+            self.assertEqual([(name, member) for name, member, source in pycode.archivesources(wheel)],
+                                [('pkg', 'pkg/__init__.py'), ('pkg.broken', 'pkg/broken.py'),
+                                 ('pkg.sub', 'pkg/sub/__init__.py'), ('pkg.sub.mod', 'pkg/sub/mod.py')])
+            archived = pycode.struct_archive(wheel, refs=True, locations=True)
+            results = dict((r['name'], r) for r in archived)
+            self.assertEqual(results['pkg']['module_doc'], 'Package')
+            self.assertEqual(results['pkg']['type'], 'package')
+            self.assertIn('error', results['pkg.broken'])
+            module = results['pkg.sub.mod']
+            self.assertEqual(module['file'], os.path.join(wheel, 'pkg/sub/mod.py'))
+            self.assertEqual(module['locations']['pkg.sub.mod.A.f'], [2, 4, 3, 11])
+            self.assertEqual(module['refs']['pkg.sub.mod.A.f'], {'calls': ['g'], 'names': []})
+
+            expected = dict((r['name'], r) for r in pycode.struct_batch('tests', 'ast'))
+            expected['pycode'] = pycode.struct_code('pycode.py', 'ast')
+            results = list(pycode.struct_archives([sdist, wheel, __file__], processes=2))
+            self.assertEqual(len(results), len(expected) + 5)
+            for result in results:
+                if result['name'] in expected:
+                    self.assertEqual(result['struct'], expected[result['name']]['struct'])
+            self.assertIn(__file__, [r['name'] for r in results if 'error' in r])
+            self.assertTrue(pycode.isarchive(sdist))
+            self.assertFalse(pycode.isarchive(__file__))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_sandboxpool(self):
+
+        def run(task):
+            if task == 'sleep':
+                time.sleep(10)
+            elif task == 'exit':
+                os._exit(3)
+            elif task == 'alloc':
+                data = ' ' * (256 * 1024 * 1024)
+                time.sleep(10)
+            return task, os.getpid()
+
+        pool = pycode.SandboxPool(run, 2, maxtasks=2, timeout=1, memlimit=128 * 1024 * 1024)
+        results = dict((task, (value, error)) for task, value, error in
+                        pool.imap_unordered(['sleep', 'exit', 'alloc', 'a', 'b', 'c', 'd']))
+        self.assertEqual(results['sleep'], (None, 'timed out after 1 seconds'))
+        self.assertEqual(results['exit'], (None, 'worker exited with code 3'))
+        self.assertEqual(results['alloc'], (None, 'resident memory over 134217728 bytes'))
+        pids = [results[task][0][1] for task in 'abcd']
+        self.assertTrue(len(set(pids)) >= 2)
+        self.assertEqual(pool.workers, [])
+
+        results = list(pycode.struct_batch('tests', engine='ast', processes=2, timeout=30))
+        self.assertEqual(sorted(r['name'] for r in results), pycode.findmodules('tests')[1])
+
+    def test_struct_records(self):
+
+        for thing, engine in (('tests.test_pycodestruct', 'ast'),
+                              ('tests.test_pycodestruct.B', 'ast'), ('json', 'inspect')):
+            records = list(pycode.struct_records(thing, engine))
+            self.assertEqual(records[0]['record'], 'code')
+            result = pycode.struct_code(thing, engine)
+            self.assertEqual(list(pycode.loadrecords(records)), [result])
+            self.assertEqual(list(pycode.loadrecords(pycode.coderecords(result))), [result])
+
+    def test_dumprecords(self):
+
+        output = StringIO.StringIO()
+        results = [pycode.struct_code(name, 'ast') for name in ('tests', 'tests.test_utils')]
+        for result in results:
+            pycode.dumprecords(pycode.coderecords(result), output)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(len(lines) > 2)
+        self.assertEqual(list(pycode.loadrecords(lines)), results)
+
+    def test_dict2flat(self):
+
+        source = {'name': 'm', 'doc': '', 'data': [], 'file': None,
+                    'classes': [{'name': 'A', 'bases': ['object']}],
+                    'nested': {'a': {'b': 1}}}
+        self.assertEqual(pycode.dict2flat('', source), {
+            'name': 'm', 'doc': '', 'data': [], 'classes[0].name': 'A',
+            'classes[0].bases': ['object'], 'nested.a.b': 1})
+        self.assertEqual(pycode.dict2flat('r', source, removeEmptyFields=True), {
+            'r.name': 'm', 'r.classes[0].name': 'A',
+            'r.classes[0].bases': ['object'], 'r.nested.a.b': 1})
+
+        items = []
+        pycode.dict2flat('', source, sink=lambda *item: items.append(item))
+        self.assertEqual(dict(items), pycode.dict2flat('', source))
+
+    def test_dict2flat_deep(self):
+
+        source = value = {}
+        for i in range(sys.getrecursionlimit() * 2):
+            value['n'] = value = {}
+        value['n'] = 1
+        flat = pycode.dict2flat('', source)
+        self.assertEqual(flat.values(), [1])
+
+    def test_expandstruct(self):
+
+        struct = {'doc': '', 'classes': [
+                    {'name': 'A', 'type': 'class', 'class_attrs': [
+                        {'name': 'f', 'type': 'method'}, {'x': 1, 'belongs_to': 'm.A'}]},
+                    {'name': 'B', 'type': 'class', 'class_attrs': []}],
+                  'data': [{'y': 2}]}
+        self.assertEqual(pycode.expandstruct(struct), struct)
+        self.assertEqual(pycode.expandstruct(struct, 0), {'doc': ''})
+        self.assertEqual(pycode.expandstruct(struct, 1), {'doc': '', 'data': [{'y': 2}],
+                            'classes': [{'name': 'A', 'type': 'class'}, {'name': 'B', 'type': 'class'}]})
+        self.assertEqual(pycode.expandstruct(struct, select=['classes.A.class_attrs.x', 'data']),
+                            {'doc': '', 'data': [{'y': 2}], 'classes': [{'name': 'A', 'type': 'class',
+                                'class_attrs': [{'x': 1, 'belongs_to': 'm.A'}]}]})
+
+        loads = []
+        def loader():
+            loads.append(1)
+            return {'classes': struct['classes']}
+        lazy = pycode.LazyStruct({'doc': ''}, ('classes', 'funcs', 'data'), loader)
+        self.assertEqual(pycode.expandstruct(lazy, 0), {'doc': ''})
+        self.assertEqual(loads, [])
+        self.assertEqual(pycode.expandstruct(lazy, select=['classes.B']),
+                            {'doc': '', 'classes': [struct['classes'][1]]})
+        self.assertEqual((loads, 'data' in lazy, dict(lazy)), ([1], False,
+                            {'doc': '', 'classes': struct['classes']}))
+
+    def test_dumpbinary(self):
+
+        attr = {'name': 'f', 'type': 'method', 'doc': u'd\xe9f'}
+        results = [
+            {'name': 'a', 'struct': {'classes': [{'class_attrs': [attr]}, {'class_attrs': [attr]}]}},
+            {'name': 'b', 'struct': {'data': [{'x': -1}, {'y': 0}, {'z': 2 ** 70}, {'w': 1.5}],
+                                    'flags': [None, False, True], 'keys': {1: 'a'}}},
+        ]
+        output = StringIO.StringIO()
+        pycode.dumpbinary(results, output)
+        data = output.getvalue()
+        self.assertTrue(data.startswith(pycode.BINARY_MAGIC))
+        self.assertEqual(data.count('d\xc3\xa9f'), 1)
+        self.assertEqual(list(pycode.loadbinary(StringIO.StringIO(data))),
+                            json.loads(json.dumps(results)))
+        self.assertTrue(len(data) < len(json.dumps(results)))
+
+        self.assertRaises(ValueError, pycode.loadbinary, StringIO.StringIO('{}'))
+        self.assertRaises(ValueError, list, pycode.loadbinary(StringIO.StringIO(data[:-1])))
+        self.assertRaises(TypeError, pycode.dumpbinary, [{'x': object()}], StringIO.StringIO())
+
+    def test_sharestrings(self):
+
+        attr = {'name': 'f', 'type': 'method', 'doc': 'f doc', 'belongs_to': 'm.A'}
+        results = [
+            {'name': 'a', 'struct': {'name': 'A', 'type': 'class', 'doc': 'A doc',
+                        'bases': ['object'], 'class_attrs': [attr, {'doc': 'x', 'belongs_to': 'm.A'}]}},
+            {'name': 'b', 'struct': {'name': 'B', 'type': 'class', 'doc': 'f doc',
+                        'bases': ['m.A', 'object'], 'inherited attrs': [attr]}},
+        ]
+        table, strings = pycode.StringTable(), []
+        shared = [pycode.sharestrings(result, table) for result in results]
+        self.assertEqual(sorted(shared[0]['strings']), ['A doc', 'f doc', 'm.A', 'object'])
+        self.assertEqual(shared[1]['strings'], [])
+        doc, cls = table.index('f doc'), table.index('m.A')
+        self.assertEqual(shared[1]['struct'], {'name': 'B', 'type': 'class', 'doc': doc,
+                            'bases': [cls, table.index('object')], 'inherited attrs': [
+                                {'name': 'f', 'type': 'method', 'doc': doc, 'belongs_to': cls}]})
+        self.assertEqual(shared[0]['struct']['class_attrs'][1], {'doc': 'x', 'belongs_to': 'm.A'})
+        self.assertEqual([pycode.expandstrings(result, strings) for result in shared], results)
+        self.assertEqual(strings, table.texts)
+
+    def test_diffstruct(self):
+
+        def module(classes, data=()):
+            return {'name': 'm', 'type': 'module', 'module_doc': 'M',
+                    'struct': {'classes': classes, 'data': list(data)}}
+
+        f = {'name': 'f', 'type': 'method', 'decl': 'f(self)', 'doc': ''}
+        old = module([{'name': 'A', 'type': 'class', 'doc': 'A', 'bases': ['object'],
+                        'class_attrs': [f, {'x': 1, 'belongs_to': 'A'}]}], [{'X': 1}])
+        new = module([{'name': 'A', 'type': 'class', 'doc': 'A', 'bases': ['B', 'object'],
+                        'class_attrs': [dict(f, decl='f(self, y)')]},
+                      {'name': 'B', 'type': 'class', 'doc': 'B', 'bases': ['object']}], [{'X': 2}])
+        self.assertEqual(list(pycode.diffstruct(old, old)), [])
+        self.assertEqual(list(pycode.diffstruct(old, new)), [
+            {'name': 'm.A', 'type': 'class', 'change': 'changed',
+                'bases': [['object'], ['B', 'object']]},
+            {'name': 'm.A.f', 'type': 'method', 'change': 'changed',
+                'decl': ['f(self)', 'f(self, y)']},
+            {'name': 'm.B', 'type': 'class', 'change': 'added'},
+            {'name': 'm.A.x', 'type': 'data', 'change': 'removed'}])
+
+        error = {'name': 'n', 'error': 'problem in n'}
+        changes = list(pycode.diffdumps([old, error], [{'name': 'o', 'type': 'function',
+                                            'struct': {'decl': 'o()', 'doc': ''}}, error]))
+        self.assertEqual(changes, [
+            {'name': 'o', 'type': 'function', 'change': 'added'},
+            {'name': 'n', 'change': 'error', 'error': 'problem in n'}] +
+            [{'name': name, 'type': kind, 'change': 'removed'} for name, kind in
+                [('m', 'module'), ('m.A', 'class'), ('m.A.f', 'method'),
+                 ('m.A.x', 'data'), ('m.X', 'data')]])
+        # each error once, of the old snapshot if only it has one
+        changes = list(pycode.diffdumps([error, dict(error, name='p')], [dict(error, error='new')]))
+        self.assertEqual(changes, [{'name': 'n', 'change': 'error', 'error': 'new'},
+                                   {'name': 'p', 'change': 'error', 'error': 'problem in n'}])
+        changes = list(pycode.diffdumps([dict(error, name='m')], [module([])]))
+        self.assertEqual(changes, [{'name': 'm', 'change': 'error', 'error': 'problem in n'}])
+
+    def test_loadresults(self):
+
+        results = [pycode.struct_code(name, 'ast') for name in ('tests', 'tests.test_utils')]
+        documents = StringIO.StringIO(''.join(pycode.dumpjson(r) + '\n' for r in results))
+        records = StringIO.StringIO()
+        table = pycode.StringTable()
+        for result in results:
+            pycode.dumprecords(pycode.coderecords(pycode.sharestrings(result, table)), records)
+        binary = StringIO.StringIO()
+        pycode.dumpbinary(results, binary)
+        expected = json.loads(pycode.dumpjson(results))
+        for file in (documents, records, binary):
+            file.seek(0)
+            self.assertEqual(list(pycode.loadresults(file)), expected)
+        self.assertEqual(list(pycode.loadresults(StringIO.StringIO('\n'))), [])
+
+    def test_dump(self):
+
+        results = [pycode.struct_code(name, 'ast') for name in ('tests', 'tests.test_utils')]
+        results.append({'name': 'broken', 'error': u'\xe9', 'values': [1.5, -3, None, True]})
+        expected = json.loads(pycode.dumpjson(results))
+        with tempfile.TemporaryFile() as file:
+            writer = pycode.DumpWriter(file)
+            for result in results:
+                writer.write(result)
+            writer.finish()
+            reader = pycode.DumpReader(file)
+            self.assertEqual(reader.get('tests.test_utils'), expected[1])
+            self.assertEqual(reader.get(u'broken'), expected[2])
+            self.assertEqual(reader.get('tests.test_utils.PyCodeUtilsTests.test_dump')['name'], 'test_dump')
+            self.assertEqual(reader.get('tests.test_utils.missing'), None)
+            self.assertIn('tests.test_utils.PyCodeUtilsTests', reader)
+            self.assertEqual(list(reader.names('tests.test_utils.PyCodeUtilsTests.test_d')),
+                                ['tests.test_utils.PyCodeUtilsTests.test_describe_builtin',
+                                 'tests.test_utils.PyCodeUtilsTests.test_describe_class',
+                                 'tests.test_utils.PyCodeUtilsTests.test_describe_function',
+                                 'tests.test_utils.PyCodeUtilsTests.test_describe_package',
+                                 'tests.test_utils.PyCodeUtilsTests.test_describe_simple',
+                                 'tests.test_utils.PyCodeUtilsTests.test_dict2flat',
+                                 'tests.test_utils.PyCodeUtilsTests.test_dict2flat_deep',
+                                 'tests.test_utils.PyCodeUtilsTests.test_diffstruct',
+                                 'tests.test_utils.PyCodeUtilsTests.test_dump',
+                                 'tests.test_utils.PyCodeUtilsTests.test_dumpbinary',
+                                 'tests.test_utils.PyCodeUtilsTests.test_dumprecords'])
+            decl = reader.get('tests.test_utils.PyCodeUtilsTests.test_dump', raw=True)['decl']
+            self.assertIsInstance(decl, buffer)
+            self.assertEqual(str(decl), 'test_dump(self)')
+            self.assertEqual(list(reader.results()), expected)
+            file.seek(0)
+            self.assertEqual(list(pycode.loadresults(file)), expected)
+        # a memoized node under two names, e.g. a function and its alias in a class
+        func = {'name': 'f', 'type': 'function', 'decl': 'f()', 'doc': ''}
+        result = {'name': 'm', 'type': 'module', 'struct': {'funcs': [func],
+                    'classes': [{'name': 'A', 'type': 'class', 'class_attrs': [func]}]}}
+        with tempfile.TemporaryFile() as file:
+            writer = pycode.DumpWriter(file)
+            writer.write(result)
+            writer.finish()
+            reader = pycode.DumpReader(file)
+            self.assertEqual((reader.get('m.f'), reader.get('m.A.f')), (func, func))
+        with tempfile.TemporaryFile() as file:
+            pycode.dumpbinary(results, file)
+            self.assertRaises(ValueError, pycode.DumpReader, file)
+
+    def test_startup(self):
+
+        # modules imported only when they are used
+        script = 'import sys, pycode; print sorted(set(sys.argv[1:]) & set(sys.modules))'
+        heavy = ['inspect', 'json', 'pprint', 'pkgutil', 'multiprocessing', 'sqlite3']
+        output = subprocess.check_output([sys.executable, '-c', script] + heavy)
+        self.assertEqual(output.strip(), '[]')
+        # nor to print the usage
+        script = ('import sys, pycode; heavy, sys.argv = sys.argv[1:], ["pycode", "--help"]; '
+                  'pycode.cli(); print >>sys.stderr, sorted(set(heavy) & set(sys.modules))')
+        process = subprocess.Popen([sys.executable, '-c', script] + heavy,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+        self.assertEqual((process.returncode, errors.strip()), (0, '[]'))
+        self.assertIn('--diff', output)
+
+        def best(*args):
+            timings = []
+            with open(os.devnull, 'w') as devnull:
+                for i in range(5):
+                    start = time.time()
+                    self.assertEqual(subprocess.call([sys.executable] + list(args),
+                                                        stdout=devnull), 0)
+                    timings.append(time.time() - start)
+            return min(timings)
+
+        # time of printing the usage above the startup of the interpreter
+        startup = best(os.path.join('bin', 'pycode'), '--help') - best('-c', 'pass')
+        self.assertLess(startup, STARTUP_BUDGET)
+
     def test_struct_code_dir(self):
         
         #pprint.pprint(pycode.struct_code('dir'))